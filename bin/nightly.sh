@@ -4,11 +4,25 @@ set -e
 
 if [ -z "$READ_ONLY" ]
 then
-    $(dirname "$0")/s3imagecheck.py
+    # The image checker's manifest, which lets it skip the images that
+    # have not changed since its last run, is kept on S3 between runs.
+    source $(dirname "$0")/s3-init.sh
+    MANIFEST=$(mktemp)
+    s3cmd get --force s3://newfs/s3imagecheck-manifest.json $MANIFEST \
+        || echo 'No image check manifest yet - checking every image'
+    $(dirname "$0")/s3imagecheck.py --manifest $MANIFEST
+    s3cmd put $MANIFEST s3://newfs/s3imagecheck-manifest.json
+    rm $MANIFEST
+
     $(dirname "$0")/s3imagescan.sh
+
+    # Re-render the distribution maps whose records have changed, which
+    # the map views then redirect to instead of drawing them live.
+    python "$(dirname "$0")/../gobotany/manage.py" prerender_maps \
+        --changed-only
 else
     echo
-    echo '$READ_ONLY is set - skipping S3 scanning and thumbnailing'
+    echo '$READ_ONLY is set - skipping S3 scanning, thumbnailing, and maps'
     echo
 fi
 #$(dirname "$0")/load images
@@ -1,9 +1,14 @@
 """Perform bulk inserts and updates."""
 
+import io
 import logging
 from collections import defaultdict
 log = logging.getLogger('bulkup')
 
+COPY_ROWS = 50000  # rows sent to the database per COPY statement
+FETCH_ROWS = 10000  # old rows read from the database at a time
+MISSING = object()  # the value of a column that a row has not been given
+
 class Database(object):
     def __init__(self, connection):
         self.connection = connection
@@ -43,15 +48,24 @@ class Database(object):
         return t
 
 class Table(object):
+    """The rows we want a table to contain, indexed by their key columns.
+
+    To keep big tables small in memory, each row is stored as a plain
+    list of values, in the order of our `columns`; the `Row` objects
+    handed out by `get()` are only light views onto those lists.
+
+    """
     def __init__(self, database, name):
         self.database = database
         self.name = name
         self.rowdict = {}
+        self.columns = []
+        self.columnindex = {}
         self.keycolumns = None
         self.keycolumnset = None
 
     def __iter__(self):
-        return iter(self.rowdict.values())
+        return (Row(self, values) for values in self.rowdict.values())
 
     def get(self, **kw):
         keycolumns = list(kw)
@@ -65,67 +79,199 @@ class Table(object):
                 ' by the key {1} instead of the key {2}'.format
                 (self.name, ','.join(self.keycolumns), ','.join(keycolumns)))
         key = tuple(kw[name] for name in self.keycolumns)
-        row = self.rowdict.get(key)
-        if row is None:
-            row = Row(kw)
-            self.rowdict[key] = row
-        return row
+        values = self.rowdict.get(key)
+        if values is None:
+            values = self.rowdict[key] = []
+            self.setvalues(values, kw)
+        return Row(self, values)
+
+    def setvalues(self, values, kw):
+        """Store the column values in `kw` into a row's list of values."""
+        columnindex = self.columnindex
+        for name, value in kw.items():
+            i = columnindex.get(name)
+            if i is None:
+                i = columnindex[name] = len(self.columns)
+                self.columns.append(name)
+            if i >= len(values):
+                values.extend([MISSING] * (i + 1 - len(values)))
+            values[i] = value
+
+    def items(self, values):
+        """Return the (column, value) pairs that a row has been given."""
+        return [(column, value) for column, value
+                in zip(self.columns, values) if value is not MISSING]
 
     def replace(self, attr, mapping):
         """Set ``row.attr`` to the value ``mapping[row.attr]`` for each row."""
-        for row in self.rowdict.values():
-            d = row.__dict__
-            d[attr] = mapping[d[attr]]
+        i = self.columnindex.get(attr)
+        for values in self.rowdict.values():
+            if i is None or i >= len(values):
+                raise KeyError(attr)
+            values[i] = mapping[values[i]]
 
         # If rows are indexed by the changed column, then rebuild our index.
 
         if self.rowdict and (attr in self.keycolumnset):
+            keyindexes = [self.columnindex[name] for name in self.keycolumns]
             rows = iter(self.rowdict.values())
             rowdict = self.rowdict = {}
-            for row in rows:
-                d = row.__dict__
-                key = tuple(d[name] for name in self.keycolumns)
-                rowdict[key] = row
+            for values in rows:
+                key = tuple(values[i] for i in keyindexes)
+                rowdict[key] = values
 
     def save(self, delete_old=False):
         if not self.rowdict:
             return
+        columns = self.uniform_columns()
+        if columns is not None and db_type(self.database.connection) in (
+                'postgresql', 'postgresql_psycopg2'):
+            self.save_by_copy(columns, delete_old)
+        else:
+            self.save_by_statements(delete_old)
+
+    def uniform_columns(self):
+        """Return the columns of our rows, or None if they differ by row."""
+        width = len(self.columns)
+        for values in self.rowdict.values():
+            if len(values) != width or MISSING in values:
+                return None
+        return list(self.columns)
+
+    def save_by_statements(self, delete_old):
+        """Save our rows by comparing them with the table's old rows.
+
+        The old rows are streamed from a server-side cursor, where the
+        database has one, and each difference is queued in a `Batch` as
+        soon as it is found, so the old table never sits in memory.
+
+        """
+        connection = self.database.connection
+        with connection.chunked_cursor() as reader:
+            reader.execute('SELECT * FROM {0}'.format(self.name))
+            columndict = dict((co[0], i)
+                              for (i, co) in enumerate(reader.description))
+            keycolumnids = [columndict[cn] for cn in self.keycolumns]
+            seen = set()
+            with Batch(connection.cursor(), self) as batch:
+                for old in fetch_rows(reader, connection):
+                    key = tuple(old[i] for i in keycolumnids)
+                    values = self.rowdict.get(key)
+                    if values is None or key in seen:
+                        if delete_old:
+                            batch.delete(self.keycolumns, key)
+                        continue
+                    seen.add(key)
+                    writeables = [(cn, value) for cn, value
+                                  in self.items(values)
+                                  if cn not in self.keycolumnset]
+                    for columnname, columnvalue in writeables:
+                        if old[columndict[columnname]] != columnvalue:
+                            batch.update(writeables, self.keycolumns, key)
+                            break
+                for key, values in self.rowdict.items():
+                    if key not in seen:
+                        batch.insert(self.items(values))
+
+    def save_by_copy(self, columns, delete_old):
+        """Save our rows with PostgreSQL's COPY, merging them server-side.
+
+        Instead of reading the whole table into Python to compare it
+        with our rows, we COPY our rows into a temporary table and let
+        the database apply the differences with three statements.  Rows
+        are matched on their key columns, where a NULL matches a NULL,
+        as it does when `save_by_statements()` compares keys in Python.
+        Only the key columns that hold a NULL in some row are compared
+        with IS NOT DISTINCT FROM, since PostgreSQL cannot hash-join on
+        it, and plain equality already matches every other row.
+
+        """
         c = self.database.connection.cursor()
-        c.execute('SELECT * FROM {0}'.format(self.name))
-        columndict = dict((co[0], i) for (i, co) in enumerate(c.description))
-        keycolumnids = [columndict[cn] for cn in self.keycolumns]
-        inserts = dict(self.rowdict)
-        deletes = []
-        with Batch(c, self) as batch:
-            for old in c.fetchall():
-                key = tuple(old[i] for i in keycolumnids)
-                row = inserts.pop(key, None)
-                if row is None:
-                    if delete_old:
-                        deletes.append(key)
-                    continue
-                writeables = set(row.__dict__.keys()) - self.keycolumnset
-                for columnname in writeables:
-                    columnno = columndict[columnname]
-                    columnvalue = row.__dict__[columnname]
-                    if old[columnno] != columnvalue:
-                        batch.update(row, writeables, self.keycolumns, key)
-                        break
-            for row in list(inserts.values()):
-                batch.insert(row)
-            for key in deletes:
-                batch.delete(self.keycolumns, key)
+        temp = 'bulkup_' + self.name
+        names = column_names(columns)
+        writeables = [cn for cn in columns if cn not in self.keycolumnset]
+        nullable = set()
+        for i, cn in enumerate(self.keycolumns):
+            if any(key[i] is None for key in self.rowdict):
+                nullable.add(cn)
+        match = ' AND '.join(
+            't."{0}" {1} s."{0}"'.format(
+                cn, 'IS NOT DISTINCT FROM' if cn in nullable else '=')
+            for cn in self.keycolumns)
+
+        c.execute('DROP TABLE IF EXISTS {0}'.format(temp))
+        c.execute('CREATE TEMPORARY TABLE {0} AS SELECT {1} FROM {2}'
+                  ' WITH NO DATA'.format(temp, names, self.name))
+        rows = list(self.rowdict.values())
+        for i in range(0, len(rows), COPY_ROWS):
+            c.copy_expert(
+                'COPY {0} ({1}) FROM STDIN WITH (FORMAT csv)'.format(
+                    temp, names),
+                copy_text(rows[i:i + COPY_ROWS]))
+
+        updates = 0
+        if writeables:
+            c.execute(
+                'UPDATE {0} t SET {1} FROM {2} s WHERE {3}'
+                ' AND ({4}) IS DISTINCT FROM ({5})'.format(
+                    self.name,
+                    ', '.join('"{0}" = s."{0}"'.format(cn)
+                              for cn in writeables),
+                    temp, match,
+                    ', '.join('t."{0}"'.format(cn) for cn in writeables),
+                    ', '.join('s."{0}"'.format(cn) for cn in writeables)))
+            updates = c.rowcount
+        c.execute(
+            'INSERT INTO {0} ({1}) SELECT {1} FROM {2} s WHERE NOT EXISTS'
+            ' (SELECT 1 FROM {0} t WHERE {3})'.format(
+                self.name, names, temp, match))
+        inserts = c.rowcount
+        deletes = 0
+        if delete_old:
+            c.execute(
+                'DELETE FROM {0} t WHERE NOT EXISTS'
+                ' (SELECT 1 FROM {1} s WHERE {2})'.format(
+                    self.name, temp, match))
+            deletes = c.rowcount
+        c.execute('DROP TABLE {0}'.format(temp))
+
+        if deletes:
+            log.info('%s: %s inserts, %s updates, and %s deletes (COPY)',
+                     self.name, inserts, updates, deletes)
+        else:
+            log.info('%s: %s inserts and %s updates (COPY)',
+                     self.name, inserts, updates)
 
 class Row(object):
-    def __init__(self, identity):
-        self.__dict__.update(identity)
+    """A view of one row of a `Table`."""
+    __slots__ = ('table', 'values')
+
+    def __init__(self, table, values):
+        self.table = table
+        self.values = values
+
+    def __getattr__(self, name):
+        value = self.get(name, MISSING)
+        if value is MISSING:
+            raise AttributeError(name)
+        return value
+
+    def __setattr__(self, name, value):
+        if name in Row.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            self.table.setvalues(self.values, {name: value})
 
     def set(self, **kw):
-        self.__dict__.update(kw)
+        self.table.setvalues(self.values, kw)
         return self
 
-    def get(self, field):
-        self.__dict__.get(field, None)
+    def get(self, field, default=None):
+        i = self.table.columnindex.get(field)
+        if i is None or i >= len(self.values):
+            return default
+        value = self.values[i]
+        return default if value is MISSING else value
 
 class Batch(object):
     def __init__(self, cursor, table, maxlen=10000):
@@ -150,22 +296,22 @@ class Batch(object):
             log.info('%s: %s inserts and %s updates',
                      self.table.name, self.inserts, self.updates)
 
-    def insert(self, row):
+    def insert(self, items):
         self.inserts += 1
-        columns = list(row.__dict__.keys())
-        values = list(row.__dict__.values())
+        columns = [column for column, value in items]
+        values = [value for column, value in items]
         self.do('INSERT INTO {0} ({1}) VALUES ({2});'
                 .format(self.table.name, column_names(columns),
                         ','.join(['%s'] * len(columns))),
                 values)
 
-    def update(self, row, writeables, keycolumns, key):
+    def update(self, writeables, keycolumns, key):
         self.updates += 1
-        values = [ row.__dict__[k] for k in writeables ]
+        values = [ value for column, value in writeables ]
         values.extend(key)
         self.do('UPDATE {0} SET {1} WHERE {2};'.format(
                 self.table.name,
-                ','.join(s + '= %s' for s in writeables),
+                ','.join(s + '= %s' for s, value in writeables),
                 ' AND '.join(s + ' = %s' for s in keycolumns),
                 ), values)
 
@@ -190,11 +336,8 @@ class Batch(object):
         args = self.args
         self.text = ''
         self.args = []
-        db_module = self.table.database.connection.settings_dict['ENGINE']
-        db_type = db_module.split('.')[3]
-
         if text:
-            if db_type == 'sqlite3':
+            if db_type(self.table.database.connection) == 'sqlite3':
                 self._flush_sqlite(text, args)
             else:
                 self.cursor.execute(text, args)
@@ -214,3 +357,41 @@ class Batch(object):
 
 def column_names(column_name_list):
     return ','.join('"{}"'.format(name) for name in column_name_list)
+
+def db_type(connection):
+    """Return the name of the Django database backend, like "sqlite3"."""
+    return connection.settings_dict['ENGINE'].split('.')[3]
+
+def fetch_rows(cursor, connection):
+    """Yield the rows of a query, a batch at a time."""
+    if db_type(connection) == 'sqlite3':
+        # SQLite cannot promise what a scan returns once the table it
+        # reads starts changing, so read everything before any writes.
+        yield from cursor.fetchall()
+        return
+    while True:
+        rows = cursor.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        yield from rows
+
+def copy_text(rows):
+    """Return a file of `rows` in the CSV format that COPY reads.
+
+    Every value but a number is quoted, so that an empty string stays
+    distinct from NULL, which COPY reads from an empty unquoted field.
+
+    """
+    f = io.StringIO()
+    for values in rows:
+        f.write(','.join(copy_field(value) for value in values))
+        f.write('\n')
+    f.seek(0)
+    return f
+
+def copy_field(value):
+    if value is None:
+        return ''
+    if isinstance(value, (bool, int, float)):
+        return str(value)
+    return '"{0}"'.format(str(value).replace('"', '""'))
@@ -0,0 +1,106 @@
+"""Encode API results as JSON, as quickly as the installed libraries allow.
+
+When the `orjson` library is installed we encode with it, since it is
+several times faster than the standard library's `json` module.  We
+fall back to `json` when `orjson` is missing, when pretty-printed output
+is wanted under DEBUG (`orjson` only knows how to indent by two
+spaces), and for any value that `orjson` declines to encode - in which
+case `json` either manages, or raises its usual `TypeError`.
+
+Either way the output is compact, with no spaces after the separators.
+
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CHUNK_SIZE = 64 * 1024  # bytes per chunk of a streamed response
+
+
+def backend_name():
+    """Return the name of the library doing the encoding."""
+    return 'json' if orjson is None else 'orjson'
+
+
+def dumps(value, indent=None):
+    """Return `value` encoded as JSON, as bytes."""
+    if orjson is not None and not indent:
+        try:
+            return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    if indent:
+        return json.dumps(value, indent=indent).encode('utf-8')
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def iterencode(value, indent=None):
+    """Yield `value` encoded as JSON, in chunks of about CHUNK_SIZE bytes.
+
+    A top-level list (or any other iterable) or dictionary is encoded
+    one member at a time, so that the whole document never needs to
+    exist in memory at once.  Pretty-printed output is not streamed.
+
+    """
+    if indent:
+        yield dumps(value, indent)
+        return
+    chunk = []
+    size = 0
+    for piece in _pieces(value):
+        chunk.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+def _pieces(value):
+    if isinstance(value, dict):
+        yield b'{'
+        for i, (key, item) in enumerate(value.items()):
+            if i:
+                yield b','
+            # Encoding a one-item dictionary converts the key exactly as
+            # encoding the whole dictionary would have.
+            yield dumps({key: item})[1:-1]
+        yield b'}'
+    elif isinstance(value, (str, bytes)) or not hasattr(value, '__iter__'):
+        yield dumps(value)
+    else:
+        yield b'['
+        for i, item in enumerate(value):
+            if i:
+                yield b','
+            yield dumps(item)
+        yield b']'
+
+
+def compact(records):
+    """Return a list of dictionaries in the compact-array wire format.
+
+    Instead of repeating every key in every record, the keys are listed
+    once as "fields", and each record becomes a row of its values in
+    the same order; a key that is missing from a record comes out as
+    null in its row.
+
+    """
+    records = list(records)
+    fields = []
+    seen = set()
+    for record in records:
+        for key in record:
+            if key not in seen:
+                seen.add(key)
+                fields.append(key)
+    return {
+        'fields': fields,
+        'rows': [[record.get(field) for field in fields]
+                 for record in records],
+        }
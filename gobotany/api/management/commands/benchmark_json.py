@@ -0,0 +1,77 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.urls import resolve
+
+from gobotany.api import encoding
+from gobotany.core.models import Pile
+
+
+class Command(BaseCommand):
+    """Compare the speed and size of the ways we can encode API results.
+
+    Each URL is fetched once through its view to learn the value it
+    serves, and that value is then encoded repeatedly: with the plain
+    `json.dumps()` call that the API used to make, with the encoder
+    layer in gobotany.api.encoding, streamed, and, for lists of
+    records, in the compact-array format.  Example:
+
+    dev/django benchmark_json --repeat 20 /api/species/lycophytes/
+    """
+    help = 'Benchmarks the JSON encoding of API responses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='*', help='API URLs to fetch'
+                            ' (default: the species list and pile vector'
+                            ' set of the first pile, and the glossary)')
+        parser.add_argument('--repeat', type=int, default=10,
+                            help='encodings to time per method'
+                            ' (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        urls = options['urls']
+        if not urls:
+            pile = Pile.objects.order_by('name').first()
+            urls = ['/api/glossaryblob/']
+            if pile is not None:
+                urls[:0] = ['/api/species/%s/' % pile.slug,
+                            '/api/vectors/pile-set/%s/' % pile.slug]
+
+        self.stdout.write('Encoder backend: %s' % encoding.backend_name())
+        self.stdout.write('%-40s %-14s %10s %12s' % (
+            'URL', 'method', 'ms', 'bytes'))
+
+        for url in urls:
+            value = self.fetch(url)
+            methods = [
+                ('json.dumps', lambda: json.dumps(value).encode('utf-8')),
+                ('dumps', lambda: encoding.dumps(value)),
+                ('iterencode',
+                 lambda: b''.join(encoding.iterencode(value))),
+                ]
+            if isinstance(value, list) and all(
+                    isinstance(item, dict) for item in value):
+                methods.append(('compact', lambda: encoding.dumps(
+                    encoding.compact(value))))
+            for name, method in methods:
+                best = None
+                for i in range(options['repeat']):
+                    start = time.perf_counter()
+                    body = method()
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                self.stdout.write('%-40s %-14s %10.2f %12d' % (
+                    url, name, best * 1000.0, len(body)))
+
+    def fetch(self, url):
+        """Return the value served by the API view for `url`."""
+        request = RequestFactory().get(url)
+        match = resolve(request.path_info)
+        response = match.func(request, *match.args, **match.kwargs)
+        if response.streaming:
+            body = b''.join(response.streaming_content)
+        else:
+            body = response.content
+        return json.loads(body)
@@ -1,3 +1,5 @@
+import base64
+import gzip
 import json
 import logging
 import os
@@ -5,10 +7,13 @@ import shutil
 
 from django.contrib.contenttypes.models import ContentType
 from django.core.files import File
-from django.test import TestCase
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
 from django.test.client import Client
 
-from gobotany.core import models
+from gobotany.api import encoding, views
+from gobotany.api import urls as api_urls
+from gobotany.core import models, vectors
 
 def _testdata_dir():
     """Return the path to a test data directory relative to this directory."""
@@ -480,12 +485,359 @@ class CharacterListTestCase(TestCase):
             '/api/piles/pile1/characters/?character_groups=0')  # id of char group
         self.assertEqual(200, response.status_code)
 
+    def test_get_with_species_ids_chooses_best_characters(self):
+        models.Character.objects.update(ease_of_observability=1)
+        models.Character.objects.filter(value_type='').update(
+            value_type='TEXT')
+        species_ids = '_'.join(str(taxon.id) for taxon
+                               in models.Taxon.objects.all())
+        url = ('/api/piles/pile1/characters/?choose_best=2&species_ids='
+               + species_ids)
+        first = json.loads(self.client.get(url).content)
+        second = json.loads(self.client.get(url).content)
+        self.assertEqual(first, second)
+        self.assertEqual([c['short_name'] for c in first], ['c1', 'c2'])
+
     def test_get_ignores_unknown_includes(self):
         response = self.client.get(
             '/api/piles/pile1/characters/?include=foo&include=c1&include=bar')
         self.assertEqual(200, response.status_code)
 
 
+class ConditionalGetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        _setup_sample_data()
+        cls.client = Client()
+
+    def setUp(self):
+        _setLoggingLevelError(self)
+        models.DataVersion.objects.bump()
+
+    def tearDown(self):
+        _restoreLoggingLevel(self)
+
+    def test_get_returns_data_version_etag_and_last_modified(self):
+        response = self.client.get('/api/piles/')
+        self.assertEqual(200, response.status_code)
+        version = models.DataVersion.objects.current()
+        self.assertTrue(response['ETag'].endswith('.%d"' % version))
+        self.assertTrue(response['Last-Modified'])
+
+    def test_get_returns_not_modified_for_current_etag(self):
+        response = self.client.get('/api/piles/pile1/')
+        response = self.client.get('/api/piles/pile1/',
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(304, response.status_code)
+
+    def test_get_returns_not_modified_since_last_modified(self):
+        response = self.client.get('/api/piles/pile1/')
+        response = self.client.get(
+            '/api/piles/pile1/',
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(304, response.status_code)
+
+    def test_get_returns_data_again_when_data_version_changes(self):
+        first = self.client.get('/api/piles/pile1/')
+        models.DataVersion.objects.bump()
+        response = self.client.get('/api/piles/pile1/',
+                                   HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(first['ETag'], response['ETag'])
+
+    def test_cached_body_is_not_served_after_data_version_changes(self):
+        bodies = []
+
+        def view(request):
+            bodies.append('body %d' % len(bodies))
+            return HttpResponse(bodies[-1])
+
+        cached_view = api_urls.versioned(
+            api_urls.versioned_cache_page(3600)(view))
+        factory = RequestFactory()
+        first = cached_view(factory.get('/api/cached/'))
+        second = cached_view(factory.get('/api/cached/'))
+        self.assertEqual(second.content, first.content)
+        models.DataVersion.objects.bump()
+        third = cached_view(factory.get('/api/cached/',
+                                        HTTP_IF_NONE_MATCH=first['ETag']))
+        self.assertEqual(200, third.status_code)
+        self.assertEqual(b'body 1', third.content)
+
+
+class EncodingTestCase(TestCase):
+    VALUE = {'b': [1, 2.5, None, True], 3: 'three', 'c': {'d': 'é'}}
+
+    def test_dumps_agrees_with_json(self):
+        self.assertEqual(json.loads(encoding.dumps(self.VALUE)),
+                         json.loads(json.dumps(self.VALUE)))
+        self.assertEqual(json.loads(encoding.dumps(self.VALUE, indent=1)),
+                         json.loads(json.dumps(self.VALUE)))
+
+    def test_dumps_raises_type_error_for_unknown_types(self):
+        self.assertRaises(TypeError, encoding.dumps, {'a': object()})
+
+    def test_iterencode_agrees_with_dumps(self):
+        for value in (self.VALUE, [self.VALUE] * 3, [], {}, 'x', 1):
+            self.assertEqual(b''.join(encoding.iterencode(value)),
+                             encoding.dumps(value))
+        self.assertEqual(b''.join(encoding.iterencode(iter([1, 2]))),
+                         b'[1,2]')
+
+    def test_iterencode_yields_chunks(self):
+        value = ['x' * 1000] * 200
+        chunks = list(encoding.iterencode(value))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(json.loads(b''.join(chunks)), value)
+
+    def test_compact_lists_each_key_once(self):
+        records = [{'a': 1, 'b': 2}, {'b': 3, 'c': 4}]
+        self.assertEqual(encoding.compact(records),
+                         {'fields': ['a', 'b', 'c'],
+                          'rows': [[1, 2, None], [None, 3, 4]]})
+
+
+class PileVectorSetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        _setup_sample_data()
+        cls.client = Client()
+
+    def setUp(self):
+        _setLoggingLevelError(self)
+        vectors._pile_vectors.clear()
+
+    def tearDown(self):
+        _restoreLoggingLevel(self)
+
+    def _taxon_id(self, scientific_name):
+        return models.Taxon.objects.get(scientific_name=scientific_name).id
+
+    def test_get_returns_ok(self):
+        response = self.client.get('/api/vectors/pile-set/pile1/')
+        self.assertEqual(200, response.status_code)
+
+    def test_get_returns_not_found_when_nonexistent_pile(self):
+        response = self.client.get('/api/vectors/pile-set/nopile/')
+        self.assertEqual(404, response.status_code)
+
+    def test_get_returns_taxa_for_each_value(self):
+        response = self.client.get('/api/vectors/pile-set/pile1/')
+        characters = {c['slug']: c for c in json.loads(response.getvalue())}
+        self.assertEqual(set(characters), {'c1', 'c2', 'c3', 'habitat'})
+        self.assertEqual(characters['c1']['group_name'], 'cg1')
+        self.assertEqual(sorted(characters['c1']['values']), sorted([
+            [self._taxon_id('Fooium barula')],
+            [self._taxon_id('Fooium fooia')],
+            ]))
+        self.assertEqual(characters['c3']['values'], [[]])
+
+    def test_get_bitset_format_matches_list_format(self):
+        lists = json.loads(self.client.get(
+            '/api/vectors/pile-set/pile1/').getvalue())
+        bitsets = json.loads(self.client.get(
+            '/api/vectors/pile-set/pile1/?format=bitset').content)
+        taxa = bitsets['taxa']
+        self.assertEqual(taxa, sorted(taxa))
+        for listed, packed in zip(lists, bitsets['characters']):
+            self.assertEqual(listed['slug'], packed['slug'])
+            for taxon_ids, encoded in zip(listed['values'],
+                                          packed['values']):
+                bits = int.from_bytes(base64.b64decode(encoded), 'little')
+                self.assertEqual(taxon_ids, [taxon_id for n, taxon_id
+                                             in enumerate(taxa)
+                                             if bits & (1 << n)])
+
+    def test_get_compact_format_matches_list_format(self):
+        lists = json.loads(self.client.get(
+            '/api/vectors/pile-set/pile1/').getvalue())
+        compact = json.loads(self.client.get(
+            '/api/vectors/pile-set/pile1/?format=compact').content)
+        self.assertEqual(lists, [dict(zip(compact['fields'], row))
+                                 for row in compact['rows']])
+
+    def test_each_format_is_serialized_once(self):
+        self.client.get('/api/vectors/pile-set/pile1/')
+        self.client.get('/api/vectors/pile-set/pile1/?format=compact')
+        payloads = dict(vectors.get_pile_vectors('pile1').payloads)
+        self.assertEqual(set(payloads), {None, 'compact'})
+        response = self.client.get('/api/vectors/pile-set/pile1/?format=x')
+        self.assertEqual(response.content, payloads[None].body)
+        self.assertEqual(vectors.get_pile_vectors('pile1').payloads,
+                         payloads)
+
+    def test_index_is_rebuilt_when_data_version_changes(self):
+        self.client.get('/api/vectors/pile-set/pile1/')
+        models.TaxonCharacterValue.objects.filter(
+            character_value__value_str='cv2').delete()
+        stale = json.loads(self.client.get(
+            '/api/vectors/pile-set/pile1/').getvalue())
+        self.assertEqual([c['values'] for c in stale if c['slug'] == 'c2'],
+                         [[[self._taxon_id('Fooium barula')]]])
+        models.DataVersion.objects.bump()
+        fresh = json.loads(self.client.get(
+            '/api/vectors/pile-set/pile1/').getvalue())
+        self.assertEqual([c['values'] for c in fresh if c['slug'] == 'c2'],
+                         [[[]]])
+
+
+class SpeciesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        _setup_sample_data()
+        cls.client = Client()
+
+    def setUp(self):
+        _setLoggingLevelError(self)
+        views._species_cache.clear()
+
+    def tearDown(self):
+        _restoreLoggingLevel(self)
+
+    def test_get_returns_species_of_pile(self):
+        response = self.client.get('/api/species/pile1/')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/json; charset=utf-8',
+                         response['Content-Type'])
+        names = sorted(s['scientific_name']
+                       for s in json.loads(response.content))
+        self.assertEqual(names, ['Bazia americana', 'Fooium barula',
+                                 'Fooium fooia'])
+
+    def test_get_returns_not_modified_for_current_etag(self):
+        response = self.client.get('/api/species/pile1/')
+        self.assertTrue(response['Last-Modified'])
+        response = self.client.get('/api/species/pile1/',
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(b'', response.content)
+
+    def test_get_returns_gzip_variant_when_accepted(self):
+        plain = self.client.get('/api/species/pile1/')
+        response = self.client.get('/api/species/pile1/',
+                                   HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual('gzip', response['Content-Encoding'])
+        self.assertEqual(str(len(response.content)),
+                         response['Content-Length'])
+        self.assertEqual(plain.content, gzip.decompress(response.content))
+        self.assertNotEqual(plain['ETag'], response['ETag'])
+
+    def test_get_does_not_return_gzip_variant_when_refused(self):
+        for header in 'gzip;q=0', 'gzip; q=0.0, deflate', '*, gzip;q=0':
+            response = self.client.get('/api/species/pile1/',
+                                       HTTP_ACCEPT_ENCODING=header)
+            self.assertNotEqual(response.get('Content-Encoding'), 'gzip',
+                                header)
+
+    def test_get_compact_format_matches_record_format(self):
+        records = json.loads(
+            self.client.get('/api/species/pile1/').content)
+        compact = json.loads(
+            self.client.get('/api/species/pile1/?format=compact').content)
+        self.assertEqual(records, [dict(zip(compact['fields'], row))
+                                   for row in compact['rows']])
+
+    def test_cached_list_is_replaced_when_data_version_changes(self):
+        first = self.client.get('/api/species/pile1/')
+        models.Pile.objects.get(slug='pile1').species.remove(
+            models.Taxon.objects.get(scientific_name='Fooium fooia'))
+        self.assertEqual(first.content,
+                         self.client.get('/api/species/pile1/').content)
+        models.DataVersion.objects.bump()
+        response = self.client.get('/api/species/pile1/',
+                                   HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, len(json.loads(response.content)))
+
+
+class SpeciesQueryTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        _setup_sample_data()
+        cls.client = Client()
+
+    def setUp(self):
+        _setLoggingLevelError(self)
+        vectors._pile_vectors.clear()
+
+    def tearDown(self):
+        _restoreLoggingLevel(self)
+
+    def test_get_returns_matching_species(self):
+        response = self.client.get('/api/piles/pile1/query/?c1=cv1_2')
+        self.assertEqual(200, response.status_code)
+        data = json.loads(response.content)
+        bar = models.Taxon.objects.get(scientific_name='Fooium barula')
+        abc = models.Taxon.objects.get(scientific_name='Bazia americana')
+        self.assertEqual(data['species'], sorted([bar.id, abc.id]))
+        self.assertEqual(data['counts']['c1'], {'cv1_1': 1, 'cv1_2': 1})
+        self.assertEqual(data['counts']['c2'], {'cv2': 1})
+
+    def test_get_ignores_cache_busting_parameter(self):
+        response = self.client.get(
+            '/api/piles/pile1/query/?c1=cv1_2&_=1361281201836')
+        self.assertEqual(200, response.status_code)
+        data = json.loads(response.content)
+        self.assertEqual(len(data['species']), 2)
+
+    def test_get_returns_not_found_when_nonexistent_pile(self):
+        response = self.client.get('/api/piles/nopile/query/')
+        self.assertEqual(404, response.status_code)
+
+    def test_get_returns_not_found_when_nonexistent_character(self):
+        response = self.client.get('/api/piles/pile1/query/?nochar=1')
+        self.assertEqual(404, response.status_code)
+
+    def test_get_returns_bad_request_when_bad_length(self):
+        response = self.client.get('/api/piles/pile1/query/?c3=long')
+        self.assertEqual(400, response.status_code)
+
+
+class QuestionsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        _setup_sample_data()
+        cls.client = Client()
+
+    def setUp(self):
+        _setLoggingLevelError(self)
+        vectors._pile_vectors.clear()
+
+    def tearDown(self):
+        _restoreLoggingLevel(self)
+
+    def _questions(self, query):
+        response = self.client.get('/api/piles/pile1/questions/' + query)
+        self.assertEqual(200, response.status_code)
+        return [c['short_name'] for c in json.loads(response.content)]
+
+    def test_get_returns_not_found_when_nonexistent_pile(self):
+        response = self.client.get('/api/piles/nopile/questions/')
+        self.assertEqual(404, response.status_code)
+
+    def _set_ease(self):
+        for ease, short_name in enumerate(['c1', 'c2', 'habitat', 'c3']):
+            models.Character.objects.filter(short_name=short_name).update(
+                ease_of_observability=ease + 1)
+
+    def test_get_puts_questions_with_several_answers_first(self):
+        self._set_ease()
+        species_ids = '_'.join(str(taxon.id) for taxon
+                               in models.Taxon.objects.all())
+        # Only c1 and habitat have more than one available answer.
+        self.assertEqual(
+            self._questions('?choose_best=3&species_ids=' + species_ids),
+            ['c1', 'habitat', 'c2'])
+
+    def test_get_fills_remaining_slots_in_order(self):
+        self._set_ease()
+        bar = models.Taxon.objects.get(scientific_name='Fooium barula')
+        self.assertEqual(
+            self._questions('?choose_best=4&exclude=c3&species_ids=%d'
+                            % bar.id),
+            ['habitat', 'c1', 'c2'])
+
+
 class CharacterValuesTestCase(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -2,9 +2,11 @@ from django.conf import settings
 from django.contrib import admin
 from django.urls import path, re_path
 from django.views.decorators.cache import cache_control, cache_page
+from django.views.decorators.http import condition
 from django.views.generic import RedirectView
 
 from gobotany.api import views
+from gobotany.core.models import DataVersion
 
 admin.autodiscover()
 
@@ -24,20 +26,69 @@ def allow_cross_site_access(f):
         return httpresponse
     return add_cross_site_header
 
+# Nearly everything the API serves changes only when the importer or
+# rebuild runs, or when someone saves a change to the botanical data in
+# the admin or editor, all of which bump the "botany" DataVersion.  So the version makes a
+# good ETag, and its time a good Last-Modified, for letting browsers
+# and caches revalidate with a cheap 304 instead of downloading the
+# data again.  Bump API_FORMAT_VERSION whenever a change to the code
+# changes what the API returns for the same data.  (Distribution maps
+# go by the "distribution" version instead.)
+
+API_FORMAT_VERSION = 1
+
+def data_version_stamp(request, name):
+    """Return the named DataVersion stamp, looked up once per request."""
+    stamps = request.__dict__.setdefault('_data_version_stamps', {})
+    if name not in stamps:
+        stamps[name] = DataVersion.objects.stamp(name)
+    return stamps[name]
+
+def versioned_by(name):
+    """Make a decorator that revalidates against the named DataVersion."""
+
+    def etag(request, *args, **kw):
+        version, updated = data_version_stamp(request, name)
+        return '%d.%d' % (API_FORMAT_VERSION, version)
+
+    def last_modified(request, *args, **kw):
+        version, updated = data_version_stamp(request, name)
+        return updated
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+def versioned_cache_page(timeout, name='botany'):
+    """Make a decorator like `cache_page()` whose cache key includes
+    the named DataVersion, so that a bump stops serving the responses
+    cached under the old version at once, instead of letting them be
+    labeled with the new version's ETag until they expire."""
+
+    def decorator(view):
+        def cached_view(request, *args, **kw):
+            version, updated = data_version_stamp(request, name)
+            prefix = '%s-%d.%d' % (name, API_FORMAT_VERSION, version)
+            return cache_page(timeout, key_prefix=prefix)(view)(
+                request, *args, **kw)
+        return cached_view
+    return decorator
+
+versioned = versioned_by('botany')
+map_versioned = versioned_by('distribution')
+
 urlpatterns = [
     re_path(r'^taxa/(?P<scientific_name>[^/]+)/$',
-        allow_cross_site_access(views.taxa), name='api-taxa'),
-    path('taxa/', views.taxa, name='api-taxa-list'),
+        allow_cross_site_access(versioned(views.taxa)), name='api-taxa'),
+    path('taxa/', versioned(views.taxa), name='api-taxa-list'),
 
-    path('taxa-count/', views.taxa_count, name='api-taxa-count'),
+    path('taxa-count/', versioned(views.taxa_count), name='api-taxa-count'),
 
-    path('taxon-image/', views.taxon_image, name='api-taxon-image'),
+    path('taxon-image/', versioned(views.taxon_image), name='api-taxon-image'),
 
-    path('characters/', views.characters, name='api-characters'),
-    path('characters/<slug:character_short_name>/', views.character,
+    path('characters/', versioned(views.characters), name='api-characters'),
+    path('characters/<slug:character_short_name>/', versioned(views.character),
         name='api-character'),
 
-    path('piles/', views.pile_listing, name='api-pile-list'),
+    path('piles/', versioned(views.pile_listing), name='api-pile-list'),
 
 
     # Redirects for the split Remaining Non-Monocots piles, so that the
@@ -61,51 +112,57 @@ urlpatterns = [
         )),
 
 
-    path('piles/<slug:pile_slug>/characters/', views.piles_characters,
+    path('piles/<slug:pile_slug>/characters/',
+        versioned(views.piles_characters),
         name='api-character-list'),
 
-    path('piles/<slug:pile_slug>/questions/', views.questions,
+    path('piles/<slug:pile_slug>/questions/', versioned(views.questions),
         name='api-questions'),
 
-    path('piles/<slug:slug>/', views.pile, name='api-pile'),
+    path('piles/<slug:pile_slug>/query/', versioned(views.species_query),
+        name='api-species-query'),
+
+    path('piles/<slug:slug>/', versioned(views.pile), name='api-pile'),
 
     path('piles/<slug:pile_slug>/<slug:character_short_name>/',
-        views.character_values, name='api-character-values'),
+        versioned(views.character_values), name='api-character-values'),
 
-    path('pilegroups/', views.pile_group_listing, name='api-pilegroup-list'),
-    path('pilegroups/<slug:slug>/', views.pile_group,
+    path('pilegroups/', versioned(views.pile_group_listing),
+        name='api-pilegroup-list'),
+    path('pilegroups/<slug:slug>/', versioned(views.pile_group),
         name='api-pilegroup'),
 
     # Plant diversity maps, data:
     # Maps
-    #re_path(r'^maps/ne-diversity-map-native?$',
-    #    views.new_england_native_diversity_map,
-    #    name='ne-native-diversity-map'),
-    #re_path(r'^maps/ne-diversity-map-nonnative?$',
-    #    views.new_england_nonnative_diversity_map,
-    #    name='ne-nonnative-diversity-map'),
-    #re_path(r'^maps/ne-diversity-map-all?$',
-    #    views.new_england_all_diversity_map,
-    #    name='ne-all-diversity-map'),
+    re_path(r'^maps/ne-diversity-map-native?$',
+        map_versioned(views.new_england_native_diversity_map),
+        name='ne-native-diversity-map'),
+    re_path(r'^maps/ne-diversity-map-nonnative?$',
+        map_versioned(views.new_england_nonnative_diversity_map),
+        name='ne-nonnative-diversity-map'),
+    re_path(r'^maps/ne-diversity-map-all?$',
+        map_versioned(views.new_england_all_diversity_map),
+        name='ne-all-diversity-map'),
     # CSV data
-    #re_path(r'^maps/ne-diversity-map-native\.csv',
-    #    views.new_england_native_diversity_csv,
-    #    name='ne-native-diversity-csv'),
-    #re_path(r'^maps/ne-diversity-map-nonnative\.csv',
-    #    views.new_england_nonnative_diversity_csv,
-    #    name='ne-nonnative-diversity-csv'),
-    #re_path(r'^maps/ne-diversity-map-all\.csv',
-    #    views.new_england_all_diversity_csv,
-    #    name='ne-all-diversity-csv'),
-
+    re_path(r'^maps/ne-diversity-map-native\.csv',
+        map_versioned(views.new_england_native_diversity_csv),
+        name='ne-native-diversity-csv'),
+    re_path(r'^maps/ne-diversity-map-nonnative\.csv',
+        map_versioned(views.new_england_nonnative_diversity_csv),
+        name='ne-nonnative-diversity-csv'),
+    re_path(r'^maps/ne-diversity-map-all\.csv',
+        map_versioned(views.new_england_all_diversity_csv),
+        name='ne-all-diversity-csv'),
 
     # Plant distribution maps
     re_path(r'^maps/(?P<genus>[^/-]+)-(?P<epithet>[^/]+)'
          '-ne-distribution-map(\.svg|/)?$',
-        views.new_england_distribution_map, name='ne-distribution-map'),
+        map_versioned(views.new_england_distribution_map),
+        name='ne-distribution-map'),
     re_path(r'^maps/(?P<genus>[^/-]+)-(?P<epithet>[^/]+)'
          '-na-distribution-map(\.svg|/)?$',
-        views.north_american_distribution_map, name='na-distribution-map'),
+        map_versioned(views.north_american_distribution_map),
+        name='na-distribution-map'),
 
     path('', views.nonexistent, name='api-base'),   # helps compute base URL
 ]
@@ -117,7 +174,7 @@ urlpatterns = [
 if 'memcache' in settings.CACHES['default']['BACKEND']:
     one_hour = 60 * 60
     browsercache = cache_control(maxage=one_hour)
-    memcache = cache_page(one_hour)
+    memcache = versioned_cache_page(one_hour)
     both = lambda view: browsercache(memcache(view))
 else:
     browsercache = lambda view: view
@@ -125,17 +182,17 @@ else:
     both = lambda view: view
 
 urlpatterns.extend([
-    path('glossaryblob/', both(views.glossary_blob)),
-    path('hierarchy/', both(views.hierarchy)),
-    path('sections/', both(views.sections)),
-    re_path(r'^dkey-images/([-\w\d]+)/$', both(views.dkey_images)),
-    re_path(r'^families/([\w]+)/$', both(views.family)),
-    re_path(r'^genera/([\w]+)/$', both(views.genus)),
+    path('glossaryblob/', versioned(both(views.glossary_blob))),
+    path('hierarchy/', versioned(both(views.hierarchy))),
+    path('sections/', versioned(both(views.sections))),
+    re_path(r'^dkey-images/([-\w\d]+)/$', versioned(both(views.dkey_images))),
+    re_path(r'^families/([\w]+)/$', versioned(both(views.family))),
+    re_path(r'^genera/([\w]+)/$', versioned(both(views.genus))),
     re_path(r'^species/([\w-]+)/$', browsercache(views.species)),
     re_path(r'^vectors/character/([\w()-]+)/$',
-        both(views.vectors_character)),
-    re_path(r'^vectors/key/([\w-]+)/$', both(views.vectors_key)),
-    re_path(r'^vectors/pile/([\w-]+)/$', both(views.vectors_pile)),
+        versioned(both(views.vectors_character))),
+    re_path(r'^vectors/key/([\w-]+)/$', versioned(both(views.vectors_key))),
+    re_path(r'^vectors/pile/([\w-]+)/$', versioned(both(views.vectors_pile))),
 
     # Another redirect for the split Remaining Non-Monocots piles, for
     # the feature Get More Questions > Pick Your Own
@@ -145,5 +202,6 @@ urlpatterns.extend([
             permanent=True,
         )),
 
-    re_path(r'^vectors/pile-set/([\w-]+)/$', both(views.pile_vector_set)),
+    re_path(r'^vectors/pile-set/([\w-]+)/$',
+        versioned(both(views.pile_vector_set))),
 ])
\ No newline at end of file
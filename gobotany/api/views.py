@@ -1,10 +1,7 @@
-import copy
 import csv
+import gzip
 import hashlib
 import inflect
-import json
-import os
-import re
 
 from collections import defaultdict
 from operator import itemgetter
@@ -14,15 +11,19 @@ from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.db import connection
 from django.forms.models import model_to_dict
-from django.http import HttpResponse, Http404, JsonResponse
+from django.http import (HttpResponse, HttpResponseRedirect, Http404,
+    JsonResponse)
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.views.decorators.cache import cache_page
-from django.views.decorators.http import etag
 from django.views.decorators.vary import vary_on_headers
 
 import gobotany.dkey.models as dkey_models
-from gobotany.core import botany, igdt, models
+from gobotany.api import encoding
+from gobotany.core import botany, igdt, models, vectors
 from gobotany.core.models import (
     Character, ContentImage,
     GlossaryTerm, PartnerSpecies, Pile,
@@ -30,19 +31,25 @@ from gobotany.core.models import (
     )
 from gobotany.core.partner import which_partner
 from gobotany.core.questions import get_questions
-from gobotany.mapping.map import (NewEnglandPlantDiversityMap,
-    NewEnglandPlantDistributionMap, NorthAmericanPlantDistributionMap,
-    UnitedStatesPlantDistributionMap)
+from gobotany.mapping import diversity
+from gobotany.mapping.render import prerendered_url, render_map
+from gobotany.middleware import accepted_codings
+from gobotany.mapping.map import NewEnglandPlantDiversityMap
 from gobotany.site.utils import secure_url
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 inflector = inflect.engine()
 
 
 def jsonify(value, headers=None, indent=1):
     """Convert the value into a JSON HTTP response."""
+    indent = indent if settings.DEBUG else None
     response = HttpResponse(
-        json.dumps(value, indent=indent if settings.DEBUG else None),
+        encoding.dumps(value, indent),
         content_type='application/json; charset=utf-8',
         )
     if headers:
@@ -50,6 +57,51 @@ def jsonify(value, headers=None, indent=1):
             response[k] = v
     return response
 
+class JSONPayload(object):
+    """The serialized bytes of a JSON response, kept to be served again.
+
+    Caching whole `HttpResponse` objects does not work, because the
+    middleware rewrites a response in place (GZipMiddleware replaces its
+    content) on its way out the door; so instead we keep the bytes of
+    the body, compressed ahead of time with each encoding we can offer,
+    and build a fresh response around them for every request.
+
+    """
+    def __init__(self, value, last_modified=None):
+        self.body = encoding.dumps(value, 1 if settings.DEBUG else None)
+        self.etag = hashlib.md5(self.body).hexdigest()
+        self.last_modified = last_modified or timezone.now()
+        self.encoded = {'gzip': gzip.compress(self.body)}
+        if brotli is not None:
+            self.encoded['br'] = brotli.compress(self.body)
+
+    def serve(self, request):
+        """Return a response, or a 304 if the client's copy is current."""
+        accepted = accepted_codings(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        for coding in ('br', 'gzip'):
+            if coding in self.encoded and coding in accepted:
+                body = self.encoded[coding]
+                etag = '"%s-%s"' % (self.etag, coding)
+                break
+        else:
+            coding = None
+            body = self.body
+            etag = '"%s"' % self.etag
+
+        response = HttpResponse(
+            body, content_type='application/json; charset=utf-8')
+        if coding:
+            response['Content-Encoding'] = coding
+        response['Content-Length'] = str(len(body))
+        response['ETag'] = etag
+        last_modified = self.last_modified.timestamp()
+        response['Last-Modified'] = http_date(last_modified)
+        response['Vary'] = 'Accept-Encoding'
+        return get_conditional_response(
+            request, etag=etag, last_modified=last_modified,
+            response=response)
+
 # API helpers.
 
 def _taxon_image(image):
@@ -210,6 +262,30 @@ def taxa_count(request):
     return jsonify({'matched': matched,
         'excluded': models.Taxon.objects.count() - matched})
 
+def species_query(request, pile_slug):
+    """Filter the species of a pile server-side, instead of in the browser.
+
+    Each query parameter selects a value for a character, as in
+    ``?habitat_general=forests&leaf_blade_length_ap=30``, and the
+    response lists the matching species IDs, plus how many species each
+    textual character value would leave if it were selected.
+    Parameters whose names start with an underscore, like the ``_=``
+    that jQuery adds to defeat caching, are not characters and are
+    ignored.
+
+    """
+    selections = {name: value for name, value in request.GET.items()
+                  if not name.startswith('_')}
+    try:
+        species, counts = botany.filter_species(pile_slug, selections)
+    except models.Pile.DoesNotExist:
+        raise Http404()
+    except models.Character.DoesNotExist:
+        return rc.NOT_FOUND
+    except ValueError:
+        return rc.BAD_REQUEST
+    return jsonify({'species': species, 'counts': counts}, indent=False)
+
 def taxon_image(request):
     kwargs = {}
     items = list(request.GET.items())
@@ -564,8 +640,7 @@ def questions(request, pile_slug):
     questions = get_questions(request, pile)
     # Normal: return JSON
     questions_list = []
-    for question in questions:
-        character = Character.objects.get(short_name=question)
+    for character in questions:
         questions_list.append(_jsonify_character(character, pile_slug))
     output = jsonify(questions_list)
     # Alternate: return HTML for browser testing with Django Debug Toolbar
@@ -785,21 +860,20 @@ def genus(request, genus_slug):
 
 # Lower-order taxa.
 
-_species_cache = {}
+_species_cache = {}  # (pile slug, format) -> (data version, JSONPayload)
 
 def species(request, pile_slug):
 
-    # Pull the result from our hard cache, if available.
+    # Serve the bytes from our hard cache, if they were built from the
+    # current data.  Our species lists only change when an import runs.
+    # With "?format=compact" the list is sent in compact-array form.
 
-    # TODO: fix. Disabled when upgrading to Django 1.5 due to error in
-    # Chrome when pulling from the cache:
-    # Error 354 (net::ERR_CONTENT_LENGTH_MISMATCH): The server unexpectedly
-    # closed the connection.
-    # Somehow the cached response has a much shorter Content-Length than the
-    # original response.
-    # Tried re-enabling after upgrade to Django 1.6, but got same error.
-    #if pile_slug in _species_cache:
-    #    return _species_cache[pile_slug]
+    wire_format = ('compact' if request.GET.get('format') == 'compact'
+                   else 'records')
+    version, updated = models.DataVersion.objects.stamp()
+    cached = _species_cache.get((pile_slug, wire_format))
+    if cached is not None and cached[0] == version:
+        return cached[1].serve(request)
 
     # Efficiently fetch the species that belong to this pile.  (Common
     # name is selected nondeterministically because, frankly, the data
@@ -830,11 +904,14 @@ def species(request, pile_slug):
         "  ON (core_contentimage.image_type_id = core_imagetype.id)"
         " JOIN django_content_type"
         "  ON (core_contentimage.content_type_id =django_content_type.id)"
+        " JOIN core_pile_species"
+        "  ON (core_contentimage.object_id = core_pile_species.taxon_id)"
+        " JOIN core_pile ON (core_pile_species.pile_id = core_pile.id)"
         " WHERE core_contentimage.rank <= 1"
-        "  AND core_contentimage.object_id IN %s"
+        "  AND core_pile.slug = %s"
         "  AND django_content_type.app_label = 'core'"
         "  AND django_content_type.model = 'taxon'",
-        (tuple( species.id for species in species_list ),))
+        (pile_slug,))
 
     image_dict = defaultdict(list)  # taxon_id -> [ContentImage, ...]
     for image in image_query:
@@ -855,11 +932,16 @@ def species(request, pile_slug):
             images.append(_taxon_image(image))
         result.append(d)
 
-    # Hard-cache the result, since our species lists do not currently
-    # change during the day in production.
+    # Hard-cache the serialized result until the next import.  (Only
+    # real piles are cached, so made-up slugs cannot fill up memory.)
 
-    _species_cache[pile_slug] = jsonify(result)
-    return _species_cache[pile_slug]
+    real_pile = bool(result)
+    if wire_format == 'compact':
+        result = encoding.compact(result)
+    payload = JSONPayload(result, updated)
+    if real_pile:
+        _species_cache[(pile_slug, wire_format)] = (version, payload)
+    return payload.serve(request)
 
 #
 
@@ -903,7 +985,9 @@ def vectors_pile(request, slug):
 
 # Big vector
 #
-# What design?
+# The pile vector set is served from an in-memory index that is built
+# once per data load; see gobotany.core.vectors.  Its traditional format
+# looks like:
 #
 # [...
 #  {name: 'habitat',
@@ -911,309 +995,81 @@ def vectors_pile(request, slug):
 #   values: [...
 #            [5, 8, 9],  <-- one array of taxon IDs per value
 #            ...
+#
+# With "?format=bitset" the response instead carries the sorted list of
+# the pile's taxon IDs, and each value becomes a base64 little-endian
+# bitset in which bit n stands for the n-th taxon in that list, and with
+# "?format=compact" the characters are sent in compact-array form (see
+# gobotany.api.encoding).
 
 def pile_vector_set(request, slug):
-
-    pile = get_object_or_404(Pile, slug=slug)
-
-    # These four queries are the barest minimum required to learn how
-    # many character values each character has, and what species belong
-    # to each value, which together is all the information that the
-    # front-end needs to display character and rank them by their
-    # usefulness.
-    #
-    # And, yes, using Django ORM objects here unfortunately destroys
-    # performance, as does trying to combine these queries into a single
-    # JOIN that repeats redundant data.
-    #
-    # 1.
-
-    cursor = connection.cursor()
-
-    cursor.execute("""
-
-      SELECT cg.id, cg.name
-        FROM core_charactergroup cg
-
-      """, [pile.id])
-
-    character_group_map = {}
-    for cgid, name in cursor.fetchall():
-        character_group_map[cgid] = name
-
-    # 2.
-
-    cursor = connection.cursor()
-
-    cursor.execute("""
-
-      SELECT c.id, c.short_name, c.friendly_name, c.character_group_id,
-          c.ease_of_observability, c.value_type
-        FROM core_character c
-        WHERE c.pile_id = %s
-
-      """, [pile.id])
-
-    character_map = {}
-    for cid, short_name, name, cgid, ease, value_type in cursor.fetchall():
-        character_map[cid] = {
-            'slug': short_name,
-            'name': name,
-            'group_name': character_group_map[cgid],
-            'ease': ease,
-            'type': value_type,
-            'values': [],
-            }
-
-    # 3.
-
-    cursor.execute("""
-
-      SELECT c.id, cv.id
-        FROM core_character c
-        JOIN core_charactervalue cv ON (c.id = cv.character_id)
-        WHERE c.pile_id = %s
-
-      """, [pile.id])
-
-    character_value_map = {}
-    for cid, cvid in cursor.fetchall():
-        taxonid_list = []  # to be filled in below!
-        character_value_map[cvid] = taxonid_list
-        character_map[cid]['values'].append(taxonid_list)
-
-    # 4.
-
-    cursor.execute("""
-
-      SELECT cv.id, taxon_id
-        FROM core_character c
-        JOIN core_charactervalue cv ON (c.id = cv.character_id)
-        JOIN core_taxoncharactervalue tcv ON (cv.id = tcv.character_value_id)
-        WHERE c.pile_id = %s
-
-      """, [pile.id])
-
-    for cvid, taxonid in cursor.fetchall():
-        character_value_map[cvid].append(taxonid)
-
-    # If you want to gander at the SQL times with the debug toolbar:
-    # from django.http import HttpResponse
-    # return HttpResponse('<html><head></head><body>foo</body>')
-
-    return jsonify(list(character_map.values()), indent=False)
+    try:
+        pile_vectors = vectors.get_pile_vectors(slug)
+    except Pile.DoesNotExist:
+        raise Http404()
+    wire_format = request.GET.get('format')
+    if wire_format not in ('bitset', 'compact'):
+        wire_format = None
+
+    # Serialize each format once, and keep it with the vectors, which
+    # are replaced when the data version changes.
+    payload = pile_vectors.payloads.get(wire_format)
+    if payload is None:
+        if wire_format == 'bitset':
+            value = pile_vectors.as_bitsets()
+        elif wire_format == 'compact':
+            value = encoding.compact(pile_vectors.as_lists())
+        else:
+            value = pile_vectors.as_lists()
+        version, updated = models.DataVersion.objects.stamp()
+        payload = JSONPayload(value, updated)
+        pile_vectors.payloads[wire_format] = payload
+    return payload.serve(request)
 
 
 # Plant diversity maps
 
-def _get_distribution_counts(new_england_distribution_records):
-    state_codes = [code.upper()
-        for code in sorted(settings.STATE_NAMES.keys())]
-    data = []
-
-    # Go state by state, getting all the Distribution records for each.
-    for new_england_state in state_codes:
-        state_plants = set()
-
-        # RULES:
-        # If a distribution record only exists at the state level (this is
-        # usually true for very old herbarium records), add it to the state
-        # count. And note the total number of plants in the state isn't the
-        # sum of plants in each county.
-        #
-        # In a county that includes only the binomial (no variety or
-        # subspecies) add it to the county and state.
-        #
-        # In a county that includes both the binomial and a variety or ssp.
-        # only include the variety or ssp. for the county and state. Do not
-        # add the binomial to the county or the state.
-
-        # Get all the state- and county-level records for this state.
-        all_records_for_state = new_england_distribution_records.filter(
-            state=new_england_state)
-
-        # Get the state-level records.
-        state_level = all_records_for_state.filter(county='')
-
-        state_only_counts = {}
-        for dist_record in state_level:
-            # If a record only exists at the state level for this plant, add
-            # it to the state count.
-            state_only_count = state_only_counts.get(
-                dist_record.scientific_name)
-            if state_only_count:
-                if state_only_count == 1:
-                    # It's already cached in the dictionary, and already counted.
-                    pass
-            else:
-                # Get the state-only count for this plant and cache it.
-                all_records_for_plant = all_records_for_state.filter(
-                    scientific_name=dist_record.scientific_name)
-                state_only_count = all_records_for_plant.count()
-                state_only_counts[
-                    dist_record.scientific_name] = state_only_count
-                if (state_only_count == 1 and
-                        all_records_for_plant.get().subspecific_epithet == ''):
-                    state_plants.add(dist_record.scientific_name)
-
-        # Get the county-level records.
-        county_level = all_records_for_state.exclude(county='')
-
-        county_plants = {}
-        county_binomials_only = {}
-        for dist_record in county_level:
-            # If this is a variety or subspecies, add it to the counts for the
-            # county and state.
-            if dist_record.subspecific_epithet != '':
-                if county_plants.get(dist_record.county):
-                    county_plants[dist_record.county].add(
-                        dist_record.scientific_name)
-                else:
-                    county_plants[dist_record.county] = { # new county
-                        dist_record.scientific_name }
-                state_plants.add(dist_record.scientific_name)
-            else:
-                # If this county has ONLY the binomial (straight species) for
-                # this plant, add it to the county and state counts.
-                binomial_only = False
-                if not county_binomials_only.get(dist_record.county):
-                    county_binomials_only[dist_record.county] = {}
-                if county_binomials_only[dist_record.county].get(
-                        dist_record.species_name):
-                    # Whether this plant has only the binomial in this county
-                    # has already been cached.
-                    binomial_only = county_binomials_only[dist_record.county][
-                        dist_record.species_name]
-                else:
-                    # Determine whether this plant has only the binomial in
-                    # this county, and cache the result.
-                    records_in_county_for_plant = county_level.filter(
-                        county=dist_record.county).filter(
-                        species_name=dist_record.species_name)
-                    # Only one record means there are no var. or ssp. records
-                    # besides, so this county must only have the binomial.
-                    binomial_only = (records_in_county_for_plant.count() == 1)
-                    county_binomials_only[dist_record.county][
-                        dist_record.species_name] = binomial_only
-                if binomial_only:
-                    if county_plants.get(dist_record.county):
-                        county_plants[dist_record.county].add(
-                            dist_record.scientific_name)
-                    else:
-                        county_plants[dist_record.county] = { # new county
-                            dist_record.scientific_name }
-                    state_plants.add(dist_record.scientific_name)
-
-        # Go through all the county counts and output their totals.
-        for county in list(county_plants.keys()):
-            # Append a data line for the county.
-            data.append([new_england_state, county,
-                len(county_plants[county])])
-
-        # Append a data line for the state.
-        data.append([new_england_state, '(all counties)',
-            len(state_plants)])
-
-    data_list = list(data)
-    return data_list
-
-def _get_csv_data(filepath):
-    dir = os.path.dirname(__file__)
-    filename = os.path.join(dir, '../static/data/' + filepath)
-    data = []
-    with open(filename, 'r') as data_file:
-        reader = csv.reader(data_file)
-        for row in reader:
-            data.append(row)
-    return data
-
-def _diversity_map(title, data_filename):
+def _diversity_map(title, kind):
     diversity_map = NewEnglandPlantDiversityMap()
     diversity_map.set_title(title)
-    data = _get_csv_data(data_filename)
-    diversity_map.set_data(data)
+    diversity_map.set_data(diversity.get_counts(kind))
     shaded_map = diversity_map.shade()
     return shaded_map
 
 def new_england_native_diversity_map(request):
-    shaded_map = _diversity_map('Number of native plant taxa',
-        'ne-diversity-map-native.csv')
+    shaded_map = _diversity_map('Number of native plant taxa', 'native')
     return HttpResponse(shaded_map.tostring(), content_type='image/svg+xml')
 
 def new_england_nonnative_diversity_map(request):
     shaded_map = _diversity_map('Number of non-native plant taxa',
-        'ne-diversity-map-nonnative.csv')
+        'nonnative')
     return HttpResponse(shaded_map.tostring(), content_type='image/svg+xml')
 
 def new_england_all_diversity_map(request):
-    shaded_map = _diversity_map('Number of plant taxa',
-        'ne-diversity-map-all.csv')
+    shaded_map = _diversity_map('Number of plant taxa', 'all')
     return HttpResponse(shaded_map.tostring(), content_type='image/svg+xml')
 
-def new_england_native_diversity_csv(request):
+def _diversity_csv(kind):
     response = HttpResponse(content_type='text/csv')
     response['Content-Disposition'] = \
-        'attachment; filename="ne-diversity-map-native.csv"'
-    state_codes = [code.upper()
-        for code in sorted(settings.STATE_NAMES.keys())]
-    natives = models.Distribution.objects.filter(
-        state__in=state_codes).filter(native=True).filter(present=True)
-    data_list = _get_distribution_counts(natives)
+        'attachment; filename="ne-diversity-map-%s.csv"' % kind
     writer = csv.writer(response)
-    for list_item in data_list:
-        writer.writerow(list_item)
+    writer.writerows(diversity.get_counts(kind))
     return response
 
+def new_england_native_diversity_csv(request):
+    return _diversity_csv('native')
+
 def new_england_nonnative_diversity_csv(request):
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = \
-        'attachment; filename="ne-diversity-map-nonnative.csv"'
-    state_codes = [code.upper()
-        for code in sorted(settings.STATE_NAMES.keys())]
-    nonnatives = models.Distribution.objects.filter(
-        state__in=state_codes).filter(native=False).filter(present=True)
-    data_list = _get_distribution_counts(nonnatives)
-    writer = csv.writer(response)
-    for list_item in data_list:
-        writer.writerow(list_item)
-    return response
+    return _diversity_csv('nonnative')
 
 def new_england_all_diversity_csv(request):
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = \
-        'attachment; filename="ne-diversity-map-all.csv"'
-    state_codes = [code.upper()
-        for code in sorted(settings.STATE_NAMES.keys())]
-    all = models.Distribution.objects.filter(
-        state__in=state_codes).filter(present=True)
-    data_list = _get_distribution_counts(all)
-    writer = csv.writer(response)
-    for list_item in data_list:
-        writer.writerow(list_item)
-    return response
+    return _diversity_csv('all')
 
 
 # Plant distribution maps
 
-def _shade_map(distribution_map, genus, epithet):
-    scientific_name = ' '.join([genus.title(), epithet.lower()])
-    distribution_map.set_plant(scientific_name)
-    return distribution_map.shade()
-
-def _compute_map_etag(request, distribution_map, genus, epithet):
-    """Generate an ETag for allowing caching of maps. This requires
-    shading a map upon every request, but saves much bandwidth.
-    """
-    map = copy.deepcopy(distribution_map)
-    shaded_map = _shade_map(map, genus, epithet)
-    h = hashlib.md5()
-    h.update(shaded_map.tostring())
-    return h.hexdigest()
-
-# Disable ETag calculation for now, as it is no longer working in
-# Production, and enabling it with the latest code results in an error.
-@etag(_compute_map_etag)
-def _distribution_map(request, distribution_map, genus, epithet):
+def _distribution_map(request, map_type, genus, epithet):
 
     # BONAP gives one species a different name than FNA; as a temporary
     # measure, we rename the species here.  A more permament solution
@@ -1225,19 +1081,21 @@ def _distribution_map(request, distribution_map, genus, epithet):
     if (genus, epithet) == ('berberis', 'aquifolium'):
         genus, epithet = 'mahonia', 'aquifolium'
 
-    shaded_map = _shade_map(distribution_map, genus, epithet)
-    return HttpResponse(shaded_map.tostring(), content_type='image/svg+xml')
+    scientific_name = ' '.join([genus.title(), epithet.lower()])
+    url = prerendered_url(map_type, scientific_name)
+    if url:
+        return HttpResponseRedirect(url)
+    return HttpResponse(render_map(map_type, scientific_name),
+                        content_type='image/svg+xml')
 
 def new_england_distribution_map(request, genus, epithet):
     """Return a vector map of New England showing county-level
     distribution data for a plant.
     """
-    distribution_map = NewEnglandPlantDistributionMap()
-    return _distribution_map(request, distribution_map, genus, epithet)
+    return _distribution_map(request, 'ne', genus, epithet)
 
 def north_american_distribution_map(request, genus, epithet):
     """Return a vector map of North America showing county-level
     distribution data for a plant.
     """
-    distribution_map = NorthAmericanPlantDistributionMap()
-    return _distribution_map(request, distribution_map, genus, epithet)
+    return _distribution_map(request, 'na', genus, epithet)
@@ -695,6 +695,7 @@ class DistributionAdmin(_Base):
                         county=county, present=present, native=native)
                     record.save()
                     records_created += 1
+            models.DataVersion.objects.bump('distribution')
             # Return to the list page with a message to display.
             message = ('Added %d Distribution records for %s.' %
                 (records_created, scientific_name))
@@ -1,6 +1,6 @@
 """A Python API for complex operations designed for exposure through REST."""
 
-from gobotany.core import models
+from gobotany.core import models, vectors
 
 
 CHAR_MAP = {
@@ -73,6 +73,39 @@ class SpeciesReader(object):
 
             return base_query
 
+    def filter_species(self, pile_slug, selections):
+        """Filter the species of a pile in memory, as the Keys do.
+
+        This answers the same kind of question as ``query_species()``
+        with a ``pile`` and some ``<character_short_name>=<value>``
+        keywords, but against the precomputed vectors of
+        `gobotany.core.vectors` rather than with database joins, and
+        with the rules used by the Simple and Full Keys: a species with
+        no value at all for a character is not ruled out by it, and
+        lengths are given in millimeters.  Besides the character short
+        names, ``family`` and ``genus`` may be given as selections, and
+        empty values are ignored.
+
+        Returns a tuple ``(taxon_ids, counts)`` where ``taxon_ids`` is
+        a sorted list of matching species IDs, and ``counts`` maps each
+        textual character to a dictionary giving, for each of its
+        values, how many species would remain if it were selected::
+
+          taxon_ids, counts = filter_species('lycophytes', {
+              'horizontal_shoot_position_ly': 'on surface',
+              'trophophyll_length_ly': '3',
+              })
+
+        Raises ``Pile.DoesNotExist`` for an unknown pile, and
+        ``Character.DoesNotExist`` for an unknown character.
+
+        """
+        pile_vectors = vectors.get_pile_vectors(pile_slug)
+        selections = {short_name: value for short_name, value
+                      in selections.items() if value not in (None, '')}
+        bits, matches = pile_vectors.query(selections)
+        return pile_vectors.taxa_in(bits), pile_vectors.counts(matches)
+
     def species_images(self, species, max_rank=10, image_types=None):
         """Return a Django query for images of the given `species`.
 
@@ -102,4 +135,5 @@ class SpeciesReader(object):
 
 _species_reader = SpeciesReader()
 query_species = _species_reader.query_species
+filter_species = _species_reader.filter_species
 species_images = _species_reader.species_images
@@ -0,0 +1,241 @@
+"""A compact in-memory copy of the plant distribution records.
+
+The maps, the species list, and the plant diversity counts all need the
+distribution records of many plants, and the ORM returns each of them
+as a full model instance.  Instead we keep the whole table in memory in
+columns: one array each of plant name codes, state codes, county codes,
+and flag bits (present, native, and whether the plant is a variety or
+subspecies), with the strings themselves stored once apiece.  The rows
+are sorted by scientific name, so that the records of a plant are
+adjacent, and those of its varieties and subspecies follow right after;
+a plant's rows are then found with a binary search of the sorted names.
+
+The store is built from a single scan of the table the first time it
+is asked for, and is then kept for the life of the process, until the
+"distribution" `DataVersion` is bumped.
+
+"""
+import sys
+from array import array
+from bisect import bisect_left
+from collections import defaultdict, namedtuple
+
+from django.db import connection
+
+from gobotany.core import models
+
+PRESENT = 1
+NATIVE = 2
+INFRASPECIFIC = 4  # the plant is a variety or subspecies
+
+DistributionRecord = namedtuple(
+    'DistributionRecord', 'scientific_name state county present native')
+
+_store = None  # (data version, DistributionStore)
+
+
+class DistributionStore(object):
+    """The distribution records, column by column."""
+
+    def __init__(self, rows):
+        """Build the store from (scientific_name, species_name,
+        subspecific_epithet, state, county, present, native) rows."""
+        rows = sorted(rows, key=lambda row: (row[0], row[3], row[4]))
+
+        self.names = []          # name code -> scientific name, sorted
+        self.species_names = []  # species code -> species name
+        self.states = []         # state code -> state
+        self.counties = ['']     # county code -> county; 0 is state-level
+        self.name_species = array('I')  # name code -> species code
+        self.starts = array('I')  # name code -> its first row number
+
+        self.name_column = array('I')
+        self.state_column = array('B')
+        self.county_column = array('H')
+        self.flag_column = array('B')
+
+        species_codes = {}
+        state_codes = {}
+        county_codes = {'': 0}
+        self.species_index = defaultdict(list)  # species name -> name codes
+
+        for (scientific_name, species_name, subspecific_epithet, state,
+             county, present, native) in rows:
+            if not self.names or self.names[-1] != scientific_name:
+                name_code = len(self.names)
+                self.names.append(scientific_name)
+                self.starts.append(len(self.name_column))
+                species_code = species_codes.get(species_name)
+                if species_code is None:
+                    species_code = species_codes[species_name] = len(
+                        self.species_names)
+                    self.species_names.append(species_name)
+                self.name_species.append(species_code)
+                self.species_index[species_name].append(name_code)
+
+            state_code = state_codes.get(state)
+            if state_code is None:
+                state_code = state_codes[state] = len(self.states)
+                self.states.append(state)
+            county_code = county_codes.get(county)
+            if county_code is None:
+                county_code = county_codes[county] = len(self.counties)
+                self.counties.append(county)
+
+            self.name_column.append(name_code)
+            self.state_column.append(state_code)
+            self.county_column.append(county_code)
+            self.flag_column.append(
+                (PRESENT if present else 0) | (NATIVE if native else 0)
+                | (INFRASPECIFIC if subspecific_epithet else 0))
+
+        self.starts.append(len(self.name_column))
+        self.species_index = dict(self.species_index)
+
+    def __len__(self):
+        return len(self.name_column)
+
+    # Lookups.
+
+    def name_codes_for_plant(self, scientific_name):
+        """Return the codes of a plant's name and of every name that
+        starts with it followed by a space: its varieties and subspecies.
+
+        These are the same names whose records are returned by
+        `Distribution.objects.all_records_for_plant()`.
+
+        """
+        names = self.names
+        lo = bisect_left(names, scientific_name)
+        # The character after the space sorts after every name that
+        # starts with the space.
+        hi = bisect_left(names, scientific_name + '!', lo)
+        return [code for code in range(lo, hi)
+                if names[code] == scientific_name
+                or names[code].startswith(scientific_name + ' ')]
+
+    def records_for_plant(self, scientific_name):
+        """Return a plant's records, in (scientific name, state, county)
+        order, as a list of `DistributionRecord` tuples."""
+        names = self.names
+        states = self.states
+        counties = self.counties
+        state_column = self.state_column
+        county_column = self.county_column
+        flag_column = self.flag_column
+        records = []
+        for name_code in self.name_codes_for_plant(scientific_name):
+            name = names[name_code]
+            for row in range(self.starts[name_code],
+                             self.starts[name_code + 1]):
+                flags = flag_column[row]
+                records.append(DistributionRecord(
+                    name, states[state_column[row]],
+                    counties[county_column[row]],
+                    bool(flags & PRESENT), bool(flags & NATIVE)))
+        return records
+
+    def present_states(self, species_names, states):
+        """Return the states, among `states`, where each species has a
+        state-level record saying that it is present.
+
+        The species are looked up by species name, so the records of
+        their varieties and subspecies count too.  Returns a dictionary
+        from species name to a set of states.
+
+        """
+        wanted_states = {code for code, state in enumerate(self.states)
+                         if state in states}
+        result = {}
+        for species_name in species_names:
+            found = set()
+            for name_code in self.species_index.get(species_name, ()):
+                for row in range(self.starts[name_code],
+                                 self.starts[name_code + 1]):
+                    if (self.county_column[row] == 0
+                            and self.flag_column[row] & PRESENT
+                            and self.state_column[row] in wanted_states):
+                        found.add(self.states[self.state_column[row]])
+            if found:
+                result[species_name] = found
+        return result
+
+    def rows(self):
+        """Yield every record as a (scientific_name, species_name, state,
+        county, flags) tuple, in scientific name order."""
+        names = self.names
+        species_names = self.species_names
+        name_species = self.name_species
+        states = self.states
+        counties = self.counties
+        for name_code, state_code, county_code, flags in zip(
+                self.name_column, self.state_column, self.county_column,
+                self.flag_column):
+            yield (names[name_code], species_names[name_species[name_code]],
+                   states[state_code], counties[county_code], flags)
+
+    # Accounting.
+
+    def memory_report(self):
+        """Return a list of (part, bytes) giving the store's memory use.
+
+        Arrays are measured whole; lists and dictionaries include their
+        strings but not the strings they share with other parts.
+
+        """
+        def strings(values):
+            return sys.getsizeof(values) + sum(
+                sys.getsizeof(value) for value in values)
+
+        return [
+            ('name column', sys.getsizeof(self.name_column)),
+            ('state column', sys.getsizeof(self.state_column)),
+            ('county column', sys.getsizeof(self.county_column)),
+            ('flag column', sys.getsizeof(self.flag_column)),
+            ('name row offsets', sys.getsizeof(self.starts)),
+            ('scientific names', strings(self.names)),
+            ('species names', strings(self.species_names)
+             + sys.getsizeof(self.name_species)),
+            ('species index', sys.getsizeof(self.species_index) + sum(
+                sys.getsizeof(codes)
+                for codes in self.species_index.values())),
+            ('states and counties',
+             strings(self.states) + strings(self.counties)),
+            ]
+
+
+def build_store():
+    """Read the distribution records from the database into a store."""
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT scientific_name, species_name, subspecific_epithet,
+               state, county, present, native
+          FROM core_distribution
+        """)
+
+    def fetch():
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            yield from rows
+
+    return DistributionStore(fetch())
+
+
+def get_store():
+    """Return the `DistributionStore`, building it if the distribution
+    data has changed since it was last built."""
+    global _store
+    version = models.DataVersion.objects.current('distribution')
+    if _store is not None and _store[0] == version:
+        return _store[1]
+    store = build_store()
+    _store = (version, store)
+    return store
+
+
+def reset():
+    """Forget the store, so that the next `get_store()` rebuilds it."""
+    global _store
+    _store = None
@@ -5,10 +5,9 @@ code located at:
   http://onlamp.com/pub/a/python/2006/02/09/ai_decision_trees.html?page=1
 '''
 import math
-from collections import defaultdict
 
-from gobotany.core.models import (Character, CharacterValue, Parameter,
-                                  TaxonCharacterValue)
+from gobotany.core import memo, vectors
+from gobotany.core.models import Character, Parameter
 
 def compute_character_entropies(pile, species_list):
     """Find the most effective characters for narrowing down these species.
@@ -18,96 +17,71 @@ def compute_character_entropies(pile, species_list):
         (character_id, entropy, coverage)
 
     """
-    # We start by fetching the character values for this pile (ignoring
+    # Rather than querying the database, we work from the in-memory
+    # vectors of the pile (see gobotany.core.vectors), which hold each
+    # character value as a bitset of the species that have it.  Ignoring
     # "NA" values, since they really state that a character doesn't
-    # apply to a species), and then selecting the TaxonCharacterValue
-    # rows that match one of these character values with one of the
-    # species given in `species_list`.
-
-    cv_list = list(CharacterValue.objects
-                   .filter(character__pile=pile)
-                   .exclude(value_str='NA')
-                   .exclude(value_min=0.0, value_max=0.0))
-    taxon_character_values = TaxonCharacterValue.objects.filter(
-        taxon__in=species_list, character_value__in=cv_list).values_list(
-            'character_value_id', 'taxon_id').iterator()
-
-    # Since Django's ORM will stupidly re-query the database if we ask
-    # for the ".character_value" of one of these TaxonCharacterValue
-    # objects, we put these character values in a dictionary by ID so
-    # that we can get them more quickly ourselves.  We also go ahead and
-    # group them by character_id, and also make a dictionary of
-    # character ids keyed by character-value ids.
-
-    cv_by_id = {}
-    cv_by_character_id = defaultdict(set)
-    char_ids_by_charval_id = {}
-    for cv in cv_list:
-        cv_id = cv.id
-        cv_by_id[cv_id] = cv
-        char_id = cv.character_id
-        cv_by_character_id[char_id].add(cv)
-        char_ids_by_charval_id[cv_id] = char_id
+    # apply to a species, all we then need to learn about the species in
+    # `species_list` can be had by intersecting their bitset with each
+    # character value's bitset and counting the bits that remain.
+
+    pile_vectors = vectors.get_pile_vectors(pile.slug)
+    species_bits = pile_vectors.bits_for(
+        getattr(species, 'id', species) for species in species_list)
 
     # To compute a character's entropy, we need to know two things:
     #
     # 1. How many species total are touched by that character's values.
     #    If a particular species is linked to two of the character's
     #    values ("this plant has blue flowers AND red flowers"), then
-    #    the species still only gets counted once.
-    #
-    #    So we create a "character_species" dictionary that maps
-    #    character IDs to species-ID sets, and count the length of each
-    #    set of species IDs when we are done.
+    #    the species still only gets counted once - which the union of
+    #    the value bitsets takes care of for us.
     #
-    # 2. How many times each character value is used.  So we create a
-    #    character_value_counts dictionary.
+    # 2. How many times each character value is used, which is simply
+    #    the number of bits its bitset shares with our species.
     #
-    # Both of these data structures are populated very simply, by
-    # iterating once across our taxon_character_values query.
-
-    character_species = defaultdict(set)
-    cv_counts = defaultdict(int)
-
-    for cv_id, taxon_id in taxon_character_values:
-        cv = cv_by_id[cv_id]
-        character_id = char_ids_by_charval_id[cv_id]
-        character_species[character_id].add(taxon_id)
-        cv_counts[cv] += 1
-
-    # Finally, we are ready to compute the entropies!  We tally up the
-    # value "n * log n" for each character value in a character, then
-    # divide the result by the total number of species touched by that
-    # character.  We also throw in to our result, just for good measure,
-    # a "coverage" fraction indicating how many of the species we are
-    # looking at are touched by each character.
+    # We then tally up the value "n * log n" for each character value in
+    # a character, and divide the result by the total number of species
+    # touched by that character.  We also throw in to our result, just
+    # for good measure, a "coverage" fraction indicating how many of the
+    # species we are looking at are touched by each character.
 
     n = float(len(species_list))
 
     result = []
-    for character_id, cv_set in list(cv_by_character_id.items()):
-        species_set = character_species[character_id]
+    for short_name, character_id in pile_vectors.character_ids.items():
+        cv_list = [choice for choice in pile_vectors.choices[short_name]
+                   if not choice.is_na()]
+        if not cv_list:
+            continue
+
+        species_set_bits = 0
+        cv_counts = {}
+        for cv in cv_list:
+            bits = cv.bits & species_bits
+            species_set_bits |= bits
+            cv_counts[cv] = bits.bit_count()
+        species_count = species_set_bits.bit_count()
 
-        # To avoid the expense of fetching characters from the database,
-        # we use a random character value to guess whether this is a
-        # textual or numeric character.
+        # As before we moved to vectors, we use the first character
+        # value to guess whether this is a textual or numeric character.
 
-        cv = next(iter(cv_set))  # random element without removing it
+        cv = cv_list[0]
         if cv.value_str is not None:
-            ne = _text_entropy(cv_set, species_set, cv_counts)
+            ne = _text_entropy(cv_list, species_count, cv_counts)
         elif cv.value_min is not None or cv.value_max is not None:
-            ne = _length_entropy(cv_set, species_set, cv_counts)
+            ne = _length_entropy(cv_list, species_count, cv_counts)
         else:
             ne = 1e10  # hopefully someone reviewing best-characters notices
 
         entropy = ne / n
-        coverage = len(species_set) / n
+        coverage = species_count / n
         result.append((character_id, entropy, coverage))
 
     return result
 
 
-def _text_entropy(cv_set, species_set, cv_counts):
+def _text_entropy(cv_set, species_count, cv_counts):
     """Compute the info-gain from choosing a value of a text character."""
     tally = 0.0
     for cv in cv_set:
@@ -117,7 +91,7 @@ def _text_entropy(cv_set, species_set, cv_counts):
     return tally
 
 
-def _length_entropy(cv_set, species_set, cv_counts):
+def _length_entropy(cv_set, species_count, cv_counts):
     """Compute the info-gain from choosing a value of a length character."""
     #
     # This routine runs along a range of length values, and pretends
@@ -208,7 +182,28 @@ def get_weights():
 
 
 def rank_characters(pile, species_list):
-    """Returns a list of (score, entropy, coverage, character), best first."""
+    """Returns a list of (score, entropy, coverage, character), best first.
+
+    Since users who make the same first few choices in a key ask about
+    exactly the same species, rankings are memoized by pile and species
+    list; see gobotany.core.memo.
+
+    """
+    species_ids = sorted(int(getattr(species, 'id', species))
+                         for species in species_list)
+    ranking = memo.memoize(
+        'rank_characters', (pile.id, species_ids),
+        lambda: _rank_character_ids(pile, species_ids),
+        )
+    characters = Character.objects.select_related('character_group').in_bulk(
+        [character_id for score, entropy, coverage, character_id in ranking])
+    return [(score, entropy, coverage, characters[character_id])
+            for score, entropy, coverage, character_id in ranking
+            if character_id in characters]
+
+
+def _rank_character_ids(pile, species_list):
+    """Returns a list of (score, entropy, coverage, character_id)."""
     celist = compute_character_entropies(pile, species_list)
     result = []
 
@@ -227,7 +222,7 @@ def rank_characters(pile, species_list):
         ease = character.ease_of_observability
         score = compute_score(entropy, coverage, ease, char_value_type,
                               coverage_weight, ease_weight, length_weight)
-        result.append((score, entropy, coverage, character))
+        result.append((score, entropy, coverage, character_id))
 
     result.sort()
     return result
@@ -0,0 +1,548 @@
+"""Audit the taxon images and thumbnails in our S3 bucket.
+
+No image directory should allow itself to be listed, while all images
+and thumbnails should allow themselves to be downloaded, with the right
+content-type and cache-control headers.  Every image should also have a
+thumbnail of each size, and no thumbnail should outlive its image.  The
+auditor fixes whatever it finds wrong.
+
+Checking an object takes an HTTP HEAD request, and there are hundreds
+of thousands of objects, so the auditor keeps a manifest: a JSON file
+that remembers the ETag and size of every object it has seen, whether
+the object passed its checks, and which thumbnails each image has.  On
+the next run only the objects that are new, that have changed, or that
+failed their checks last time are checked again, and only the images
+that have changed get new thumbnails.  The checks run in a pool of
+threads, since they spend their time waiting on the network, while the
+thumbnails are made in a bounded pool of processes.
+
+The bucket is reached through a small interface with two implementations:
+`S3Bucket`, for Amazon S3, and `DirectoryBucket`, which keeps its objects
+as files in a local directory so that the auditor can be tried out, and
+tested, without S3.
+
+"""
+import argparse
+import hashlib
+import io
+import json
+import math
+import mimetypes
+import os
+import socket
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+IMAGE_PREFIX = 'taxon-images/'
+CACHE_CONTROL = 'max-age=28800, public'
+THUMBNAIL_SIZES = '160x149', '239x239', '1000s1000'
+DRAFT_REDUCING_GAP = 1.0  # raise to decode larger, for smoother thumbnails
+
+ObjectInfo = namedtuple('ObjectInfo', 'key etag size')
+Head = namedtuple('Head', 'status content_type cache_control')
+
+
+class S3Bucket(object):
+    """A bucket on Amazon S3.
+
+    Public access is checked the way the public sees it, with anonymous
+    HTTP requests; one HTTP session is kept open for each thread, and
+    the S3 hostname is looked up only once.
+
+    """
+    def __init__(self, name):
+        if boto3 is None or requests is None:
+            raise RuntimeError('auditing S3 needs the "boto3" and'
+                               ' "requests" packages')
+        self.name = name
+        self.client = boto3.client('s3')
+        self.hostname = '{}.s3.amazonaws.com'.format(name)
+        self.cached_ip = socket.gethostbyname(self.hostname)
+        self.local = threading.local()
+
+    def list(self, prefix):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.name, Prefix=prefix):
+            for item in page.get('Contents', ()):
+                yield ObjectInfo(item['Key'], item['ETag'].strip('"'),
+                                 item['Size'])
+
+    def head(self, key):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        url = 'http://{}/{}'.format(self.cached_ip, key)
+        r = session.head(url, headers={'Host': self.hostname})
+        return Head(r.status_code, r.headers.get('content-type'),
+                    r.headers.get('cache-control'))
+
+    def make_private(self, key):
+        self.client.put_object_acl(Bucket=self.name, Key=key, ACL='private')
+
+    def publish(self, key, content_type):
+        """Make an object public, with the right headers."""
+        self.client.copy_object(
+            Bucket=self.name, Key=key,
+            CopySource={'Bucket': self.name, 'Key': key},
+            ACL='public-read', CacheControl=CACHE_CONTROL,
+            ContentType=content_type, MetadataDirective='REPLACE')
+
+    def read(self, key):
+        return self.client.get_object(Bucket=self.name, Key=key)['Body'].read()
+
+    def write(self, key, data, content_type):
+        """Save a public object; return its new `ObjectInfo`."""
+        r = self.client.put_object(
+            Bucket=self.name, Key=key, Body=data, ACL='public-read',
+            CacheControl=CACHE_CONTROL, ContentType=content_type)
+        return ObjectInfo(key, r['ETag'].strip('"'), len(data))
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.name, Key=key)
+
+
+class DirectoryBucket(object):
+    """A stand-in for an S3 bucket, that keeps objects in a directory.
+
+    The headers and the public flag of each object are kept beside it
+    in a ``.meta`` file; an object without one is private, like an
+    object uploaded to S3 without an ACL.
+
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def list(self, prefix):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith('.meta'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    yield ObjectInfo(key, hashlib.md5(data).hexdigest(),
+                                     len(data))
+
+    def metadata(self, key):
+        try:
+            with open(self.path(key) + '.meta') as f:
+                return json.load(f)
+        except IOError:
+            return {'public': False}
+
+    def set_metadata(self, key, **metadata):
+        with open(self.path(key) + '.meta', 'w') as f:
+            json.dump(metadata, f)
+
+    def head(self, key):
+        if not os.path.exists(self.path(key)):
+            return Head(404, None, None)
+        metadata = self.metadata(key)
+        if not metadata['public']:
+            return Head(403, None, None)
+        return Head(200, metadata['content_type'], metadata['cache_control'])
+
+    def make_private(self, key):
+        self.set_metadata(key, public=False)
+
+    def publish(self, key, content_type):
+        self.set_metadata(key, public=True, content_type=content_type,
+                          cache_control=CACHE_CONTROL)
+
+    def read(self, key):
+        with open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def write(self, key, data, content_type):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.publish(key, content_type)
+        return ObjectInfo(key, hashlib.md5(data).hexdigest(), len(data))
+
+    def delete(self, key):
+        for path in (self.path(key), self.path(key) + '.meta'):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def open_bucket(location):
+    """Open ``s3://bucket-name``, or else a local directory."""
+    if location.startswith('s3://'):
+        return S3Bucket(location[len('s3://'):])
+    return DirectoryBucket(location)
+
+
+# The manifest.
+
+def load_manifest(path):
+    """Return the manifest saved at `path`, or an empty one."""
+    try:
+        with open(path) as f:
+            text = f.read()
+    except IOError:
+        return {}
+    return json.loads(text) if text.strip() else {}
+
+
+def save_manifest(path, manifest):
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(manifest, f, indent=0, sort_keys=True)
+    os.replace(temporary_path, path)
+
+
+def is_unchanged(manifest, info):
+    """Return whether an object passed its checks and has not changed."""
+    entry = manifest.get(info.key)
+    return (entry is not None and entry['ok'] and entry['etag'] == info.etag
+            and entry['size'] == info.size)
+
+
+# Checks.
+
+def check_directory(bucket, key):
+    """Make a directory private if it is not; return the problems found."""
+    head = bucket.head(key)
+    if head.status != 403:
+        bucket.make_private(key)
+        return ['Status code {} != 403 - making private'.format(head.status)]
+    return []
+
+
+def check_image(bucket, key):
+    """Make an image public, with the right headers, if it is not;
+    return the problems found."""
+    if not key.endswith('.jpg'):
+        return ['Unrecognized image extension']
+
+    head = bucket.head(key)
+    correct_type = content_type_for(key)
+    if head.status != 200:
+        problem = 'Making image public; status code was {}'.format(
+            head.status)
+    elif head.content_type != correct_type:
+        problem = 'Fixing bad content-type: {}'.format(head.content_type)
+    elif head.cache_control != CACHE_CONTROL:
+        problem = 'Fixing bad cache-control value: {}'.format(
+            head.cache_control)
+    else:
+        return []
+    bucket.publish(key, correct_type)
+    return [problem]
+
+
+def check_object(bucket, key):
+    if key.endswith('/'):
+        return check_directory(bucket, key)
+    return check_image(bucket, key)
+
+
+# Thumbnails, which are made in worker processes that each open the
+# bucket for themselves.
+
+_bucket = None
+
+
+def _init_worker(location):
+    global _bucket
+    _bucket = open_bucket(location)
+
+
+def decode_size(image_size, sizes):
+    """Return how large an image must be decoded to make its thumbnails.
+
+    This is the size that the largest thumbnail needs, times
+    `DRAFT_REDUCING_GAP`, but never more than the full size.  A draft
+    decode is never smaller than it is asked to be, so each thumbnail
+    is still resampled down from at least as many pixels as it has.
+
+    """
+    width, height = image_size
+    scale = 0.0
+    for size in sizes:
+        operator, (w, h) = THUMBNAIL_CALLS[size]
+        if operator is cropped_thumbnail:
+            scale = max(scale, w / width, h / height)
+        else:
+            scale = max(scale, min(w / width, h / height))
+    scale = min(1.0, scale * DRAFT_REDUCING_GAP)
+    return int(math.ceil(width * scale)), int(math.ceil(height * scale))
+
+
+def thumbnail_images(data, sizes):
+    """Return a dict of the JPEG bytes of an image's thumbnails by size.
+
+    The image is decoded only once for all of the sizes.  A JPEG is
+    decoded in draft mode, which lets the decoder skip straight to 1/2,
+    1/4, or 1/8 scale; our photographs are several times larger than
+    even the largest thumbnail, so most of the decoding work is saved.
+
+    """
+    im = Image.open(io.BytesIO(data))
+    im.draft(im.mode, decode_size(im.size, sizes))
+    im.load()
+    thumbnails = {}
+    for size in sizes:
+        operator, arg = THUMBNAIL_CALLS[size]
+        thumbnail = operator(im.copy(), arg)
+        output = io.BytesIO()
+        thumbnail.save(output, 'JPEG')
+        thumbnails[size] = output.getvalue()
+    return thumbnails
+
+
+def make_thumbnails(job):
+    """Make and save thumbnails of an image in the given sizes.
+
+    Returns the image key, the `ObjectInfo` of each thumbnail made, and
+    a (size, message) pair for each thumbnail that could not be made.
+
+    """
+    image_key, sizes = job
+    try:
+        thumbnails = thumbnail_images(_bucket.read(image_key), sizes)
+    except IOError as e:
+        return image_key, [], [(size, str(e)) for size in sizes]
+    made = [_bucket.write(thumbnail_key(size, image_key), data, 'image/jpeg')
+            for size, data in sorted(thumbnails.items())]
+    return image_key, made, []
+
+
+def generate_thumbnails(location, jobs, processes=None):
+    """Make thumbnails across a pool of processes.
+
+    Each job is an ``(image_key, sizes)`` pair naming an image in the
+    bucket at `location`; for each job, yields what `make_thumbnails()`
+    returns, in the same order as the jobs.
+
+    """
+    with ProcessPoolExecutor(processes, initializer=_init_worker,
+                             initargs=(location,)) as executor:
+        yield from executor.map(make_thumbnails, jobs)
+
+
+# The audit.
+
+class Auditor(object):
+    """Audit the images and thumbnails of a bucket, and fix them."""
+
+    def __init__(self, location, manifest_path, threads=16, processes=None,
+                 family=None, out=sys.stdout):
+        self.location = location
+        self.bucket = open_bucket(location)
+        self.manifest_path = manifest_path
+        self.threads = threads
+        self.processes = processes
+        self.family = family
+        self.out = out
+
+        self.t0 = time.time()
+        self.checked_count = 0
+        self.unchanged_count = 0
+        self.thumbnail_count = 0
+        self.deleted_count = 0
+        self.error_count = 0
+
+    def run(self):
+        old_manifest = load_manifest(self.manifest_path)
+        manifest = {}
+
+        prefix = IMAGE_PREFIX
+        if self.family:
+            prefix += self.family + '/'
+        images = {info.key: info for info in self.bucket.list(prefix)
+                  if image_name(info.key) is not None}
+
+        # Thumbnails whose image is gone are deleted; the rest are
+        # noted as present on their image.
+
+        objects = list(images.values())
+        thumbnails = {key: set() for key in images}
+        for size in THUMBNAIL_SIZES:
+            prefix = 'taxon-images-{}/'.format(size)
+            if self.family:
+                prefix += self.family + '/'
+            for info in self.bucket.list(prefix):
+                if info.key.endswith('/'):
+                    objects.append(info)
+                    continue
+                image_key = IMAGE_PREFIX + info.key.split('/', 1)[1]
+                if image_key not in images:
+                    self.error(info.key, 'Thumbnail is an orphan; deleting')
+                    self.bucket.delete(info.key)
+                    self.deleted_count += 1
+                    continue
+                objects.append(info)
+                thumbnails[image_key].add(size)
+
+        # Check every object that is new, changed, or was bad before.
+
+        pending = []
+        for info in objects:
+            if is_unchanged(old_manifest, info):
+                manifest[info.key] = old_manifest[info.key]
+                self.unchanged_count += 1
+            else:
+                pending.append(info)
+
+        with ThreadPoolExecutor(self.threads) as executor:
+            results = executor.map(
+                lambda info: check_object(self.bucket, info.key), pending)
+            for info, problems in zip(pending, results):
+                self.checked_count += 1
+                for problem in problems:
+                    self.error(info.key, problem)
+                manifest[info.key] = {'etag': info.etag, 'size': info.size,
+                                      'ok': not problems}
+
+        # Make the missing thumbnails, and new ones for changed images.
+
+        jobs = []
+        for key, info in sorted(images.items()):
+            old_entry = old_manifest.get(key)
+            if old_entry is not None and old_entry['etag'] != info.etag:
+                sizes = list(THUMBNAIL_SIZES)
+                self.error(key, 'Image has changed; generating new'
+                           ' thumbnails')
+            else:
+                sizes = [size for size in THUMBNAIL_SIZES
+                         if size not in thumbnails[key]]
+                for size in sizes:
+                    self.error(key, 'Image is missing its {} thumbnail;'
+                               ' generating'.format(size))
+            if sizes:
+                jobs.append((key, sizes))
+
+        if jobs:
+            for image_key, made, errors in generate_thumbnails(
+                    self.location, jobs, self.processes):
+                for info in made:
+                    manifest[info.key] = {'etag': info.etag,
+                                          'size': info.size, 'ok': True}
+                    thumbnails[image_key].add(
+                        info.key.split('/', 1)[0][len('taxon-images-'):])
+                    self.thumbnail_count += 1
+                for size, message in errors:
+                    self.error(image_key, 'Thumbnail operation failed: {}'
+                               .format(message))
+
+        for key in images:
+            manifest[key]['thumbnails'] = sorted(thumbnails[key])
+
+        # An audit of one family keeps what is known about the others.
+
+        if self.family:
+            for key, entry in old_manifest.items():
+                if family_of(key) != self.family:
+                    manifest.setdefault(key, entry)
+
+        save_manifest(self.manifest_path, manifest)
+        return manifest
+
+    # Error reporting and statistics.
+
+    def error(self, key, message):
+        print(key, file=self.out)
+        print(' ', message, file=self.out)
+        self.error_count += 1
+
+    def final_report(self):
+        elapsed = time.time() - self.t0
+        print(file=self.out)
+        print('Scan took {:.2f} seconds'.format(elapsed), file=self.out)
+        print('Checked {} objects'.format(self.checked_count), file=self.out)
+        print('Skipped {} unchanged objects'.format(self.unchanged_count),
+              file=self.out)
+        print('Made {} thumbnails'.format(self.thumbnail_count),
+              file=self.out)
+        print('Deleted {} orphan thumbnails'.format(self.deleted_count),
+              file=self.out)
+        print('Found {} errors'.format(self.error_count), file=self.out)
+
+
+# Names.
+
+def image_name(key):
+    """Return the name of an image from its key, or None if the key
+    does not name an image directly beneath a family directory."""
+    parts = key.split('/')
+    if len(parts) != 3 or not parts[2]:
+        return None
+    return parts[2]
+
+
+def family_of(key):
+    parts = key.split('/')
+    return parts[1] if len(parts) > 2 else None
+
+
+def thumbnail_key(size, image_key):
+    return 'taxon-images-{}/{}'.format(size, image_key.split('/', 1)[1])
+
+
+def content_type_for(key):
+    content_type, encoding = mimetypes.guess_type(key)
+    if content_type is None:
+        content_type = 'image/jpeg'
+    return content_type
+
+
+def cropped_thumbnail(image, size):
+    return ImageOps.fit(image, size, Image.LANCZOS)
+
+
+def scaled_thumbnail(image, size):
+    image.thumbnail(size, Image.LANCZOS)
+    return image
+
+
+THUMBNAIL_CALLS = {
+    '160x149': (cropped_thumbnail, (160, 149)),
+    '239x239': (cropped_thumbnail, (239, 239)),
+    '1000s1000': (scaled_thumbnail, (1000, 1000)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('location', nargs='?', default='s3://newfs',
+                        help='s3://bucket-name, or a local directory'
+                        ' (default: s3://newfs)')
+    parser.add_argument('--manifest', default='s3imagecheck-manifest.json',
+                        help='file in which to remember what was checked')
+    parser.add_argument('--family',
+                        help='audit only the images of this family')
+    parser.add_argument('--threads', type=int, default=16,
+                        help='objects to check at the same time')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='processes making thumbnails'
+                        ' (default: one per CPU)')
+    args = parser.parse_args(argv)
+
+    auditor = Auditor(args.location, args.manifest, args.threads,
+                      args.processes, args.family)
+    auditor.run()
+    auditor.final_report()
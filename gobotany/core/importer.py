@@ -1,16 +1,21 @@
 import argparse
 import csv
 import gzip
+import hashlib
 import inspect
+import io
 import logging
+import multiprocessing
 import os
 import re
 import shutil
 import sys
+import time
 import xlrd
 import zipfile
 from bs4 import BeautifulSoup
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from functools import partial
 from operator import attrgetter
 
@@ -21,7 +26,7 @@ from gobotany.core import rebuild
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.files.storage import default_storage
-from django.db import connection, transaction
+from django.db import connection, connections as db_connections, transaction
 from django.template.defaultfilters import slugify
 from django.urls import reverse
 
@@ -32,11 +37,20 @@ from gobotany.core.pile_suffixes import pile_suffixes
 from gobotany.search.models import (GroupsListPage, PlainPage,
                                     SubgroupResultsPage, SubgroupsListPage)
 from gobotany.simplekey.groups_order import ordered_pilegroups, ordered_piles
-from gobotany.site.models import PlantNameSuggestion, SearchSuggestion
+from gobotany.site import suggestions as site_suggestions
+from gobotany.site.models import SearchSuggestion
 
 DEBUG=False
 log = logging.getLogger('gobotany.import')
 
+csv_rows_read = [0]  # rows read by open_csv() in this process
+
+# The taxon image listing is the output of "s3cmd ls -r", whose lines
+# end with the URL of an image: "s3://newfs/taxon-images/Family/x.jpg".
+s3_path_pattern = re.compile(r' s3://\w+/(.*)')
+image_type_pattern = re.compile(r'(-[a-z]{2}-)')
+image_extensions = ('jpg', 'gif', 'png', 'tif')
+
 def start_logging():
     # Log everything to the import.log file.
 
@@ -66,6 +80,7 @@ def open_csv(data_file, lower=True):
     if lower:
         names = [ name.lower() for name in names ]
     for row in r:
+        csv_rows_read[0] += 1
         yield dict(list(zip(names, (s for s in row))))
 
 class CSVReader(object):
@@ -498,6 +513,8 @@ class Importer(object):
         commonname_table.save(delete_old=True)
         synonym_table.replace('taxon_id', taxon_map)
         synonym_table.save(delete_old=True)
+        # Maps look up distribution records under synonyms, too.
+        models.DataVersion.objects.bump('distribution')
         invasivestatus_table.replace('taxon_id', taxon_map)
         invasivestatus_table.save(delete_old=True)
 
@@ -574,7 +591,9 @@ class Importer(object):
     def import_plant_name_suggestions(self):
         log.info('Setting up plant name suggestions')
 
-        PlantNameSuggestion.objects.all().delete()
+        # Deleting through the ORM would send a signal per suggestion
+        # to update its keys, which are rebuilt below all at once.
+        connection.cursor().execute('DELETE FROM site_plantnamesuggestion')
 
         db = bulkup.Database(connection)
         names = set()
@@ -594,6 +613,8 @@ class Importer(object):
             table.get(name=name)
         table.save()
 
+        site_suggestions.rebuild_keys('plant_name')
+
 
     def import_conservation_statuses(self, statuses_file):
         log.info('Importing conservation statuses')
@@ -679,104 +700,127 @@ class Importer(object):
         unknown_characters = set()
         unknown_character_values = set()
 
+        # Cells repeat the same few values over and over, so each
+        # distinct value is parsed only once.
+        text_values = {}    # (character_id, cell) -> [cv_id, ...]
+        length_values = {}  # cell -> float, or None to skip the cell
+
         for filename in filenames:
             log.info('Loading %s', filename)
 
-            suffixes = []
-            for row in open_csv(filename, lower=False):
-                # Look for a column name that ends with _litsrc in order
-                # to reliably extract the pile suffix for these CSV files.
-                for colname in list(row.keys()):
-                    if colname.endswith('_litsrc'):
-                        suffix = colname[-10:-7]
-                        suffixes.append(suffix)
-                        break
-                break
+            # Do *not* lower() column names; case is important!
+            reader = csv.reader(filename.open())
+            header = next(reader, [])
 
-            if len(suffixes) == 0:
+            # Look for a column name that ends with _litsrc in order
+            # to reliably extract the pile suffix for these CSV files.
+            suffix = None
+            for colname in header:
+                if colname.endswith('_litsrc'):
+                    suffix = colname[-10:-7]
+                    break
+
+            if suffix is None:
                 log.error('No pile suffixes to process.')
+                continue
 
-            for suffix in suffixes:
-                log.info('Creating TaxonCharacterValues for: %s', suffix)
-                pile_id = None
+            log.info('Creating TaxonCharacterValues for: %s', suffix)
+            pile_id = pile_map.get(suffix)
+            name_column = header.index('Scientific__Name')
+
+            # Work out once, from the header, what each column holds:
+            # (column number, short name, character ID, kind of value).
+            plan = []
+            if pile_id is not None:
+                for column, character_name in enumerate(header):
+                    lowered = character_name.lower()
+                    if '_min' in lowered:
+                        kind = 'min'
+                    elif '_max' in lowered:
+                        kind = 'max'
+                    else:
+                        kind = 'text'
+                    short_name = shorten_character_name(character_name)
+                    plan.append((column, short_name,
+                                 character_map.get(short_name), kind))
+
+            for row in reader:
+                csv_rows_read[0] += 1
+
+                # Look up the taxon.
+                taxon_id = taxon_map.get(row[name_column])
+                if taxon_id is None:
+                    log.error('Unknown taxon: %r', row[name_column])
+                    continue
 
-                # Do *not* lower() column names; case is important!
-                for row in open_csv(filename, lower=False):
+                # Create a structure for tracking whether both min and
+                # max values have been seen for this character, in order
+                # to avoid creating unnecessary CharacterValues.
+                length_pairs = defaultdict(lambda: [None, None])
 
-                    # Look up the taxon.
-                    taxon_id = taxon_map.get(row['Scientific__Name'])
-                    if taxon_id is None:
-                        log.error('Unknown taxon: %r',
-                                  row['Scientific__Name'])
+                for column, short_name, character_id, kind in plan:
+                    if column >= len(row):
+                        continue
+                    v = row[column]
+                    if not v.strip():
                         continue
 
-                    # Create a structure for tracking whether both min and
-                    # max values have been seen for this character, in order
-                    # to avoid creating unnecessary CharacterValues.
-                    length_pairs = defaultdict(lambda: [None, None])
-
-                    # Go through the key/value pairs for this row.
-                    for character_name, v in list(row.items()):
-                        if not v.strip():
-                            continue
-
-                        pile_id = pile_map.get(suffix)
-                        if pile_id is None:
-                            continue
-
-                        short_name = shorten_character_name(character_name)
-
-                        character_id = character_map.get(short_name)
-                        if character_id is None:
-                            unknown_characters.add(short_name)
-                            continue
+                    if character_id is None:
+                        unknown_characters.add(short_name)
+                        continue
 
-                        is_min = '_min' in character_name.lower()
-                        is_max = '_max' in character_name.lower()
+                    if kind == 'text':
+                        # We can create normal tcv rows very simply.
+                        cv_ids = text_values.get((character_id, v))
+                        if cv_ids is None:
+                            cv_ids = text_values[character_id, v] = []
+                            for value_str in v.split('|'):
+                                cvkey = (character_id, value_str.strip())
+                                cv_id = cv_map.get(cvkey)
+                                if cv_id is None:
+                                    unknown_character_values.add(cvkey)
+                                else:
+                                    cv_ids.append(cv_id)
+                        for cv_id in cv_ids:
+                            tcv_table.get(
+                                taxon_id=taxon_id,
+                                character_value_id=cv_id,
+                                )
+                        continue
 
-                        if is_min or is_max:
-                            if v == 'n/a':
-                                continue
+                    if v in length_values:
+                        numv = length_values[v]
+                    else:
+                        numv = None
+                        if v != 'n/a':
                             try:
                                 numv = float(v)
                             except ValueError:
                                 bad_float_values.add(v)
-                                continue
+                        length_values[v] = numv
+                    if numv is None:
+                        continue
 
-                            index = 0 if is_min else 1
-                            length_pairs[short_name][index] = numv
+                    index = 0 if kind == 'min' else 1
+                    length_pairs[short_name][index] = numv
 
-                        else:
-                            # We can create normal tcv rows very simply.
+                # Now we have seen both the min and max of every range.
 
-                            for value_str in v.split('|'):
-                                value_str = value_str.strip()
-                                cvkey = (character_id, value_str)
-                                cv_id = cv_map.get(cvkey)
-                                if cv_id is None:
-                                    unknown_character_values.add(cvkey)
-                                    continue
-                                tcv_table.get(
-                                    taxon_id=taxon_id,
-                                    character_value_id=cv_id,
-                                    )
-
-                    # Now we have seen both the min and max of every range.
-
-                    for character_name, (vmin,
-                                         vmax) in length_pairs.items():
-                        character_id = character_map[character_name]
-                        cv_table.get(
-                            character_id=character_id,
-                            value_min=vmin,
-                            value_max=vmax,
-                            ).set(
-                            friendly_text='',
-                            )
-                        tcv_table.get(
-                            taxon_id=taxon_id,
-                            character_value_id=(character_id, vmin, vmax),
-                            )
+                for character_name, (vmin, vmax) in length_pairs.items():
+                    character_id = character_map[character_name]
+                    cv_table.get(
+                        character_id=character_id,
+                        value_min=vmin,
+                        value_max=vmax,
+                        ).set(
+                        friendly_text='',
+                        )
+                    tcv_table.get(
+                        taxon_id=taxon_id,
+                        character_value_id=(character_id, vmin, vmax),
+                        )
+
+            filename.close()
 
         for s in sorted(bad_float_values):
             log.debug('Bad floating-point value: %s', s)
@@ -1157,14 +1201,21 @@ class Importer(object):
     def _get_species_for_image_filename(self, filename):
         """Parse an image filename and return the species to which it
         pertains, with some relevant image information.
+
+        Raises ValueError, whose message says what is wrong, for a
+        filename that cannot be parsed.
         """
-        pattern = re.compile(r'(-[a-z]{2}-)')
-        parts = pattern.split(filename)
+        parts = image_type_pattern.split(filename)
+        if len(parts) < 3:
+            raise ValueError('filename lacks an image type code')
         name = parts[0].split('-')
         image_type = parts[1][1:3]
         end_parts = parts[2].split('-')
         photographer = end_parts[0]
-        rank = len(end_parts) > 1 and int(end_parts[1]) or None
+        try:
+            rank = len(end_parts) > 1 and int(end_parts[1]) or None
+        except ValueError:
+            raise ValueError('filename has a bad rank')
         genus = name[0]
 
         # Support the use of underscores in filenames to indicate
@@ -1216,13 +1267,29 @@ class Importer(object):
         core_dir = os.path.dirname(os.path.abspath(__file__))
         image_categories_csv = os.path.join(core_dir, 'image_categories.csv')
 
-        taxon_image_types = {}
+        pile_image_types = defaultdict(dict)  # pile name -> code -> type
         for row in open_csv(PlainFile('.', image_categories_csv)):
             # lower() is important because case is often mismatched
-            # between the official name of a pile and its name here
-            key = (row['pile'].lower(), row['code'])
+            # between the official name of a pile and its name here.
             # The category looks like "bark, ba" so we split on the comma
-            taxon_image_types[key] = row['category'].rsplit(',', 1)[0]
+            pile_image_types[row['pile'].lower()][row['code']] = (
+                row['category'].rsplit(',', 1)[0])
+
+        # The image types of a taxon are those of its piles, with its
+        # first pile winning if two piles use the same code.  They are
+        # looked up once per taxon, instead of once per image.
+
+        taxon_image_types = {}
+
+        def image_types_of(taxon_id):
+            image_types = taxon_image_types.get(taxon_id)
+            if image_types is None:
+                image_types = taxon_image_types[taxon_id] = {}
+                for pile_id in taxonpile_map[taxon_id]:
+                    pile_name = pile_names[pile_id].lower()
+                    for code, name in pile_image_types[pile_name].items():
+                        image_types.setdefault(code, name)
+            return image_types
 
         # We expect our image storage to contain directories named by
         # family, with taxon images beneath them (but we ignore the
@@ -1234,29 +1301,46 @@ class Importer(object):
         log.info('Scanning S3 for taxon images')
 
         lsgz = default_storage.open('ls-taxon-images.gz')
-        ls = gzip.GzipFile(fileobj=lsgz)
+        ls = io.TextIOWrapper(gzip.GzipFile(fileobj=lsgz), encoding='utf-8')
 
         count = 0
         already_seen = {}
 
+        # Rather than logging every bad file as an error, we count the
+        # bad files for each reason, and log each file only at the
+        # debug level, which goes to import.log.
+        errors = Counter()
+
+        def skip(reason, filename):
+            errors[reason] += 1
+            log.debug('  %s: %s', reason, filename)
+
         for line in ls:
-            image_path = re.split(' s3://\w+/', line)[1].strip()
+            match = s3_path_pattern.search(line)
+            if match is None:
+                skip('line lacks an S3 path', line.strip())
+                continue
+            image_path = match.group(1).strip()
             dirname, filename = image_path.rsplit('/', 1)
             if '.' not in filename:
-                log.error('  file lacks an extension: %s', filename)
+                skip('file lacks an extension', filename)
                 continue
             if filename.count('.') > 1:
-                log.error('  filename has multiple periods: %s', filename)
+                skip('filename has multiple periods', filename)
                 continue
             name, ext = filename.split('.')
-            if ext.lower() not in ('jpg', 'gif', 'png', 'tif'):
-                log.error('  file lacks image extension: %s', filename)
+            if ext.lower() not in image_extensions:
+                skip('file lacks image extension', filename)
                 continue
 
             # With an acceptable-looking image filename, parse it to find
             # the species.
 
-            species = self._get_species_for_image_filename(name)
+            try:
+                species = self._get_species_for_image_filename(name)
+            except ValueError as e:
+                skip(str(e), filename)
+                continue
 
             # Find the Taxon corresponding to this species.
 
@@ -1271,24 +1355,19 @@ class Importer(object):
                 taxon_id = taxon_ids.get(scientific_name)
 
                 if taxon_id is None:
-                    log.error('  image names unknown taxon: %s', filename)
+                    skip('image names unknown taxon', filename)
                     continue
 
             # Get the image type, now that we know what pile the
             # species belongs in.
 
-            for pile_id in taxonpile_map[taxon_id]:
-                key = (pile_names[pile_id].lower(), species['image_type'])
-                if key in taxon_image_types:
-                    break
-            else:
-                log.error('  unknown image type %r: %s',
-                          species['image_type'], filename)
+            image_type_code = species['image_type']
+            image_type_name = image_types_of(taxon_id).get(image_type_code)
+            if image_type_name is None:
+                skip('unknown image type %r' % image_type_code, filename)
                 continue
 
             # Fetch or create a row representing this image type.
-            image_type_code = key[1]
-            image_type_name = taxon_image_types[key]
             table_imagetype.get(name=image_type_name, code=image_type_code)
 
             rank = species['rank']
@@ -1328,6 +1407,8 @@ class Importer(object):
         table_contentimage.replace('image_type_id', imagetype_map)
         table_contentimage.save()
 
+        for reason, n in sorted(errors.items()):
+            log.error('  skipped %d files: %s', n, reason)
         log.info('Imported %d taxon images', count)
 
     def import_home_page_images(self, db):
@@ -1658,7 +1739,7 @@ class Importer(object):
             county=county,
             )
 
-        current_nativity = distribution_row.__dict__.get('native') or None
+        current_nativity = distribution_row.get('native') or None
         if is_present == True:
             distribution_row.set(present=True)
             if current_nativity != False:
@@ -1703,6 +1784,7 @@ class Importer(object):
                                           status_column_name)
 
         distribution.save()
+        models.DataVersion.objects.bump('distribution')
 
 
     def import_videos(self, db, videofilename):
@@ -1963,7 +2045,7 @@ class Importer(object):
         """Set up the search-suggestions table"""
         log.info('Setting up search suggestions')
 
-        SearchSuggestion.objects.all().delete()
+        connection.cursor().execute('DELETE FROM site_searchsuggestion')
 
         db = bulkup.Database(connection)
         terms = set()
@@ -2016,6 +2098,8 @@ class Importer(object):
             if created:
                 log.info('  New SearchSuggestion: %s' % suggestion)
 
+        site_suggestions.rebuild_keys('search')
+
 # Split a multiple value string like u'foo| bar'
 
 def pipe_split(text):
@@ -2121,81 +2205,132 @@ def import_partner_species(partner_short_name, excel_file):
 
 # Routines for doing full import.
 
+class ImportStep(object):
+    """One step of a full import.
+
+    A step calls `function` with the data files named in `filenames`
+    (a name starting with "!" is passed as a plain string instead), and
+    cannot start until every step named in `after` has finished.
+
+    """
+    def __init__(self, name, function, filenames=(), after=()):
+        self.name = name
+        self.function = function
+        self.filenames = tuple(filenames)
+        self.after = tuple(after)
+
+taxon_character_value_files = (
+    'pile_angiosperms_1.csv',
+    'pile_angiosperms_1a.csv',
+    'pile_angiosperms_2.csv',
+    'pile_angiosperms_3.csv',
+    'pile_carex_1.csv',
+    'pile_carex_2.csv',
+    'pile_composites_1.csv',
+    'pile_composites_2.csv',
+    'pile_composites_3.csv',
+    'pile_composites_4.csv',
+    'pile_composites_5.csv',
+    'pile_equisetaceae.csv',
+    'pile_gymnosperms_1.csv',
+    'pile_gymnosperms_2.csv',
+    'pile_lycophytes.csv',
+    'pile_monilophytes.csv',
+    'pile_non_orchid_monocots_1.csv',
+    'pile_non_orchid_monocots_2.csv',
+    'pile_non_orchid_monocots_3.csv',
+    'pile_non_thalloid_aquatics_1a.csv',
+    'pile_non_thalloid_aquatics_1b.csv',
+    'pile_non_thalloid_aquatics_2.csv',
+    'pile_orchid_monocots.csv',
+    'pile_poaceae_1.csv',
+    'pile_poaceae_1a.csv',
+    'pile_poaceae_2.csv',
+    'pile_remaining_graminoids_1a.csv',
+    'pile_remaining_graminoids_1b.csv',
+    'pile_remaining_non_monocots_1.csv',
+    'pile_remaining_non_monocots_2.csv',
+    'pile_remaining_non_monocots_2a.csv',
+    'pile_remaining_non_monocots_2b.csv',
+    'pile_remaining_non_monocots_3.csv',
+    'pile_remaining_non_monocots_3a.csv',
+    'pile_remaining_non_monocots_3b.csv',
+    'pile_remaining_non_monocots_4.csv',
+    'pile_remaining_non_monocots_5.csv',
+    'pile_remaining_non_monocots_6.csv',
+    'pile_remaining_non_monocots_7.csv',
+    'pile_remaining_non_monocots_8.csv',
+    'pile_thalloid_aquatics.csv',
+    )
+
 full_import_steps = (
-    (Importer.import_partner_sites,),
-    (Importer.import_pile_groups, 'pile_group_info.csv'),
-    (Importer.import_piles, 'pile_info.csv'),
-    (Importer.import_families, 'families.csv'),
-    (Importer.import_genera, 'genera.csv'),
-    (Importer.import_wetland_indicators, 'wetland_indicators.csv'),
-    (Importer.import_taxa, 'taxa.csv'),
-    (Importer.import_conservation_statuses, 'conservation_status.csv'),
-    (Importer.import_characters, 'characters.csv'),
-    (Importer.import_character_values, 'character_values.csv'),
-    (Importer.import_glossary, 'glossary.csv'),
-    (Importer.import_lookalikes, 'lookalikes-raw.csv'),
-    (Importer.import_places, 'habitats.csv', 'taxa.csv'),
-    (Importer.import_videos, 'videos.csv'),
-    (Importer.import_constants, 'characters.csv'),
-    (Importer.import_copyright_holders, 'copyright_holders.csv'),
-    (Importer.import_plant_name_suggestions,),
-
-    (Importer.import_distributions,
-     'New-England-tracheophyte-county-level-nativity.csv'),
-    (Importer.import_distributions, 'bonap-north-america.csv'),
-
-    (Importer.import_taxon_character_values,
-     'pile_angiosperms_1.csv',
-     'pile_angiosperms_1a.csv',
-     'pile_angiosperms_2.csv',
-     'pile_angiosperms_3.csv',
-     'pile_carex_1.csv',
-     'pile_carex_2.csv',
-     'pile_composites_1.csv',
-     'pile_composites_2.csv',
-     'pile_composites_3.csv',
-     'pile_composites_4.csv',
-     'pile_composites_5.csv',
-     'pile_equisetaceae.csv',
-     'pile_gymnosperms_1.csv',
-     'pile_gymnosperms_2.csv',
-     'pile_lycophytes.csv',
-     'pile_monilophytes.csv',
-     'pile_non_orchid_monocots_1.csv',
-     'pile_non_orchid_monocots_2.csv',
-     'pile_non_orchid_monocots_3.csv',
-     'pile_non_thalloid_aquatics_1a.csv',
-     'pile_non_thalloid_aquatics_1b.csv',
-     'pile_non_thalloid_aquatics_2.csv',
-     'pile_orchid_monocots.csv',
-     'pile_poaceae_1.csv',
-     'pile_poaceae_1a.csv',
-     'pile_poaceae_2.csv',
-     'pile_remaining_graminoids_1a.csv',
-     'pile_remaining_graminoids_1b.csv',
-     'pile_remaining_non_monocots_1.csv',
-     'pile_remaining_non_monocots_2.csv',
-     'pile_remaining_non_monocots_2a.csv',
-     'pile_remaining_non_monocots_2b.csv',
-     'pile_remaining_non_monocots_3.csv',
-     'pile_remaining_non_monocots_3a.csv',
-     'pile_remaining_non_monocots_3b.csv',
-     'pile_remaining_non_monocots_4.csv',
-     'pile_remaining_non_monocots_5.csv',
-     'pile_remaining_non_monocots_6.csv',
-     'pile_remaining_non_monocots_7.csv',
-     'pile_remaining_non_monocots_8.csv',
-     'pile_thalloid_aquatics.csv',
-     ),
-
-    (import_partner_species, '!concord', 'concord-species-list-and-blurbs.xlsx'),
-    (import_partner_species, '!montshire', 'montshire-species-list.xls'),
-    (import_partner_species, '!partner', 'partersite-sample-species-lists.xls'),
-    (rebuild.rebuild_default_filters, 'characters.csv'),
-    (rebuild.rebuild_plant_of_the_day, '!SIMPLEKEY'),
-
-    (gobotany.dkey.import_csv.import_illustrative_species,
-     'dkey_illustrative_species.csv'),
+    ImportStep('partner-sites', Importer.import_partner_sites),
+    ImportStep('pile-groups', Importer.import_pile_groups,
+               ['pile_group_info.csv']),
+    ImportStep('piles', Importer.import_piles, ['pile_info.csv'],
+               after=['pile-groups']),
+    ImportStep('families', Importer.import_families, ['families.csv']),
+    ImportStep('genera', Importer.import_genera, ['genera.csv'],
+               after=['families']),
+    ImportStep('wetland-indicators', Importer.import_wetland_indicators,
+               ['wetland_indicators.csv']),
+    ImportStep('taxa', Importer.import_taxa, ['taxa.csv'],
+               after=['partner-sites', 'piles', 'genera',
+                      'wetland-indicators']),
+    ImportStep('conservation-statuses', Importer.import_conservation_statuses,
+               ['conservation_status.csv'], after=['taxa']),
+    ImportStep('characters', Importer.import_characters, ['characters.csv'],
+               after=['piles']),
+    ImportStep('character-values', Importer.import_character_values,
+               ['character_values.csv'], after=['characters']),
+    ImportStep('glossary', Importer.import_glossary, ['glossary.csv']),
+    ImportStep('lookalikes', Importer.import_lookalikes,
+               ['lookalikes-raw.csv'], after=['taxa']),
+    ImportStep('places', Importer.import_places, ['habitats.csv', 'taxa.csv'],
+               after=['taxa', 'character-values']),
+    ImportStep('videos', Importer.import_videos, ['videos.csv'],
+               after=['piles']),
+    # The pages, preview characters, and suggestions are built from
+    # nearly everything loaded before them.
+    ImportStep('constants', Importer.import_constants, ['characters.csv'],
+               after=['partner-sites', 'piles', 'genera', 'taxa',
+                      'characters', 'places', 'videos', 'glossary']),
+    ImportStep('copyright-holders', Importer.import_copyright_holders,
+               ['copyright_holders.csv']),
+    ImportStep('plant-name-suggestions',
+               Importer.import_plant_name_suggestions, after=['taxa']),
+
+    # Both distribution files load the same table, so they take turns.
+    ImportStep('distributions-new-england', Importer.import_distributions,
+               ['New-England-tracheophyte-county-level-nativity.csv']),
+    ImportStep('distributions-north-america', Importer.import_distributions,
+               ['bonap-north-america.csv'],
+               after=['distributions-new-england']),
+
+    # The places step writes habitat values into the same table.
+    ImportStep('taxon-character-values',
+               Importer.import_taxon_character_values,
+               taxon_character_value_files,
+               after=['taxa', 'character-values', 'places']),
+
+    # Each partner's species list rewrites the same table, too.
+    ImportStep('partner-concord', import_partner_species,
+               ['!concord', 'concord-species-list-and-blurbs.xlsx'],
+               after=['taxa']),
+    ImportStep('partner-montshire', import_partner_species,
+               ['!montshire', 'montshire-species-list.xls'],
+               after=['partner-concord']),
+    ImportStep('partner-sample', import_partner_species,
+               ['!partner', 'partersite-sample-species-lists.xls'],
+               after=['partner-montshire']),
+    ImportStep('default-filters', rebuild.rebuild_default_filters,
+               ['characters.csv'], after=['characters', 'places']),
+    ImportStep('plant-of-the-day', rebuild.rebuild_plant_of_the_day,
+               ['!SIMPLEKEY'], after=['partner-sample']),
+
+    ImportStep('dkey-illustrative-species',
+               gobotany.dkey.import_csv.import_illustrative_species,
+               ['dkey_illustrative_species.csv']),
     )
 
 
@@ -2227,6 +2362,18 @@ class PlainFile(object):
         self.openfiles.append(f)
         return f
 
+    def checksum(self):
+        """Return a hash of the file contents."""
+        h = hashlib.sha1()
+        try:
+            f = open(self.path, 'rb')
+        except IOError:
+            raise CannotOpen(self.path)
+        with f:
+            for block in iter(partial(f.read, 65536), b''):
+                h.update(block)
+        return h.hexdigest()
+
     def close(self):
         for f in self.openfiles:
             f.close()
@@ -2250,14 +2397,23 @@ class ZipMember(object):
     def __str__(self):
         return self.name
 
-    def open(self, mode='rU'):
+    def open(self, mode='r'):
         try:
-            f = self.zipfileobj.open(self.name, mode)
+            f = io.TextIOWrapper(self.zipfileobj.open(self.name, mode),
+                                 encoding='Windows-1252', newline='')
         except KeyError:
             raise CannotOpen(self.name)
         self.openfiles.append(f)
         return f
 
+    def checksum(self):
+        """Return the CRC and size that the zip file records for us."""
+        try:
+            info = self.zipfileobj.getinfo(self.name)
+        except KeyError:
+            raise CannotOpen(self.name)
+        return '%08x-%d' % (info.CRC, info.file_size)
+
     def close(self):
         for f in self.openfiles:
             f.close()
@@ -2270,6 +2426,33 @@ def ziplist():
             print(filename)
 
 
+def fetch_data_source(name):
+    """Return the local zipfile or directory to import data from.
+
+    When `name` is None, the most recent data zipfile on Amazon S3 is
+    downloaded, unless it is already present, and its name returned.
+
+    """
+    if name is None:
+        print('Searching S3 for the most recent data zip file ...')
+        directories, filenames = default_storage.listdir('/data/')
+        name = sorted([ f for f in filenames if f.endswith('.zip') ])[-1]
+        print('Most recent data zip file is:')
+        print()
+        print('   ', name)
+        print()
+        if os.path.exists(name):
+            print('Using copy already present on filesystem')
+        else:
+            print('Downloading', name, '...')
+            with open(name, 'wb') as dst:
+                with default_storage.open('/data/' + name) as src:
+                    shutil.copyfileobj(src, dst)
+            print('Done')
+
+    return name
+
+
 def get_data_fileopener(name):
     """Return a ``fileopener()`` function for opening import data files.
 
@@ -2292,22 +2475,7 @@ def get_data_fileopener(name):
         system by simply naming the directory.
 
     """
-    if name is None:
-        print('Searching S3 for the most recent data zip file ...')
-        directories, filenames = default_storage.listdir('/data/')
-        name = sorted([ f for f in filenames if f.endswith('.zip') ])[-1]
-        print('Most recent data zip file is:')
-        print()
-        print('   ', name)
-        print()
-        if os.path.exists(name):
-            print('Using copy already present on filesystem')
-        else:
-            print('Downloading', name, '...')
-            with open(name, 'w') as dst:
-                with default_storage.open('/data/' + name) as src:
-                    shutil.copyfileobj(src, dst)
-            print('Done')
+    name = fetch_data_source(name)
 
     if os.path.isdir(name):
         fileopener = partial(PlainFile, name)
@@ -2326,7 +2494,7 @@ def get_data_fileopener(name):
     return fileopener
 
 
-def zipimport(name):
+def zipimport(name, jobs=1, changed_only=False):
     """Does a full database load from CSV files in a zip file or directory.
 
     If you do not specify a filename or directory name, then an attempt
@@ -2338,37 +2506,223 @@ def zipimport(name):
     for a complete import.  Use the separate "ziplist" command if you
     need to review which zip files are available on S3.
 
+    With more than one job, independent import steps run at the same
+    time in separate worker processes, each step as soon as the steps
+    it depends on are done; each step then commits on its own, instead
+    of the whole import committing together.
+
+    Every step records checksums of the files it read.  With
+    --changed-only, a step is skipped if its files have not changed
+    since it last ran and none of the steps it runs after is run again;
+    so a new glossary.csv reloads only the glossary and the constants
+    built from it, while a new taxa.csv reloads the taxa and everything
+    that is built from them.  (All of the pile spreadsheets belong to
+    the one "taxon-character-values" step, so a new copy of any one of
+    them reloads the taxon character values of every pile.)
+
     """
-    fileopener = get_data_fileopener(name)
-    importer_self = Importer()
+    name = fetch_data_source(name)
+    start = time.time()
+    if jobs > 1:
+        timings = run_steps_in_parallel(name, jobs, changed_only)
+    else:
+        fileopener = get_data_fileopener(name)
+        importer_self = Importer()
+        manifest = load_manifest()
+        rerun = set()
+        timings = []
+        for step in full_import_steps:
+            checksums = step_checksums(step, fileopener)
+            if changed_only and step_is_current(
+                    step, checksums, manifest, rerun):
+                print('Skipping unchanged step', step.name)
+                continue
+            rerun.add(step.name)
+            timings.append(
+                run_step(step, importer_self, fileopener, checksums))
+    print_timing_report(timings, time.time() - start)
+
 
+def find_step(step_name):
     for step in full_import_steps:
-        function = step[0]
-        args = []
-        if takes_self_arg(function):
-            args.append(importer_self)
-        if takes_db_arg(function):
-            db = bulkup.Database(connection)  # fresh instance for each import!
-            args.append(db)
-        filenames = step[1:]
-        args.extend(
-            fn[1:] if fn.startswith('!') else fileopener(fn)
-            for fn in filenames
-            )
-        print()
-        print('Calling', function.__name__ + '()')
-        print()
+        if step.name == step_name:
+            return step
+    raise KeyError(step_name)
 
-        wrapped_function = transaction.atomic(function)
-        try:
-            wrapped_function(*args)
-        except CannotOpen as e:
-            log.info('Canceling import step: %s', str(e))
+
+def step_checksums(step, fileopener):
+    """Return a dict of checksums of the files that a step reads.
+
+    Arguments that are not files, like the nickname of a partner site,
+    stand for themselves.  A file that cannot be opened has a checksum
+    of None.  A step that reads no files at all gets the single entry
+    ``{'': ''}``, so that its having run can be recorded too.
+
+    """
+    checksums = {}
+    for fn in step.filenames:
+        if fn.startswith('!'):
+            checksums[fn] = fn[1:]
             continue
-        finally:
-            for arg in args:
-                if hasattr(arg, 'close'):
-                    arg.close()
+        try:
+            checksums[fn] = fileopener(fn).checksum()
+        except CannotOpen:
+            checksums[fn] = None
+    return checksums or {'': ''}
+
+
+def load_manifest():
+    """Return the recorded checksums as a dict of dicts, by step name."""
+    manifest = defaultdict(dict)
+    for step_name, filename, checksum in models.ImportedFile.objects \
+            .values_list('step', 'filename', 'checksum'):
+        manifest[step_name][filename] = checksum
+    return manifest
+
+
+def step_is_current(step, checksums, manifest, rerun):
+    """Return whether a step's last run already loaded these files.
+
+    A step is never current if any of the steps it runs after are in
+    `rerun`, the set of steps being run again, or if any of its files
+    are missing.
+
+    """
+    if rerun.intersection(step.after) or None in checksums.values():
+        return False
+    return manifest.get(step.name) == checksums
+
+
+def record_step(step, checksums):
+    """Remember the checksums of the files that a step has just read."""
+    models.ImportedFile.objects.bulk_create(
+        models.ImportedFile(step=step.name, filename=filename,
+                            checksum=checksum)
+        for filename, checksum in sorted(checksums.items())
+        if checksum is not None
+        )
+
+
+def run_step(step, importer_self, fileopener, checksums=None):
+    """Run one import step; return its name, seconds, and CSV rows read.
+
+    If the step completes, and `checksums` of its files are given, they
+    are recorded in the same transaction as the step's own changes.
+
+    """
+    function = step.function
+    args = []
+    if takes_self_arg(function):
+        args.append(importer_self)
+    if takes_db_arg(function):
+        db = bulkup.Database(connection)  # fresh instance for each import!
+        args.append(db)
+    args.extend(
+        fn[1:] if fn.startswith('!') else fileopener(fn)
+        for fn in step.filenames
+        )
+    print()
+    print('Calling', function.__name__ + '()', 'for step', step.name)
+    print()
+
+    def run_and_record():
+        # Forgetting the old checksums first, before the step reads
+        # anything, makes the step take its write lock right away on
+        # SQLite, where two steps that each read and then try to write
+        # would otherwise fail with "database is locked".  (The ORM's
+        # delete() would read before writing.)
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM core_importedfile WHERE step = %s',
+                       [step.name])
+        function(*args)
+        if checksums is not None:
+            record_step(step, checksums)
+
+    start = time.time()
+    rows_before = csv_rows_read[0]
+    wrapped_function = transaction.atomic(run_and_record)
+    try:
+        wrapped_function()
+    except CannotOpen as e:
+        log.info('Canceling import step: %s', str(e))
+    finally:
+        for arg in args:
+            if hasattr(arg, 'close'):
+                arg.close()
+    return step.name, time.time() - start, csv_rows_read[0] - rows_before
+
+
+def _run_step_in_worker(step_name, name, checksums):
+    return run_step(find_step(step_name), Importer(),
+                    get_data_fileopener(name), checksums)
+
+
+def run_steps_in_parallel(name, jobs, changed_only=False):
+    """Run the full import steps across `jobs` worker processes.
+
+    A step is started as soon as all of the steps it runs after have
+    finished, or skipped if `changed_only` and its files are unchanged.
+    Returns the timings of the steps in the order they ended.
+
+    """
+    names = set(step.name for step in full_import_steps)
+    for step in full_import_steps:
+        unknown = set(step.after) - names
+        if unknown:
+            raise ValueError('step %s runs after unknown steps: %s'
+                             % (step.name, ', '.join(sorted(unknown))))
+
+    fileopener = get_data_fileopener(name)
+    manifest = load_manifest()
+
+    # Each worker must open its own database connection.
+    db_connections.close_all()
+
+    waiting = list(full_import_steps)
+    done = set()
+    rerun = set()
+    running = {}
+    timings = []
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(jobs, mp_context=context) as executor:
+        while waiting or running:
+            # The steps are listed after the steps they depend on, so
+            # a single pass also starts the steps after a skipped one.
+            for step in list(waiting):
+                if done.issuperset(step.after):
+                    waiting.remove(step)
+                    checksums = step_checksums(step, fileopener)
+                    if changed_only and step_is_current(
+                            step, checksums, manifest, rerun):
+                        print('Skipping unchanged step', step.name)
+                        done.add(step.name)
+                        continue
+                    rerun.add(step.name)
+                    future = executor.submit(
+                        _run_step_in_worker, step.name, name, checksums)
+                    running[future] = step
+            if not running:
+                if not waiting:
+                    break
+                raise ValueError('import steps depend on each other in a'
+                                 ' cycle: ' + ', '.join(
+                                     step.name for step in waiting))
+            finished, pending = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                timings.append(future.result())
+                done.add(step.name)
+    return timings
+
+
+def print_timing_report(timings, elapsed):
+    print()
+    print('%-32s %10s %10s' % ('Step', 'Seconds', 'CSV rows'))
+    for step_name, seconds, rows in timings:
+        print('%-32s %10.1f %10d' % (step_name, seconds, rows))
+    print('%-32s %10.1f' % ('Total of the steps',
+                            sum(seconds for n, seconds, r in timings)))
+    print('%-32s %10.1f' % ('Wall time', elapsed))
 
 # Utilities.
 
@@ -2392,17 +2746,17 @@ def _extract_scientific_name(name):
 # Parse the command line.
 
 def takes_self_arg(callable):
-    spec = inspect.getargspec(callable)
+    spec = inspect.getfullargspec(callable)
     return spec.args[0:1] == ['self']
 
 def takes_db_arg(callable):
-    spec = inspect.getargspec(callable)
+    spec = inspect.getfullargspec(callable)
     if spec.args[0:1] == ['self']:
         del spec.args[0]
     return spec.args[0:1] == ['db']
 
 def takes_data_source(callable):
-    spec = inspect.getargspec(callable)
+    spec = inspect.getfullargspec(callable)
     if spec.args[0:1] == ['self']:
         del spec.args[0]
     if spec.args[0:1] == ['db']:
@@ -2410,7 +2764,7 @@ def takes_data_source(callable):
     return spec.args == ['data_source_name']
 
 def takes_single_filename(callable):
-    spec = inspect.getargspec(callable)
+    spec = inspect.getfullargspec(callable)
     if spec.args[0:1] == ['self']:
         del spec.args[0]
     if spec.args[0:1] == ['db']:
@@ -2418,7 +2772,7 @@ def takes_single_filename(callable):
     return spec.args == ['filename']
 
 def takes_many_filenames(callable):
-    spec = inspect.getargspec(callable)
+    spec = inspect.getfullargspec(callable)
     if spec.args[0:1] == ['self']:
         del spec.args[0]
     if spec.args[0:1] == ['db']:
@@ -2473,6 +2827,16 @@ def main():
         help='S3 zipfile, local zipfile, or directory; omit this argument'
         ' to force the latest zipfile to be downloaded from S3',
         )
+    sub.add_argument(
+        '--jobs', type=int, default=1,
+        help='worker processes for running independent import steps at'
+        ' the same time (default: 1, which imports in a single transaction)',
+        )
+    sub.add_argument(
+        '--changed-only', action='store_true',
+        help='skip the import steps whose files have not changed since'
+        ' they were last imported',
+        )
 
     args = parser.parse_args()
 
@@ -2486,6 +2850,10 @@ def main():
         function_args.append(args.partner)
     if hasattr(args, 'file_or_directory'):
         function_args.append(args.file_or_directory)
+    if hasattr(args, 'jobs'):
+        function_args.append(args.jobs)
+    if hasattr(args, 'changed_only'):
+        function_args.append(args.changed_only)
     if hasattr(args, 'data_source'):
         function_args.append(args.data_source)
     if hasattr(args, 'filename'):
@@ -2493,8 +2861,15 @@ def main():
     if hasattr(args, 'filenames'):
         function_args.extend(PlainFile('.', f) for f in args.filenames)
 
-    wrapped_function = transaction.atomic(function)
-    wrapped_function(*function_args)
+    if getattr(args, 'jobs', 1) > 1:
+        # The parallel steps commit separately, in their own processes.
+        function(*function_args)
+    else:
+        wrapped_function = transaction.atomic(function)
+        wrapped_function(*function_args)
+
+    # Let the web processes know that their precomputed data is stale.
+    models.DataVersion.objects.bump()
 
 if __name__ == '__main__':
     main()
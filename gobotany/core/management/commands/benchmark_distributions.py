@@ -0,0 +1,69 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from gobotany.core import distributions
+from gobotany.core.models import Distribution, Taxon
+
+
+class Command(BaseCommand):
+    """Compare the in-memory distribution store with the ORM.
+
+    Reports how much memory each part of the store takes, and then
+    times the lookups that the maps and the species list make: the
+    records of each plant, and the New England states where each
+    species is present.  Example, for the first 500 plants:
+
+    dev/django benchmark_distributions --plants 500
+    """
+    help = 'Benchmarks distribution lookups against the ORM'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plants', type=int, default=200,
+                            help='plants to look up (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        store = distributions.build_store()
+        self.report('build store', time.perf_counter() - start)
+
+        self.stdout.write('Memory used by %d records:' % len(store))
+        total = 0
+        for part, size in store.memory_report():
+            self.stdout.write('  %-22s %12d bytes' % (part, size))
+            total += size
+        self.stdout.write('  %-22s %12d bytes' % ('total', total))
+
+        names = list(Taxon.objects.order_by('scientific_name').values_list(
+            'scientific_name', flat=True)[:options['plants']])
+        states = [state.upper() for state in settings.STATE_NAMES]
+
+        def orm_records():
+            for name in names:
+                list(Distribution.objects.all_records_for_plant(name))
+
+        def store_records():
+            for name in names:
+                store.records_for_plant(name)
+
+        def orm_states():
+            list(Distribution.objects.filter(present=True).filter(
+                county__exact='').filter(state__in=states).filter(
+                species_name__in=names).values_list('species_name', 'state'))
+
+        def store_states():
+            store.present_states(names, states)
+
+        for label, method in [
+                ('records, ORM', orm_records),
+                ('records, store', store_records),
+                ('species states, ORM', orm_states),
+                ('species states, store', store_states),
+                ]:
+            start = time.perf_counter()
+            method()
+            self.report(label, time.perf_counter() - start)
+
+    def report(self, label, elapsed):
+        self.stdout.write('%-24s %10.2f ms' % (label, elapsed * 1000.0))
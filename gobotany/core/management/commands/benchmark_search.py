@@ -0,0 +1,117 @@
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from haystack import connections
+from haystack.query import SearchQuerySet
+
+from gobotany.site.models import SearchSuggestion
+
+ALIAS = 'benchmark_sqlite'
+
+
+class Command(BaseCommand):
+    """Compare the SQLite search backend with Solr.
+
+    Every search index is built into a new SQLite index file, reporting
+    the time and documents per second for each, and then every Nth
+    search suggestion is searched for the way the search page does it:
+    the query, highlighted, plus its exact name, counted and then the
+    first page of results fetched.  If the default connection is Solr,
+    and it answers, the same searches are timed against it; with
+    --rebuild-solr its index is first rebuilt and timed too, which
+    leaves the site without search results for as long as it takes.
+    Example, searching every 50th suggestion:
+
+    dev/django benchmark_search --every 50
+    """
+    help = 'Benchmarks the SQLite search backend against Solr'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=int, default=100,
+                            help='search for every Nth search suggestion'
+                            ' (default: %(default)s)')
+        parser.add_argument('--rebuild-solr', action='store_true',
+                            help='also rebuild the Solr index and time it')
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp()
+        settings.HAYSTACK_CONNECTIONS[ALIAS] = {
+            'ENGINE': 'gobotany.search.sqlite_backend.SQLiteEngine',
+            'PATH': os.path.join(directory, 'search.sqlite3'),
+            }
+        try:
+            self.benchmark(options)
+        finally:
+            del settings.HAYSTACK_CONNECTIONS[ALIAS]
+            shutil.rmtree(directory)
+
+    def benchmark(self, options):
+        queries = list(SearchSuggestion.objects.order_by('term').values_list(
+            'term', flat=True)[::options['every']])
+
+        aliases = [ALIAS]
+        solr_engine = 'haystack.backends.solr_backend.SolrEngine'
+        if settings.HAYSTACK_CONNECTIONS['default']['ENGINE'] != solr_engine:
+            self.stdout.write('(the default connection is not Solr)')
+        else:
+            try:
+                connections['default'].get_backend().conn.search('*:*')
+            except Exception as e:
+                self.stdout.write('(Solr is unavailable: %s)' % e)
+            else:
+                aliases.append('default')
+
+        for alias in aliases:
+            label = 'solr' if alias == 'default' else 'sqlite'
+            if alias == ALIAS or options['rebuild_solr']:
+                self.build(alias, label)
+            self.search(alias, label, queries)
+
+    def build(self, alias, label):
+        """Rebuild every index of a connection, timing each."""
+        backend = connections[alias].get_backend()
+        unified_index = connections[alias].get_unified_index()
+        backend.clear()
+        total_start = time.perf_counter()
+        for model in sorted(unified_index.get_indexed_models(),
+                            key=lambda model: model.__name__):
+            index = unified_index.get_index(model)
+            objects = list(index.index_queryset(using=alias))
+            start = time.perf_counter()
+            for i in range(0, len(objects), backend.batch_size):
+                backend.update(index, objects[i:i + backend.batch_size])
+            elapsed = time.perf_counter() - start
+            self.stdout.write('%-32s %10.2f ms  (%d documents, %.0f/s)' % (
+                '%s, build %s' % (label, model.__name__), elapsed * 1000.0,
+                len(objects), len(objects) / elapsed if elapsed else 0))
+        self.stdout.write('%-32s %10.2f ms' % (
+            '%s, build all' % label,
+            (time.perf_counter() - total_start) * 1000.0))
+
+    def search(self, alias, label, queries):
+        """Time searches like those of the search page."""
+        if not queries:
+            return
+        timings = []
+        hits = 0
+        for query in queries:
+            start = time.perf_counter()
+            name = ' '.join(re.findall(r'\w+', query)).lower()
+            results = (SearchQuerySet(using=alias).auto_query(query)
+                       .highlight().filter_or(name__exact=name))
+            hits += results.count()
+            list(results[:settings.HAYSTACK_SEARCH_RESULTS_PER_PAGE])
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        self.stdout.write('%-32s %10.2f ms/query  (%d queries, %d hits)' % (
+            '%s, search mean' % label,
+            sum(timings) * 1000.0 / len(timings), len(timings), hits))
+        self.stdout.write('%-32s %10.2f ms/query' % (
+            '%s, search 95th percentile' % label,
+            timings[int(len(timings) * 0.95)] * 1000.0))
@@ -0,0 +1,116 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from gobotany.site import suggestions
+from gobotany.site.models import PlantNameSuggestion, SearchSuggestion
+from gobotany.site.utils import query_regex
+from gobotany.site.views import clean_input_string
+
+MAX_RESULTS = suggestions.MAX_RESULTS
+
+
+def orm_search_suggestions(query):
+    """Look up search suggestions the old way, with two queries."""
+    regex = query_regex(query)
+    regex_at_start = '^%s' % regex
+    found = list(SearchSuggestion.objects.filter(
+        term__iregex=regex_at_start).exclude(term=query).order_by(
+        'term').values_list('term', flat=True)[:MAX_RESULTS * 2])
+    found = sorted(set(term.lower() for term in found))[:MAX_RESULTS]
+    remaining_slots = MAX_RESULTS - len(found)
+    if remaining_slots > 0:
+        more = list(SearchSuggestion.objects.filter(
+            term__iregex=regex).exclude(term__iregex=regex_at_start).order_by(
+            'term').values_list('term', flat=True)[:MAX_RESULTS * 2])
+        found.extend(sorted(set(term.lower() for term in more))
+                     [:remaining_slots])
+    return found
+
+
+def orm_plant_name_suggestions(query):
+    """Look up plant name suggestions the old way, with two queries."""
+    regex = query_regex(query)
+    regex_at_start = '^%s' % regex
+    found = list(PlantNameSuggestion.objects.filter(
+        name__iregex=regex_at_start).exclude(name=query).order_by(
+        'name').values_list('name', flat=True)[:MAX_RESULTS])
+    remaining_slots = MAX_RESULTS - len(found)
+    if remaining_slots > 0:
+        found.extend(PlantNameSuggestion.objects.filter(
+            name__iregex=regex).exclude(name__iregex=regex_at_start).order_by(
+            'name').values_list('name', flat=True)[:remaining_slots])
+    return found
+
+
+class Command(BaseCommand):
+    """Compare the suggestion backends with the ORM.
+
+    Each sample term is typed one keystroke at a time, as in the search
+    box, and the suggestions for every keystroke are looked up the old
+    way, with regular expression queries, then from the in-memory index,
+    and then from the database backend.  The report gives the time to
+    build each index and to rebuild its `SuggestionKey` rows, the
+    average time per keystroke, and how many keystrokes got different
+    suggestions than the ORM (which should be none, unless the database
+    sorts in another collation).  Example, typing every 50th term:
+
+    dev/django benchmark_suggestions --every 50
+    """
+    help = 'Benchmarks search and plant name suggestions against the ORM'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=int, default=100,
+                            help='type every Nth term of each table'
+                            ' (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        for source, orm_function, index_function in [
+                ('search', orm_search_suggestions,
+                 suggestions.search_suggestions),
+                ('plant_name', orm_plant_name_suggestions,
+                 suggestions.plant_name_suggestions),
+                ]:
+            start = time.perf_counter()
+            index = suggestions.build_index(source)
+            self.stdout.write('%-24s %10.2f ms  (%d terms)' % (
+                'build %s index' % source,
+                (time.perf_counter() - start) * 1000.0, len(index)))
+
+            start = time.perf_counter()
+            suggestions.rebuild_keys(source, force=True)
+            self.stdout.write('%-24s %10.2f ms' % (
+                'rebuild %s keys' % source,
+                (time.perf_counter() - start) * 1000.0))
+
+            keystrokes = []
+            for term in index.terms[::options['every']]:
+                query = clean_input_string(term.lower())
+                keystrokes.extend(query[:i + 1] for i in range(len(query)))
+            keystrokes = [query for query in keystrokes if query.strip()]
+            if not keystrokes:
+                continue
+
+            suggestions.get_index(source)  # build it before timing
+            results = {}
+            for label, backend, function in [
+                    ('ORM', None, orm_function),
+                    ('memory', 'memory', index_function),
+                    ('database', 'database', index_function),
+                    ]:
+                with override_settings(SUGGESTION_BACKEND=backend):
+                    start = time.perf_counter()
+                    results[label] = [function(query)
+                                      for query in keystrokes]
+                    elapsed = time.perf_counter() - start
+                self.stdout.write('%-24s %10.1f us/keystroke' % (
+                    '%s, %s' % (source, label),
+                    elapsed * 1e6 / len(keystrokes)))
+
+            for label in 'memory', 'database':
+                differences = sum(1 for a, b in zip(
+                    results['ORM'], results[label]) if a != b)
+                self.stdout.write('%-24s %10d of %d keystrokes' % (
+                    '%s, %s differences' % (source, label), differences,
+                    len(keystrokes)))
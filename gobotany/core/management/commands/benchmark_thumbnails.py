@@ -0,0 +1,116 @@
+import io
+import os
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from gobotany.core import imagecheck
+
+
+def _init_worker(location):
+    imagecheck._init_worker(location)
+
+
+def _thumbnail_each_size(image_key):
+    """Make the thumbnails the old way, decoding the image once per size
+    at full size; return the worker's peak memory use."""
+    data = imagecheck._bucket.read(image_key)
+    for size in imagecheck.THUMBNAIL_SIZES:
+        operator, arg = imagecheck.THUMBNAIL_CALLS[size]
+        thumbnail = operator(Image.open(io.BytesIO(data)), arg)
+        output = io.BytesIO()
+        thumbnail.save(output, 'JPEG')
+        imagecheck._bucket.write(imagecheck.thumbnail_key(size, image_key),
+                                 output.getvalue(), 'image/jpeg')
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _thumbnail_all_sizes(image_key):
+    """Make the thumbnails from a single draft-mode decode; return the
+    worker's peak memory use."""
+    imagecheck.make_thumbnails((image_key, imagecheck.THUMBNAIL_SIZES))
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Command(BaseCommand):
+    """Time the making of taxon image thumbnails.
+
+    The thumbnails of a set of sample images are made the old way, by
+    decoding each image at full size once for every thumbnail size, and
+    then the new way, with a single draft-mode decode, first in one
+    process and then across a pool.  Each run reports images per second
+    and the peak resident memory of its worker processes.  The sample
+    images are photograph-sized JPEGs made up for the purpose, unless a
+    directory of real ones is given.  Example:
+
+    dev/django benchmark_thumbnails --images 40 --processes 4
+    """
+    help = 'Benchmarks taxon image thumbnail generation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=20,
+                            help='sample images to make (default:'
+                            ' %(default)s)')
+        parser.add_argument('--directory',
+                            help='use the JPEG files in this directory as'
+                            ' the sample images instead')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='processes in the pool (default: one per'
+                            ' CPU)')
+
+    def handle(self, *args, **options):
+        root = tempfile.mkdtemp()
+        try:
+            bucket = imagecheck.DirectoryBucket(root)
+            keys = self.save_samples(bucket, options)
+            for label, function, processes in [
+                    ('each size, 1 process', _thumbnail_each_size, 1),
+                    ('all sizes, 1 process', _thumbnail_all_sizes, 1),
+                    ('all sizes, pool', _thumbnail_all_sizes,
+                     options['processes']),
+                    ]:
+                start = time.perf_counter()
+                with ProcessPoolExecutor(
+                        processes, initializer=_init_worker,
+                        initargs=(root,)) as executor:
+                    peak = max(executor.map(function, keys))
+                elapsed = time.perf_counter() - start
+                self.stdout.write('%-24s %8.1f images/s %8.1f MB peak RSS'
+                                  % (label, len(keys) / elapsed,
+                                     peak / 1024.0))
+        finally:
+            shutil.rmtree(root)
+
+    def save_samples(self, bucket, options):
+        """Save the sample images to the bucket; return their keys."""
+        if options['directory']:
+            datas = []
+            for filename in sorted(os.listdir(options['directory'])):
+                if filename.lower().endswith('.jpg'):
+                    path = os.path.join(options['directory'], filename)
+                    with open(path, 'rb') as f:
+                        datas.append(f.read())
+        else:
+            # A gradient with noise, at the size of our larger photos.
+            size = (3000, 2000)
+            gradient = Image.linear_gradient('L').resize(size)
+            image = Image.merge('RGB', [
+                gradient, Image.effect_noise(size, 40),
+                gradient.transpose(Image.FLIP_LEFT_RIGHT)])
+            output = io.BytesIO()
+            image.save(output, 'JPEG', quality=90)
+            datas = [output.getvalue()] * options['images']
+
+        keys = []
+        for i, data in enumerate(datas):
+            key = '{}Sample/sample-{}-ha-photographer.jpg'.format(
+                imagecheck.IMAGE_PREFIX, i)
+            bucket.write(key, data, 'image/jpeg')
+            keys.append(key)
+        self.stdout.write('%d sample images' % len(keys))
+        return keys
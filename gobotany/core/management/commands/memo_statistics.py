@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from gobotany.core import memo
+
+
+class Command(BaseCommand):
+    """Report how often memoized results were found in the cache.
+
+    The counts are kept in the cache alongside the results, so they
+    cover every web process that shares it, since the counts were last
+    reset or evicted.  Example, reporting and then starting afresh:
+
+    dev/django memo_statistics --reset
+    """
+    help = 'Reports the cache hits and misses of memoized computations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='set the counts back to zero afterwards')
+
+    def handle(self, *args, **options):
+        self.stdout.write('%-24s %10s %10s %8s' % (
+            'name', 'hits', 'misses', 'hit rate'))
+        for name, counts in sorted(memo.statistics().items()):
+            hits, misses = counts['hits'], counts['misses']
+            total = hits + misses
+            self.stdout.write('%-24s %10d %10d %7.1f%%' % (
+                name, hits, misses, 100.0 * hits / total if total else 0.0))
+        if options['reset']:
+            memo.reset_statistics()
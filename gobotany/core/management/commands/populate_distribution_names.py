@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
 
-from gobotany.core.models import Distribution
+from gobotany.core.models import DataVersion, Distribution
 
 class Command(BaseCommand):
     """Populate the species_name and subspecific_epithet fields
@@ -41,3 +41,5 @@ class Command(BaseCommand):
                 if record.subspecific_epithet:
                     message += ' | ' + record.subspecific_epithet
                 self.stdout.write(message)
+
+        DataVersion.objects.bump('distribution')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from gobotany.site import suggestions
+
+
+class Command(BaseCommand):
+    """Build the SuggestionKey rows of every suggestion.
+
+    The keys are only kept up to date while SUGGESTION_BACKEND says
+    'database', so run this after switching a site to that backend:
+
+    dev/django rebuild_suggestion_keys
+    """
+    help = 'Rebuilds the keys for looking up suggestions in the database'
+
+    def handle(self, *args, **options):
+        for source in sorted(suggestions.SOURCES):
+            suggestions.rebuild_keys(source, force=True)
+            self.stdout.write('Rebuilt the %s suggestion keys' % source)
@@ -0,0 +1,96 @@
+"""Remember the results of expensive computations across requests.
+
+Results are kept in Django's default cache, which is memcached when
+that is configured in ``settings.CACHES`` and is otherwise Django's
+in-process, least-recently-used ``LocMemCache``; either way, entries
+expire after the cache's configured timeout.  Every key includes the
+current "botany" `DataVersion` (or another named version, for results
+computed from other data), so an import, rebuild, or change to a
+scoring `Parameter` makes all earlier results unreachable at once.
+
+Hits and misses are counted for each kind of computation in the cache
+too, so that the counts add up across every web process that shares
+a memcached; `statistics()` reads them back, and the `memo_statistics`
+management command reports them.
+
+"""
+import hashlib
+import logging
+
+from django.core.cache import cache
+
+from gobotany.core import models
+
+log = logging.getLogger('gobotany.memo')
+
+_MISSING = object()
+_NAMES_KEY = 'gobotany:memo-names'
+
+
+def fingerprint(value):
+    """Return a short, stable hash of `value`, which should be a repr()
+    that does not depend on dictionary or set ordering."""
+    return hashlib.sha1(repr(value).encode('utf-8')).hexdigest()
+
+
+def memoize(name, key, compute, version_name='botany'):
+    """Return the cached result of `compute()` for this name and key.
+
+    The `name` says what kind of computation this is, and the `key`
+    must capture every input to the computation; it is hashed, so it
+    can be as large as a whole list of species IDs.  The result must
+    be picklable, and must not be None.  It is forgotten when the
+    `DataVersion` named `version_name` is bumped.
+
+    """
+    version = models.DataVersion.objects.current(version_name)
+    cache_key = 'gobotany:%s:%s.%s:%s' % (
+        name, version_name, version, fingerprint(key))
+    value = cache.get(cache_key, _MISSING)
+    if value is _MISSING:
+        log.debug('%s: miss %s', name, cache_key)
+        _register(name)
+        _count(name, 'misses')
+        value = compute()
+        cache.set(cache_key, value)
+    else:
+        _count(name, 'hits')
+    return value
+
+
+def _count_key(name, outcome):
+    return 'gobotany:memo-%s:%s' % (outcome, name)
+
+
+def _register(name):
+    """Remember, in the cache, that there are counts for `name`."""
+    names = cache.get(_NAMES_KEY) or []
+    if name not in names:
+        cache.set(_NAMES_KEY, sorted(names + [name]), None)
+
+
+def _count(name, outcome):
+    """Add one to the cached count of hits or misses for `name`."""
+    key = _count_key(name, outcome)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The count is not in the cache yet, or has been evicted.
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def statistics():
+    """Return the hit and miss counts kept in the cache, by name."""
+    names = cache.get(_NAMES_KEY) or []
+    return {name: {outcome: cache.get(_count_key(name, outcome), 0)
+                   for outcome in ('hits', 'misses')}
+            for name in names}
+
+
+def reset_statistics():
+    """Set every hit and miss count back to zero."""
+    names = cache.get(_NAMES_KEY) or []
+    cache.delete_many([_count_key(name, outcome) for name in names
+                       for outcome in ('hits', 'misses')])
+
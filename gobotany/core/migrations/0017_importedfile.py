@@ -0,0 +1,26 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_dataversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportedFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('step', models.CharField(max_length=100)),
+                ('filename', models.CharField(blank=True, max_length=200)),
+                ('checksum', models.CharField(max_length=100)),
+                ('imported', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['step', 'filename'],
+                'unique_together': {('step', 'filename')},
+            },
+        ),
+    ]
@@ -14,8 +14,10 @@ from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelatio
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MaxValueValidator
+from django.dispatch import receiver
 from django.forms import ValidationError
 from django.template.defaultfilters import slugify
+from django.utils import timezone
 
 from tinymce import models as tinymce_models
 
@@ -57,6 +59,127 @@ class Parameter(models.Model):
     def __str__(self):
         return 'Parameter %s value=%s' % (self.name, self.value)
 
+
+@receiver(models.signals.post_save, sender=Parameter)
+@receiver(models.signals.post_delete, sender=Parameter)
+def _parameter_changed(sender, **kwargs):
+    """Scoring parameters change which characters rank best, so make
+    sure that no memoized rankings survive the change."""
+    DataVersion.objects.bump()
+
+
+# The apps whose models hold botanical data, plus the suggestions built
+# from them, any admin change to which makes out of date whatever the
+# web processes have computed from the "botany" data.
+BOTANY_APP_LABELS = ('core', 'dkey')
+BOTANY_SITE_MODELS = ('plantnamesuggestion', 'searchsuggestion')
+
+
+@receiver(models.signals.post_save, sender='core.Edit')
+def _data_edited(sender, **kwargs):
+    """The editor records every character value that it changes, so
+    whatever the web processes have computed from the old data is now
+    out of date."""
+    DataVersion.objects.bump()
+
+
+@receiver(models.signals.post_save, sender='admin.LogEntry')
+def _admin_data_edited(sender, instance, **kwargs):
+    """The admin logs every change that it saves; a change to botanical
+    data, but not to users, PlantShare or site news, bumps the "botany"
+    version, and a change to a Distribution the "distribution" one."""
+    content_type = instance.content_type
+    if content_type is None:
+        return
+    app_label, model = content_type.app_label, content_type.model
+    if app_label in BOTANY_APP_LABELS or (
+            app_label == 'site' and model in BOTANY_SITE_MODELS):
+        DataVersion.objects.bump()
+    if (app_label, model) == ('core', 'distribution'):
+        DataVersion.objects.bump('distribution')
+
+
+class DataVersionManager(models.Manager):
+    def current(self, name='botany'):
+        """Return the current version number of the named kind of data.
+
+        A kind of data that has never been bumped is at version zero.
+
+        """
+        versions = self.filter(name=name).values_list('version', flat=True)
+        for version in versions:
+            return version
+        return 0
+
+    def stamp(self, name='botany'):
+        """Return the named version number and the time it last changed.
+
+        The time is None for a kind of data that has never been bumped.
+
+        """
+        stamps = self.filter(name=name).values_list('version', 'updated')
+        for version, updated in stamps:
+            return version, updated
+        return 0, None
+
+    def bump(self, name='botany'):
+        """Advance the named version, and return its new value."""
+        updated = self.filter(name=name).update(
+            version=models.F('version') + 1, updated=timezone.now())
+        if not updated:
+            self.get_or_create(name=name, defaults={'version': 1})
+        return self.current(name)
+
+
+class DataVersion(models.Model):
+    """A counter that advances every time a kind of data is reloaded.
+
+    The web processes use these counters to learn that the database has
+    changed underneath them - because an import or rebuild ran in some
+    other process - so that anything they have precomputed and kept in
+    memory can be thrown away and computed again.  The "botany" version
+    covers taxa, piles, characters, and character values; the
+    "distribution" version covers the distribution records, and the
+    synonyms under which they might be listed, that maps are drawn from;
+    and the "maps" version, the maps prerendered into storage.
+
+    """
+    name = models.CharField(max_length=100, unique=True)
+    version = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(default=timezone.now)
+
+    objects = DataVersionManager()
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return 'DataVersion %s version=%s' % (self.name, self.version)
+
+
+class ImportedFile(models.Model):
+    """A source file that an import step read the last time it ran.
+
+    Each full import records, for every step, a checksum of each file
+    that the step read; a step that reads no files gets a single entry
+    with an empty filename.  An import run with --changed-only can then
+    skip every step whose files are unchanged since they were loaded.
+
+    """
+    step = models.CharField(max_length=100)
+    filename = models.CharField(max_length=200, blank=True)
+    checksum = models.CharField(max_length=100)
+    imported = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['step', 'filename']
+        unique_together = ('step', 'filename')
+
+    def __str__(self):
+        return 'ImportedFile %s %s checksum=%s' % (
+            self.step, self.filename, self.checksum)
+
+
 class CharacterGroup(models.Model):
     """A group of characters that should be associated in the UI.
 
@@ -733,11 +856,10 @@ class Taxon(models.Model):
         distributions = Distribution.objects.all_records_for_plant(
             self.scientific_name).filter(state__in=states).values_list(
             'state', 'present')
-        invasive_statuses = InvasiveStatus.objects.filter(
-            taxon=self).values_list('region', 'invasive_in_region',
-            'prohibited_from_sale')
-        invasive_dict = {state: (invasive, prohibited)
-            for state, invasive, prohibited in invasive_statuses}
+        # Going through the relation uses its prefetched rows, if any.
+        invasive_dict = {status.region: (status.invasive_in_region,
+                                         status.prohibited_from_sale)
+                         for status in self.invasive_statuses.all()}
         mapping = {settings.STATE_NAMES[state.lower()]: 'absent'
                    for state in states}
         for state, present in distributions:
@@ -762,6 +884,12 @@ class Taxon(models.Model):
             return None
 
     def get_habitats(self):
+        if 'character_values' in getattr(self, '_prefetched_objects_cache',
+                                         {}):
+            # Pick them from the prefetched values, as when indexing.
+            return sorted((value for value in self.character_values.all()
+                           if value.character.short_name == 'habitat'),
+                          key=lambda value: value.value_str)
         return (self.character_values.filter(character__short_name='habitat')
                 .order_by('value_str'))
 
@@ -1,4 +1,5 @@
-from gobotany.core.models import (Character, Taxon, TaxonCharacterValue)
+from gobotany.core import vectors
+from gobotany.core.models import Character
 
 def _is_length(short_name):
     """Detect whether a filter is a numeric length filter."""
@@ -8,25 +9,27 @@ def _is_length(short_name):
             short_name.find('thickness') > -1 or
             short_name.find('diameter') > -1)
 
-def _number_of_answers(species_query_set, question_short_name):
-    """Return the number of answers for a question for the given species.
+def _numbers_of_answers(pile, species_ids, question_short_names):
+    """Return the number of answers for each question for the given species.
     This has the effect of excluding answers that are no longer available
     to the user, i.e. are disabled and grayed out.
+
+    All of the questions are answered in a single pass over the pile's
+    in-memory vectors, instead of with a database query per question.
     """
-    species_ids = species_query_set.values_list('id', flat=True)
-    number_of_answers = 0
-    if not _is_length(question_short_name):
-        number_of_answers = TaxonCharacterValue.objects.filter(
-            character_value__character__short_name=question_short_name,
-            taxon__in=species_ids
-        ).values_list(
-            'character_value__value_str', flat=True
-        ).distinct().count()
-    return number_of_answers
+    pile_vectors = vectors.get_pile_vectors(pile.slug)
+    species_bits = pile_vectors.bits_for(species_ids)
+    numbers_of_answers = {}
+    for short_name in question_short_names:
+        answers = set(choice.value_str for choice
+                      in pile_vectors.choices.get(short_name, ())
+                      if choice.bits & species_bits)
+        numbers_of_answers[short_name] = len(answers)
+    return numbers_of_answers
 
 
 def get_questions(request, pile):
-    """Returns a list of questions for a plant subgroup (pile).
+    """Returns a list of questions, as characters, for a plant subgroup (pile).
     A possible replacement for using piles_characters for choosing
     the next best questions. This takes the current filtering
     state into account to return questions with more than one
@@ -55,36 +58,38 @@ def get_questions(request, pile):
             short_name__in=listed_questions
         )
 
-    # Build a list of candidate questions to be checked in order.
-    candidate_questions = characters.values('character_group__id',
-        'short_name', 'friendly_name', 'ease_of_observability')
+    # Build a list of candidate questions to be checked in order, with
+    # everything needed to display them already joined in.
+    candidate_questions = list(characters.select_related('character_group'))
 
     # Get the species that represent the current filtering state.
     species_ids = request.GET.get('species_ids', '')
     species_ids = species_ids.split('_') if species_ids.strip() else ()
-    filtered_species = Taxon.objects.filter(id__in=species_ids)
+
+    # For text-filter questions, get the number of currently available
+    # answers. These are answers that appear on the page as enabled and
+    # selectable, with a non-zero count in parentheses.
+    numbers_of_answers = _numbers_of_answers(pile, species_ids, [
+        question.short_name for question in candidate_questions
+        if not _is_length(question.short_name)
+        ])
 
     # Build a list of the specified number of best questions (or a default
     # number), in order of ease of observability.
     number_of_best_questions = int(request.GET.get('choose_best') or 3)
     best_questions = []
+    best = {}
     for question in candidate_questions:
-        short_name = question['short_name']
+        short_name = question.short_name
         if _is_length(short_name):
             # Allow a length-filter question to go on as a "best" question.
-            question['best'] = True
+            best[short_name] = True
         else:
-            # For text-filter questions, get the number of currently
-            # available answers. These are answers that appear on the
-            # page as enabled and selectable, with a non-zero count in
-            # parentheses.
-            number_of_answers = _number_of_answers(filtered_species,
-                                                   short_name)
             # The question is marked "best" if it has more than one
             # currently available answer.
-            question['best'] = (number_of_answers > 1)
+            best[short_name] = (numbers_of_answers[short_name] > 1)
 
-        if question['best'] == True:
+        if best[short_name] == True:
             best_questions.append(question)
         if len(best_questions) >= number_of_best_questions:
             break
@@ -95,8 +100,7 @@ def get_questions(request, pile):
     # did not qualify, also in order of ease of observability.
     if len(best_questions) < number_of_best_questions:
         for question in candidate_questions:
-            if (('best' not in question) or
-                ('best' in question and question['best'] == False)):
+            if best.get(question.short_name) != True:
                 best_questions.append(question)
             if len(best_questions) >= number_of_best_questions:
                 break
@@ -107,6 +111,6 @@ def get_questions(request, pile):
     #    'candidate_questions': candidate_questions,
     #    'best_questions': best_questions,
     #    })
-    response = [question['short_name'] for question in best_questions]
+    response = best_questions
 
     return response
@@ -260,6 +260,7 @@ def main():
         function = globals()[function_name]
         wrapped_function = transaction.atomic(function)
         wrapped_function(*sys.argv[2:])
+        models.DataVersion.objects.bump()
     else:
         print("Error: rebuild target %r unknown" % thing, file=sys.stderr)
         exit(2)
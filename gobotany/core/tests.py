@@ -1,18 +1,32 @@
 # coding=windows-1252
 
 import doctest
+import gzip
+import io
 import os
 import re
+import shutil
+import tempfile
 import unittest
 
 from collections import OrderedDict
-
+from functools import partial
+
+from django.contrib.admin.models import ADDITION, LogEntry
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
 from django.db import connection
 from django.forms import ValidationError
 from django.test import TestCase
+from django.utils import timezone
+from PIL import Image
 
 import bulkup
-from gobotany.core import botany, igdt, importer, models
+from gobotany.core import (botany, distributions, igdt, imagecheck,
+                           importer, memo, models, vectors)
 
 # Set up a logging handler to avoid getting a "no handlers could be found
 # for logger" error during importer tests, but quiet down the messages.
@@ -291,6 +305,7 @@ class APITests(SampleData):
 
     def setUp(self):
         self.setup_sample_data()
+        vectors._pile_vectors.clear()
 
     def try_query(self, result, *args, **kw):
         result_set = set(result)
@@ -395,6 +410,43 @@ class APITests(SampleData):
                 image_types='stem', max_rank=3)]),
             set([fox_stem_2]))
 
+    def try_filter(self, result, selections, pile='pets'):
+        taxon_ids, counts = botany.filter_species(pile, selections)
+        self.assertEqual(taxon_ids, sorted(taxon.id for taxon in result))
+
+    def test_filter_species(self):
+        self.try_filter([self.cat, self.rabbit], {})
+        self.try_filter([self.cat, self.rabbit], {'color': 'gray'})
+        self.try_filter([self.cat], {'color': 'orange'})
+        self.try_filter([], {'color': 'chartreuse'})
+        self.try_filter([self.rabbit], {'color': 'gray', 'length': '2'})
+        self.try_filter([self.cat, self.rabbit], {'length': '3.5'})
+        self.try_filter([self.rabbit], {'length': '2'})
+        self.try_filter([], {'length': '5'})  # the fox is not a pet
+        self.try_filter([self.rabbit], {'family': 'Leporidae'})
+        self.try_filter([self.cat, self.rabbit], {'cuteness': ''})
+        self.try_filter([self.fox, self.cat], {}, pile='carnivores')
+        self.assertRaises(models.Character.DoesNotExist,
+                          self.try_filter, [], {'bad_character': 'red'})
+        self.assertRaises(models.Pile.DoesNotExist,
+                          self.try_filter, [], {}, pile='nonexistent')
+
+    def test_filter_species_counts(self):
+        taxon_ids, counts = botany.filter_species('pets', {
+            'color': 'orange', 'length': '2'})
+        self.assertEqual(taxon_ids, [])
+        # Each count ignores the selection made for its own character.
+        self.assertEqual(counts['color'], {
+            'red': 0, 'orange': 0, 'gray': 1, 'chartreuse': 0})
+        self.assertEqual(counts['cuteness'], {'cute': 0})
+        self.assertEqual(counts['genus'], {'Felis': 0, 'Oryctolagus': 0})
+
+        taxon_ids, counts = botany.filter_species('pets', {'length': '2'})
+        self.assertEqual(taxon_ids, [self.rabbit.id])
+        self.assertEqual(counts['cuteness'], {'cute': 1})
+        self.assertEqual(counts['genus'], {'Felis': 0, 'Oryctolagus': 1})
+        self.assertNotIn('length', counts)
+
     def test_best_filters(self):
         celist = igdt.compute_character_entropies(
             self.carnivores, list(models.Taxon.objects.all()))
@@ -409,6 +461,166 @@ class APITests(SampleData):
                 ])
 
 
+class DataVersionTestCase(TestCase):
+
+    def test_unknown_version_is_zero(self):
+        self.assertEqual(models.DataVersion.objects.current('nothing'), 0)
+
+    def test_bump_advances_only_the_named_version(self):
+        self.assertEqual(models.DataVersion.objects.bump(), 1)
+        self.assertEqual(models.DataVersion.objects.bump(), 2)
+        self.assertEqual(models.DataVersion.objects.bump('other'), 1)
+        self.assertEqual(models.DataVersion.objects.current(), 2)
+
+    def test_stamp_gives_version_and_time_of_last_bump(self):
+        self.assertEqual(models.DataVersion.objects.stamp(), (0, None))
+        models.DataVersion.objects.bump()
+        version, updated = models.DataVersion.objects.stamp()
+        self.assertEqual(version, 1)
+        self.assertTrue(updated <= timezone.now())
+
+    def log_admin_addition(self, model):
+        user, created = User.objects.get_or_create(username='admin')
+        content_type = models.ContentType.objects.get_for_model(model)
+        LogEntry.objects.log_action(user.id, content_type.id, None,
+                                    'Acer rubrum', ADDITION)
+
+    def test_admin_saves_bump_the_version(self):
+        self.log_admin_addition(models.Taxon)
+        self.assertEqual(models.DataVersion.objects.current(), 1)
+        self.assertEqual(
+            models.DataVersion.objects.current('distribution'), 0)
+
+    def test_admin_distribution_saves_bump_both_versions(self):
+        self.log_admin_addition(models.Distribution)
+        self.assertEqual(models.DataVersion.objects.current(), 1)
+        self.assertEqual(
+            models.DataVersion.objects.current('distribution'), 1)
+
+    def test_admin_saves_of_other_data_leave_the_versions_alone(self):
+        self.log_admin_addition(User)
+        self.assertEqual(models.DataVersion.objects.current(), 0)
+        self.assertEqual(
+            models.DataVersion.objects.current('distribution'), 0)
+
+    def test_editor_saves_bump_the_version(self):
+        models.Edit(author='botanist', datetime=timezone.now(),
+                    itemtype='character-value', coordinate1='Acer rubrum',
+                    coordinate2='state', old_value='[]').save()
+        self.assertEqual(models.DataVersion.objects.current(), 1)
+
+
+class MemoTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_memoize_remembers_results_by_key(self):
+        self.assertEqual(memo.memoize('test', (1, [2, 3]), self.compute), 1)
+        self.assertEqual(memo.memoize('test', (1, [2, 3]), self.compute), 1)
+        self.assertEqual(memo.memoize('test', (1, [2]), self.compute), 2)
+        self.assertEqual(self.calls, 2)
+
+    def test_memoize_counts_hits_and_misses(self):
+        memo.memoize('test', 'a', self.compute)
+        memo.memoize('test', 'a', self.compute)
+        memo.memoize('test', 'a', self.compute)
+        memo.memoize('test', 'b', self.compute)
+        self.assertEqual(memo.statistics(),
+                         {'test': {'hits': 2, 'misses': 2}})
+        memo.reset_statistics()
+        self.assertEqual(memo.statistics(),
+                         {'test': {'hits': 0, 'misses': 0}})
+
+    def test_memo_statistics_command_reports_the_counts(self):
+        memo.memoize('test', 'a', self.compute)
+        memo.memoize('test', 'a', self.compute)
+        output = io.StringIO()
+        call_command('memo_statistics', stdout=output)
+        self.assertEqual(output.getvalue().splitlines()[1].split(),
+                         ['test', '1', '1', '50.0%'])
+
+    def test_memoize_forgets_results_when_data_version_changes(self):
+        self.assertEqual(memo.memoize('test', 'key', self.compute), 1)
+        models.DataVersion.objects.bump()
+        self.assertEqual(memo.memoize('test', 'key', self.compute), 2)
+
+    def test_saving_a_parameter_changes_the_data_version(self):
+        version = models.DataVersion.objects.current()
+        models.Parameter.objects.create(name='coverage_weight', value=0.5)
+        self.assertEqual(models.DataVersion.objects.current(), version + 1)
+
+
+# The tables that each full import step reads and writes.
+IMPORT_STEP_TABLES = {
+    'partner-sites': ([], ['core_partnersite']),
+    'pile-groups': ([], ['core_pilegroup']),
+    'piles': (['core_pilegroup'], ['core_pile']),
+    'families': ([], ['core_family']),
+    'genera': (['core_family'], ['core_genus']),
+    'wetland-indicators': ([], ['core_wetlandindicator']),
+    'taxa': (
+        ['core_partnersite', 'core_pile', 'core_family', 'core_genus',
+         'core_wetlandindicator'],
+        ['core_family', 'core_genus', 'core_taxon', 'core_partnerspecies',
+         'core_pile_species', 'core_commonname', 'core_synonym',
+         'core_invasivestatus']),
+    'conservation-statuses': (['core_taxon', 'core_synonym'],
+                              ['core_conservationstatus']),
+    'characters': (['core_pile'], ['core_charactergroup', 'core_character']),
+    'character-values': (['core_character'], ['core_charactervalue']),
+    'glossary': ([], ['core_glossaryterm']),
+    'lookalikes': (['core_taxon'], ['core_lookalike']),
+    'places': (
+        ['core_taxon'],
+        ['core_charactergroup', 'core_character', 'core_charactervalue',
+         'core_taxoncharactervalue']),
+    'videos': (['core_pilegroup', 'core_pile'],
+               ['core_video', 'core_pilegroup', 'core_pile']),
+    'constants': (
+        ['core_partnersite', 'core_pilegroup', 'core_pile', 'core_character',
+         'core_video', 'core_family', 'core_genus', 'core_taxon',
+         'core_commonname', 'core_synonym', 'core_glossaryterm'],
+        ['core_plantpreviewcharacter', 'search_plainpage',
+         'search_plainpage_videos', 'search_groupslistpage',
+         'search_groupslistpage_groups', 'search_subgroupslistpage',
+         'search_subgroupresultspage', 'site_searchsuggestion',
+         'site_suggestionkey']),
+    'copyright-holders': ([], ['core_copyrightholder']),
+    'plant-name-suggestions': (
+        ['core_taxon', 'core_commonname', 'core_synonym'],
+        ['site_plantnamesuggestion', 'site_suggestionkey']),
+    'distributions-new-england': ([], ['core_distribution']),
+    'distributions-north-america': ([], ['core_distribution']),
+    'taxon-character-values': (
+        ['core_pile', 'core_taxon', 'core_character', 'core_charactervalue'],
+        ['core_charactervalue', 'core_taxoncharactervalue']),
+    'partner-concord': (
+        ['core_partnersite', 'core_taxon', 'core_synonym',
+         'core_partnerspecies'],
+        ['core_partnerspecies']),
+    'partner-montshire': (
+        ['core_partnersite', 'core_taxon', 'core_synonym',
+         'core_partnerspecies'],
+        ['core_partnerspecies']),
+    'partner-sample': (
+        ['core_partnersite', 'core_taxon', 'core_synonym',
+         'core_partnerspecies'],
+        ['core_partnerspecies']),
+    'default-filters': (['core_pile', 'core_character'],
+                        ['core_defaultfilter']),
+    'plant-of-the-day': (
+        ['core_partnersite', 'core_partnerspecies', 'core_taxon'],
+        ['plantoftheday_plantoftheday']),
+    'dkey-illustrative-species': ([], ['dkey_illustrativespecies']),
+    }
+
+
 class ImportTestCase(TestCase):
     def setUp(self):
         self.db = bulkup.Database(connection)
@@ -427,6 +639,117 @@ class ImportTestCase(TestCase):
             'this_is_a_length_char_max_ly')
         self.assertEqual('this_is_a_length_char_ly', short_name)
 
+    def test_full_import_steps_are_listed_after_their_dependencies(self):
+        # A single-job import runs the steps in the order listed.
+        seen = set()
+        for step in importer.full_import_steps:
+            self.assertTrue(seen.issuperset(step.after), step.name)
+            self.assertNotIn(step.name, seen)
+            seen.add(step.name)
+
+    def test_full_import_steps_run_after_the_steps_they_read_from(self):
+        # A parallel import starts a step as soon as the steps it runs
+        # after are done, so every table that a step reads must have
+        # been written by one of those steps or by the steps before
+        # them.  A step may also read back what it has written itself.
+        steps = dict((step.name, step) for step in importer.full_import_steps)
+        self.assertEqual(set(IMPORT_STEP_TABLES), set(steps))
+        tables = set(connection.introspection.table_names())
+
+        def ancestors(name):
+            found = set()
+            pending = list(steps[name].after)
+            while pending:
+                name = pending.pop()
+                if name not in found:
+                    found.add(name)
+                    pending.extend(steps[name].after)
+            return found
+
+        for name, (reads, writes) in IMPORT_STEP_TABLES.items():
+            self.assertTrue(tables.issuperset(reads + writes), name)
+            written = set()
+            for ancestor in ancestors(name):
+                written.update(IMPORT_STEP_TABLES[ancestor][1])
+            for table in reads:
+                self.assertIn(table, written,
+                              'step %s reads %s' % (name, table))
+
+    def test_run_step_reports_rows_read(self):
+        step = importer.ImportStep(
+            'test-piles', importer.Importer.import_pile_groups,
+            ['pile_group_info.csv'])
+        opener = partial(importer.PlainFile, testdata(''))
+        name, seconds, rows = importer.run_step(
+            step, importer.Importer(), opener)
+        self.assertEqual(name, 'test-piles')
+        self.assertEqual(rows, models.PileGroup.objects.count())
+
+    def test_run_step_skips_missing_files(self):
+        step = importer.ImportStep(
+            'test-missing', importer.Importer.import_pile_groups,
+            ['no-such-file.csv'])
+        opener = partial(importer.PlainFile, testdata(''))
+        name, seconds, rows = importer.run_step(
+            step, importer.Importer(), opener)
+        self.assertEqual(rows, 0)
+
+    def test_step_checksums(self):
+        opener = partial(importer.PlainFile, testdata(''))
+        step = importer.ImportStep(
+            'test-piles', importer.Importer.import_pile_groups,
+            ['pile_group_info.csv', 'no-such-file.csv', '!partner'])
+        checksums = importer.step_checksums(step, opener)
+        self.assertEqual(len(checksums['pile_group_info.csv']), 40)
+        self.assertEqual(checksums['no-such-file.csv'], None)
+        self.assertEqual(checksums['!partner'], 'partner')
+
+        step = importer.ImportStep(
+            'test-sites', importer.Importer.import_partner_sites)
+        self.assertEqual(importer.step_checksums(step, opener), {'': ''})
+
+    def test_run_step_records_checksums(self):
+        step = importer.ImportStep(
+            'test-piles', importer.Importer.import_pile_groups,
+            ['pile_group_info.csv'], after=['test-sites'])
+        opener = partial(importer.PlainFile, testdata(''))
+        checksums = importer.step_checksums(step, opener)
+        importer.run_step(step, importer.Importer(), opener, checksums)
+
+        manifest = importer.load_manifest()
+        self.assertEqual(manifest['test-piles'], checksums)
+        self.assertTrue(importer.step_is_current(
+            step, checksums, manifest, set()))
+        self.assertFalse(importer.step_is_current(
+            step, {'pile_group_info.csv': 'changed'}, manifest, set()))
+        self.assertFalse(importer.step_is_current(
+            step, checksums, manifest, {'test-sites'}))
+
+    def test_changed_taxa_rerun_the_steps_built_from_them(self):
+        # Walk the steps as a --changed-only import does, with every
+        # file unchanged except taxa.csv.
+        manifest = dict((step.name, {'file.csv': 'old'})
+                        for step in importer.full_import_steps)
+        rerun = set()
+        for step in importer.full_import_steps:
+            checksums = {'file.csv': 'new' if step.name == 'taxa' else 'old'}
+            if not importer.step_is_current(step, checksums, manifest, rerun):
+                rerun.add(step.name)
+        self.assertIn('constants', rerun)
+        self.assertIn('plant-name-suggestions', rerun)
+        self.assertIn('taxon-character-values', rerun)
+        self.assertNotIn('characters', rerun)
+        self.assertNotIn('glossary', rerun)
+
+    def test_canceled_step_records_no_checksums(self):
+        step = importer.ImportStep(
+            'test-missing', importer.Importer.import_pile_groups,
+            ['no-such-file.csv'])
+        opener = partial(importer.PlainFile, testdata(''))
+        importer.run_step(step, importer.Importer(), opener,
+                          importer.step_checksums(step, opener))
+        self.assertNotIn('test-missing', importer.load_manifest())
+
     def test_import_characters(self):
         im = importer.Importer()
         im.import_characters(self.db,
@@ -493,6 +816,263 @@ class ImportTestCase(TestCase):
         self.assertEqual('Leaf disposition', friendly_name)
 
 
+class ImportTaxonCharacterValuesTestCase(SampleData):
+    def setUp(self):
+        self.setup_sample_data()
+        self.create(models.Pile, 'Lycophytes', pilegroup=self.pilegroup1)
+        self.create(models.Character, 'color_ly',
+                    character_group=self.appearance, value_type='TEXT',
+                    pile=self.lycophytes)
+        self.create(models.Character, 'length_ly',
+                    character_group=self.dimensions, value_type='LENGTH',
+                    pile=self.lycophytes)
+        self.create(models.CharacterValue, 'red', character=self.color_ly)
+        self.create(models.CharacterValue, 'blue', character=self.color_ly)
+        importer.Importer().import_taxon_character_values(
+            bulkup.Database(connection),
+            importer.PlainFile('.', testdata('taxon_character_values.csv')))
+
+    def values_of(self, taxon):
+        return sorted(
+            (tcv.character_value.character.short_name,
+             tcv.character_value.value_str,
+             tcv.character_value.value_min,
+             tcv.character_value.value_max)
+            for tcv in models.TaxonCharacterValue.objects.filter(
+                taxon=taxon, character_value__character__pile=self.lycophytes))
+
+    def test_text_and_length_values(self):
+        self.assertEqual(self.values_of(self.fox), [
+            ('color_ly', 'blue', None, None),
+            ('color_ly', 'red', None, None),
+            ('length_ly', None, 2.0, 4.0),
+            ])
+
+    def test_repeated_values_share_character_values(self):
+        self.assertEqual(self.values_of(self.cat), [
+            ('color_ly', 'red', None, None),
+            ('length_ly', None, 2.0, 4.0),
+            ])
+        self.assertEqual(models.CharacterValue.objects.filter(
+            character=self.length_ly).count(), 2)
+
+    def test_unknown_and_unusable_values_are_skipped(self):
+        self.assertEqual(self.values_of(self.rabbit), [
+            ('length_ly', None, None, 6.0),
+            ])
+
+    def test_reimport_keeps_values_with_null_key_columns(self):
+        # The rabbit's one-sided length leaves value_min NULL, which is
+        # part of the key that character values are saved by.
+        counts = (models.CharacterValue.objects.count(),
+                  models.TaxonCharacterValue.objects.count())
+        importer.Importer().import_taxon_character_values(
+            bulkup.Database(connection),
+            importer.PlainFile('.', testdata('taxon_character_values.csv')))
+        self.assertEqual((models.CharacterValue.objects.count(),
+                          models.TaxonCharacterValue.objects.count()), counts)
+        self.assertEqual(self.values_of(self.rabbit), [
+            ('length_ly', None, None, 6.0),
+            ])
+
+
+class ImportTaxonImagesTestCase(SampleData):
+    LISTING = [
+        'taxon-images/Canidae/vulpes-fox-ha-smith-2.jpg',
+        'taxon-images/Canidae/vulpes-fox-sc-jones.jpg',
+        'taxon-images/Canidae/vulpes-fox-zz-jones.jpg',
+        'taxon-images/Canidae/vulpes-wolf-ha-smith.jpg',
+        'taxon-images/Canidae/vulpes-fox-ha.notes.jpg',
+        'taxon-images/Canidae/README',
+        'taxon-images/Felidae/felis-cat-ha-smith.png',
+        'taxon-images/Felidae/felis-cat-smith.jpg',
+        ]
+
+    def setUp(self):
+        self.setup_sample_data()
+        self.create(models.Pile, 'Lycophytes', pilegroup=self.pilegroup1)
+        self.lycophytes.species.add(self.fox)
+        self.lycophytes.species.add(self.cat)
+        lines = ''.join('2013-01-01 12:00  1000   s3://newfs/%s\n' % path
+                        for path in self.LISTING)
+        default_storage.save('ls-taxon-images.gz',
+                             ContentFile(gzip.compress(lines.encode())))
+
+    def tearDown(self):
+        default_storage.delete('ls-taxon-images.gz')
+
+    def test_images_are_imported(self):
+        importer.Importer().import_taxon_images(bulkup.Database(connection))
+        images = models.ContentImage.objects.order_by('image')
+        self.assertEqual(
+            [(image.image.name, image.alt, image.creator, image.rank)
+             for image in images],
+            [('taxon-images/Canidae/vulpes-fox-ha-smith-2.jpg',
+              'Vulpes fox: plant form 2', 'smith', 2),
+             ('taxon-images/Canidae/vulpes-fox-sc-jones.jpg',
+              'Vulpes fox: spore cones 1', 'jones', 1),
+             ('taxon-images/Felidae/felis-cat-ha-smith.png',
+              'Felis cat: plant form 1', 'smith', 1)])
+
+    def test_skipped_files_are_counted_by_reason(self):
+        logging.disable(logging.NOTSET)  # see the end of this module
+        try:
+            with self.assertLogs('gobotany.import', 'ERROR') as logs:
+                importer.Importer().import_taxon_images(
+                    bulkup.Database(connection))
+        finally:
+            logging.disable(logging.CRITICAL)
+        self.assertEqual(sorted(logs.output), [
+            'ERROR:gobotany.import:  skipped 1 files: file lacks an'
+            ' extension',
+            'ERROR:gobotany.import:  skipped 1 files: filename has'
+            ' multiple periods',
+            'ERROR:gobotany.import:  skipped 1 files: filename lacks an'
+            ' image type code',
+            'ERROR:gobotany.import:  skipped 1 files: image names unknown'
+            ' taxon',
+            "ERROR:gobotany.import:  skipped 1 files: unknown image type"
+            " 'zz'",
+            ])
+
+
+class ImageCheckTestCase(unittest.TestCase):
+    IMAGE = 'taxon-images/Aceraceae/acer-rubrum-ha-smith.jpg'
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.manifest = os.path.join(self.root, 'manifest.json')
+        self.bucket = imagecheck.DirectoryBucket(
+            os.path.join(self.root, 'bucket'))
+        self.save_image(self.IMAGE, 'red')
+        self.bucket.make_private(self.IMAGE)
+        self.save_image('taxon-images-160x149/Aceraceae/acer-gone.jpg', 'red')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def save_image(self, key, color):
+        output = io.BytesIO()
+        Image.new('RGB', (300, 200), color).save(output, 'JPEG')
+        path = self.bucket.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(output.getvalue())
+
+    def audit(self):
+        auditor = imagecheck.Auditor(self.bucket.root, self.manifest,
+                                     processes=1, out=io.StringIO())
+        manifest = auditor.run()
+        return auditor, manifest
+
+    def test_images_are_fixed_and_thumbnails_made(self):
+        auditor, manifest = self.audit()
+        self.assertEqual(self.bucket.head(self.IMAGE),
+                         (200, 'image/jpeg', imagecheck.CACHE_CONTROL))
+        self.assertEqual(manifest[self.IMAGE]['thumbnails'],
+                         sorted(imagecheck.THUMBNAIL_SIZES))
+        self.assertEqual(auditor.thumbnail_count, 3)
+        self.assertEqual(auditor.deleted_count, 1)
+        keys = [info.key for info in self.bucket.list('')]
+        self.assertNotIn('taxon-images-160x149/Aceraceae/acer-gone.jpg', keys)
+        thumbnail = Image.open(io.BytesIO(self.bucket.read(
+            'taxon-images-239x239/Aceraceae/acer-rubrum-ha-smith.jpg')))
+        self.assertEqual(thumbnail.size, (239, 239))
+
+    def test_unchanged_objects_are_not_checked_again(self):
+        self.audit()
+        # The image that was fixed is checked once more, to confirm.
+        auditor, manifest = self.audit()
+        self.assertEqual(auditor.checked_count, 1)
+        auditor, manifest = self.audit()
+        self.assertEqual(auditor.checked_count, 0)
+        self.assertEqual(auditor.unchanged_count, 4)
+        self.assertEqual(auditor.thumbnail_count, 0)
+
+    def test_changed_images_get_new_thumbnails(self):
+        self.audit()
+        self.save_image(self.IMAGE, 'blue')
+        auditor, manifest = self.audit()
+        self.assertEqual(auditor.checked_count, 1)
+        self.assertEqual(auditor.thumbnail_count, 3)
+        thumbnail = Image.open(io.BytesIO(self.bucket.read(
+            'taxon-images-160x149/Aceraceae/acer-rubrum-ha-smith.jpg')))
+        red, green, blue = thumbnail.getpixel((80, 75))
+        self.assertGreater(blue, red)
+
+
+class ThumbnailTestCase(unittest.TestCase):
+    def jpeg(self, size):
+        output = io.BytesIO()
+        Image.new('RGB', size, 'green').save(output, 'JPEG')
+        return output.getvalue()
+
+    def test_decode_size_covers_the_largest_thumbnail(self):
+        self.assertEqual(imagecheck.decode_size(
+            (4000, 3000), imagecheck.THUMBNAIL_SIZES), (1000, 750))
+        self.assertEqual(imagecheck.decode_size(
+            (4000, 3000), ['160x149', '239x239']), (319, 239))
+        self.assertEqual(imagecheck.decode_size(
+            (800, 600), imagecheck.THUMBNAIL_SIZES), (800, 600))
+
+    def test_every_size_is_made_from_one_decode(self):
+        thumbnails = imagecheck.thumbnail_images(
+            self.jpeg((4000, 3000)), imagecheck.THUMBNAIL_SIZES)
+        self.assertEqual(
+            {size: Image.open(io.BytesIO(data)).size
+             for size, data in thumbnails.items()},
+            {'160x149': (160, 149), '239x239': (239, 239),
+             '1000s1000': (1000, 750)})
+
+
+class BulkupTestCase(TestCase):
+
+    def test_save_inserts_updates_and_deletes(self):
+        def save(rows, delete_old=False):
+            table = bulkup.Database(connection).table('core_wetlandindicator')
+            for code, name, sequence in rows:
+                table.get(code=code).set(name=name, friendly_description='',
+                                         sequence=sequence)
+            table.save(delete_old=delete_old)
+
+        save([('OBL', 'Obligate', 1), ('FACW', 'Facultative wet', 2)])
+        save([('OBL', 'Obligate wetland', 1), ('UPL', 'Upland', 5)],
+             delete_old=True)
+        self.assertEqual(
+            list(models.WetlandIndicator.objects.values_list(
+                'code', 'name', 'sequence')),
+            [('OBL', 'Obligate wetland', 1), ('UPL', 'Upland', 5)])
+
+    def test_rows_are_stored_as_lists_of_values(self):
+        table = bulkup.Database(connection).table('core_wetlandindicator')
+        table.get(code='OBL').set(name='Obligate')
+        table.get(code='UPL')
+        self.assertEqual(table.get(code='OBL').get('name'), 'Obligate')
+        self.assertEqual(table.get(code='UPL').get('name', ''), '')
+        self.assertEqual(table.rowdict[('OBL',)], ['OBL', 'Obligate'])
+        self.assertEqual(table.rowdict[('UPL',)], ['UPL'])
+
+    def test_row_attributes_read_and_write_values(self):
+        table = bulkup.Database(connection).table('core_wetlandindicator')
+        row = table.get(code='OBL').set(name='Obligate')
+        row.name += ' wetland'
+        row.sequence = 1
+        self.assertEqual(table.rowdict[('OBL',)],
+                         ['OBL', 'Obligate wetland', 1])
+
+    def test_uniform_columns(self):
+        table = bulkup.Database(connection).table('core_character')
+        table.get(short_name='a').set(image=None)
+        self.assertEqual(table.uniform_columns(), ['short_name', 'image'])
+        table.get(short_name='b')
+        self.assertEqual(table.uniform_columns(), None)
+
+    def test_copy_text_keeps_empty_strings_distinct_from_null(self):
+        row = [None, '', True, 2, 'say "hi",\nthen go']
+        self.assertEqual(bulkup.copy_text([row]).read(),
+                         ',"",True,2,"say ""hi"",\nthen go"\n')
+
+
 class StateDistributionLabelsTestCase(TestCase):
 
     def setUp(self):
@@ -533,6 +1113,56 @@ class StateDistributionLabelsTestCase(TestCase):
         self.assertEqual(labels, expected)
 
 
+class DistributionStoreTestCase(TestCase):
+
+    def setUp(self):
+        for scientific_name, state, county, present, native in [
+                ('Carex arcta', 'ME', 'Piscataquis', True, True),
+                ('Carex arctata', 'MA', 'Barnstable', True, True),
+                ('Carex arctata', 'MA', '', True, False),
+                ('Acer rubrum', 'MA', '', True, True),
+                ('Acer rubrum', 'NY', '', True, True),
+                ('Acer rubrum var. trilobum', 'VT', '', True, True),
+                ('Acer rubrum var. trilobum', 'CT', '', False, True),
+                ('Acer rubrum var. trilobum', 'CT', 'Fairfield', True, True),
+                ('Acer rubrumoides', 'NH', '', True, True),
+                ]:
+            models.Distribution.objects.create(
+                scientific_name=scientific_name, state=state, county=county,
+                present=present, native=native)
+        self.store = distributions.build_store()
+
+    def test_records_for_plant_match_the_orm(self):
+        for name in ['Carex arcta', 'Carex arctata', 'Acer rubrum',
+                     'Acer rubrum var. trilobum', 'Acer', 'Quercus alba']:
+            expected = [
+                (r.scientific_name, r.state, r.county, r.present, r.native)
+                for r in models.Distribution.objects.all_records_for_plant(
+                    name)]
+            self.assertEqual(
+                [tuple(r) for r in self.store.records_for_plant(name)],
+                expected)
+
+    def test_present_states(self):
+        self.assertEqual(
+            self.store.present_states(
+                ['Acer rubrum', 'Carex arcta', 'Carex arctata'],
+                ['CT', 'MA', 'ME', 'NH', 'RI', 'VT']),
+            {'Acer rubrum': {'MA', 'VT'}, 'Carex arctata': {'MA'}})
+
+    def test_memory_report(self):
+        report = dict(self.store.memory_report())
+        self.assertEqual(len(self.store), 9)
+        self.assertTrue(all(size > 0 for size in report.values()))
+
+    def test_store_is_rebuilt_when_the_distribution_data_changes(self):
+        distributions.reset()
+        store = distributions.get_store()
+        self.assertIs(distributions.get_store(), store)
+        models.DataVersion.objects.bump('distribution')
+        self.assertIsNot(distributions.get_store(), store)
+
+
 class StripTaxonomicAuthorityTestCase(TestCase):
 
     def test_strip_taxonomic_authority_species(self):
@@ -0,0 +1,318 @@
+"""Precomputed in-memory vectors of which species have which character values.
+
+For each pile we keep, for every character value, the set of species
+having that value as a bitset: a Python integer whose bit number ``n``
+is set if the ``n``-th taxon in the pile's sorted list of taxon IDs has
+the value.  Intersecting or counting sets of species then costs only a
+few integer operations, instead of a trip to the database.
+
+The vectors for a pile are computed the first time they are asked for,
+and are then kept for the life of the process, until the "botany"
+`DataVersion` is bumped by an import or rebuild, at which point they
+are computed afresh on their next use.  Along with them, a pile keeps
+the API's serialized responses for its vectors (see `payloads`), so
+that those, too, are built only once per data version.
+
+"""
+import base64
+from collections import defaultdict
+from itertools import compress
+
+from django.db import connection
+
+from gobotany.core import models
+
+_pile_vectors = {}  # pile slug -> (data version, PileVectors)
+_bit_values = bytes.maketrans(b'01', b'\x00\x01')
+
+
+class Choice(object):
+    """One character value, and the bitset of species that have it."""
+
+    __slots__ = ('id', 'value_str', 'value_min', 'value_max', 'bits')
+
+    def __init__(self, id, value_str, value_min, value_max, bits=0):
+        self.id = id
+        self.value_str = value_str
+        self.value_min = value_min  # in the character's own unit
+        self.value_max = value_max
+        self.bits = bits
+
+    def is_na(self):
+        """Whether this value says the character does not apply."""
+        return (self.value_str == 'NA' or
+                (self.value_min == 0.0 and self.value_max == 0.0))
+
+    def is_range(self):
+        """Whether this is a usable (non-NA) length range."""
+        return (self.value_min is not None and self.value_max is not None
+                and not self.is_na())
+
+
+class PileVectors(object):
+    """The character values of one pile, with a bitset of species for each."""
+
+    def __init__(self, pile_id, slug, taxon_ids, characters):
+        self.pile_id = pile_id
+        self.slug = slug
+        self.taxon_ids = taxon_ids  # sorted; bit n stands for taxon_ids[n]
+        self.bit_numbers = {taxon_id: n for n, taxon_id
+                            in enumerate(taxon_ids)}
+        self.pile_bits = 0  # species actually listed in the pile
+        self.characters = characters
+        self.character_ids = {}  # short name -> character ID
+        self.value_types = {}    # short name -> 'TEXT', 'LENGTH', ...
+        self.units_mm = {}       # short name -> millimeters per unit
+        self.choices = {}        # short name -> [Choice, ...]
+        self.payloads = {}       # wire format -> serialized API response
+
+    def bits_for(self, taxon_ids):
+        """Return a bitset of whichever of these taxon IDs are in the pile."""
+        bit_numbers = self.bit_numbers
+        bits = 0
+        for taxon_id in taxon_ids:
+            n = bit_numbers.get(int(taxon_id))
+            if n is not None:
+                bits |= 1 << n
+        return bits
+
+    def taxa_in(self, bits):
+        """Return a sorted list of the taxon IDs in the bitset `bits`."""
+        # Walk the bits without shifting a large integer over and over.
+        selectors = bin(bits)[:1:-1].encode('ascii').translate(_bit_values)
+        return list(compress(self.taxon_ids, selectors))
+
+    def encode(self, bits):
+        """Return the bitset `bits` as little-endian base64 bytes."""
+        nbytes = (len(self.taxon_ids) + 7) // 8
+        return base64.b64encode(bits.to_bytes(nbytes, 'little')).decode()
+
+    def as_lists(self):
+        """Return the pile's vectors with each bitset as a list of IDs.
+
+        This is the traditional format of the pile vector set API.
+
+        """
+        return [dict(character, values=[
+            self.taxa_in(bits) for value_id, bits in character['values']
+            ]) for character in self.characters]
+
+    def as_bitsets(self):
+        """Return the pile's vectors with each bitset encoded as base64."""
+        return {
+            'taxa': self.taxon_ids,
+            'characters': [dict(character, values=[
+                self.encode(bits) for value_id, bits in character['values']
+                ]) for character in self.characters],
+            }
+
+    # Filtering.
+
+    def matching(self, short_name, value):
+        """Return the species that survive selecting `value` for a filter.
+
+        Just as in the Simple and Full Keys, a species for which the
+        character has no value at all is not ruled out by the filter.
+        A length `value` is given in millimeters.  Raises
+        `Character.DoesNotExist` for an unknown short name, and
+        `ValueError` for a length that is not a number.
+
+        """
+        choices = self.choices.get(short_name)
+        if choices is None:
+            raise models.Character.DoesNotExist(short_name)
+        bits = 0
+        valued = 0
+        if self.value_types[short_name] == 'LENGTH':
+            length = float(value)
+            mm = self.units_mm[short_name]
+            for choice in choices:
+                valued |= choice.bits
+                if choice.is_range() and (choice.value_min * mm <= length
+                                          <= choice.value_max * mm):
+                    bits |= choice.bits
+        else:
+            for choice in choices:
+                valued |= choice.bits
+                if choice.value_str == value:
+                    bits |= choice.bits
+        return self.pile_bits & (bits | ~valued)
+
+    def query(self, selections):
+        """Return the species matching every (short name, value) selection.
+
+        The result is a bitset of the pile's species.  The result of each
+        individual selection is also returned, as a dictionary, so that
+        the caller can compute what would remain with one of them left
+        out.
+
+        """
+        bits = self.pile_bits
+        matches = {}
+        for short_name, value in selections.items():
+            matches[short_name] = m = self.matching(short_name, value)
+            bits &= m
+        return bits, matches
+
+    def counts(self, matches):
+        """Count the species that each text value would leave behind.
+
+        As in the Keys, the count for a character's values ignores any
+        selection already made for that same character.  Returns a
+        dictionary mapping each short name to a dictionary of
+        value -> count.
+
+        """
+        result = {}
+        for short_name, choices in self.choices.items():
+            if self.value_types[short_name] == 'LENGTH':
+                continue
+            other = self.pile_bits
+            for other_name, m in matches.items():
+                if other_name != short_name:
+                    other &= m
+            counts = result[short_name] = {}
+            for choice in choices:
+                if choice.value_str is None:
+                    continue
+                counts[choice.value_str] = (
+                    counts.get(choice.value_str, 0)
+                    + (choice.bits & other).bit_count())
+        return result
+
+
+def build_pile_vectors(pile):
+    """Compute the character value vectors for `pile` from the database."""
+
+    # These queries are the barest minimum required to learn how many
+    # character values each character has, and what species belong to
+    # each value.  Using Django ORM objects here would unfortunately
+    # destroy performance, as would trying to combine these queries into
+    # a single JOIN that repeats redundant data.
+
+    cursor = connection.cursor()
+
+    cursor.execute("""
+
+      SELECT c.id, c.short_name, c.friendly_name, cg.name,
+          c.ease_of_observability, c.value_type, c.unit
+        FROM core_character c
+        JOIN core_charactergroup cg ON (cg.id = c.character_group_id)
+        WHERE c.pile_id = %s
+
+      """, [pile.id])
+
+    character_map = {}
+    units_mm = {}
+    for cid, short_name, name, group_name, ease, value_type, unit \
+            in cursor.fetchall():
+        character_map[cid] = {
+            'slug': short_name,
+            'name': name,
+            'group_name': group_name,
+            'ease': ease,
+            'type': value_type,
+            'values': [],
+            }
+        units_mm[cid] = models.Character.UNIT_MM.get(unit, 1.0)
+
+    cursor.execute("""
+
+      SELECT cv.character_id, cv.id, cv.value_str, cv.value_min, cv.value_max
+        FROM core_character c
+        JOIN core_charactervalue cv ON (c.id = cv.character_id)
+        WHERE c.pile_id = %s
+        ORDER BY cv.id
+
+      """, [pile.id])
+
+    choice_map = {}
+    character_choices = defaultdict(list)
+    for cid, cvid, value_str, value_min, value_max in cursor.fetchall():
+        choice_map[cvid] = choice = Choice(cvid, value_str,
+                                           value_min, value_max)
+        character_choices[cid].append(choice)
+
+    cursor.execute("""
+
+      SELECT tcv.character_value_id, tcv.taxon_id
+        FROM core_character c
+        JOIN core_charactervalue cv ON (c.id = cv.character_id)
+        JOIN core_taxoncharactervalue tcv ON (cv.id = tcv.character_value_id)
+        WHERE c.pile_id = %s
+
+      """, [pile.id])
+
+    tcv_rows = cursor.fetchall()
+
+    cursor.execute("""
+
+      SELECT t.id, f.name, g.name
+        FROM core_pile_species ps
+        JOIN core_taxon t ON (t.id = ps.taxon_id)
+        JOIN core_family f ON (f.id = t.family_id)
+        JOIN core_genus g ON (g.id = t.genus_id)
+        WHERE ps.pile_id = %s
+
+      """, [pile.id])
+
+    species_rows = cursor.fetchall()
+
+    taxon_ids = set(taxon_id for taxon_id, family, genus in species_rows)
+    taxon_ids.update(taxon_id for cvid, taxon_id in tcv_rows)
+    taxon_ids = sorted(taxon_ids)
+
+    vectors = PileVectors(pile.id, pile.slug, taxon_ids,
+                          list(character_map.values()))
+    bit_numbers = vectors.bit_numbers
+
+    for cvid, taxon_id in tcv_rows:
+        choice_map[cvid].bits |= 1 << bit_numbers[taxon_id]
+
+    for cid, character in character_map.items():
+        short_name = character['slug']
+        choices = character_choices[cid]
+        character['values'] = [(choice.id, choice.bits)
+                               for choice in choices]
+        vectors.character_ids[short_name] = cid
+        vectors.value_types[short_name] = character['type']
+        vectors.units_mm[short_name] = units_mm[cid]
+        vectors.choices[short_name] = choices
+
+    # The family and genus of each species can be filtered on too, like
+    # any other text character.
+
+    families = defaultdict(int)
+    genera = defaultdict(int)
+    for taxon_id, family, genus in species_rows:
+        bit = 1 << bit_numbers[taxon_id]
+        vectors.pile_bits |= bit
+        families[family] |= bit
+        genera[genus] |= bit
+
+    for short_name, names in (('family', families), ('genus', genera)):
+        vectors.value_types[short_name] = 'TEXT'
+        vectors.choices[short_name] = [
+            Choice(None, name, None, None, bits)
+            for name, bits in sorted(names.items())
+            ]
+
+    return vectors
+
+
+def get_pile_vectors(slug):
+    """Return the `PileVectors` for the pile with this slug.
+
+    The vectors are computed on first use and then served from memory
+    until the botany data version changes.  Raises `Pile.DoesNotExist`
+    if there is no such pile.
+
+    """
+    version = models.DataVersion.objects.current()
+    cached = _pile_vectors.get(slug)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    pile = models.Pile.objects.get(slug=slug)
+    vectors = build_pile_vectors(pile)
+    _pile_vectors[slug] = (version, vectors)
+    return vectors
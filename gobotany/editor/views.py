@@ -482,6 +482,9 @@ def partner_plants_upload(request, idnum):
                       )[0]
                 ps.delete()
 
+            # Let the web processes know that the partner lists changed.
+            models.DataVersion.objects.bump()
+
             return redirect(return_url)
 
         # Step 2: they have selected a file and pressed "Upload".
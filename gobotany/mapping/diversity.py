@@ -0,0 +1,100 @@
+"""Count the plant taxa of each New England state and county.
+
+The counts shade the plant diversity maps, and can be downloaded as
+CSV.  They are computed for all three kinds of map - native, non-native,
+and all plants - in a single pass over the in-memory distribution store
+(see gobotany.core.distributions), and the results are cached until the
+"distribution" `DataVersion` is bumped.
+
+The rules for which records count are:
+
+* A plant whose only record in a state is a state-level one (as is
+  usual for very old herbarium records) is added to the state count,
+  if it is a binomial.  So the total for a state is not the sum of the
+  totals of its counties.
+
+* In a county that has only the binomial of a plant (no variety or
+  subspecies), the binomial is added to the county and the state.
+
+* In a county that has both the binomial and a variety or subspecies,
+  only the variety or subspecies is added to the county and the state.
+
+"""
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+from gobotany.core import distributions, memo
+
+KINDS = ('native', 'nonnative', 'all')
+STATE_TOTAL = '(all counties)'
+
+
+def _count_state(rows):
+    """Return the county counts and the state count of one state.
+
+    Each row is a (county, scientific_name, species_name,
+    is_infraspecific) tuple, with an empty county for state-level
+    records.
+
+    """
+    records_per_plant = Counter(row[1] for row in rows)
+    records_per_county_species = Counter(
+        (row[0], row[2]) for row in rows if row[0])
+
+    state_plants = set()
+    county_plants = defaultdict(set)
+    for county, scientific_name, species_name, is_infraspecific in rows:
+        if not county:
+            if (records_per_plant[scientific_name] == 1
+                    and not is_infraspecific):
+                state_plants.add(scientific_name)
+        elif (is_infraspecific
+                or records_per_county_species[county, species_name] == 1):
+            county_plants[county].add(scientific_name)
+            state_plants.add(scientific_name)
+
+    county_counts = [(county, len(county_plants[county]))
+                     for county in sorted(county_plants)]
+    return county_counts, len(state_plants)
+
+
+def compute_counts():
+    """Return the rows of counts for every kind of diversity map.
+
+    The result is a dictionary from each kind in KINDS to a list of
+    [state, county, count] rows, with each state's total in a row whose
+    county is STATE_TOTAL.
+
+    """
+    state_codes = [code.upper() for code in sorted(settings.STATE_NAMES)]
+    wanted_states = set(state_codes)
+
+    rows_of_kind = {kind: defaultdict(list) for kind in KINDS}
+    for scientific_name, species_name, state, county, flags \
+            in distributions.get_store().rows():
+        if not flags & distributions.PRESENT or state not in wanted_states:
+            continue
+        row = (county, scientific_name, species_name,
+               flags & distributions.INFRASPECIFIC)
+        rows_of_kind['all'][state].append(row)
+        if flags & distributions.NATIVE:
+            rows_of_kind['native'][state].append(row)
+        else:
+            rows_of_kind['nonnative'][state].append(row)
+
+    counts = {kind: [] for kind in KINDS}
+    for kind in KINDS:
+        for state in state_codes:
+            county_counts, state_count = _count_state(
+                rows_of_kind[kind][state])
+            counts[kind].extend([state, county, count]
+                                for county, count in county_counts)
+            counts[kind].append([state, STATE_TOTAL, state_count])
+    return counts
+
+
+def get_counts(kind):
+    """Return the [state, county, count] rows for one kind of map."""
+    return memo.memoize('diversity_counts', None, compute_counts,
+                        version_name='distribution')[kind]
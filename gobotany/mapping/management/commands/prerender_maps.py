@@ -0,0 +1,131 @@
+import json
+import multiprocessing
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from gobotany.core.models import DataVersion, Taxon
+from gobotany.mapping import render
+
+MANIFEST_NAME = render.MANIFEST_NAME
+
+
+def _save(path, content):
+    if default_storage.exists(path):
+        default_storage.delete(path)
+    default_storage.save(path, ContentFile(content))
+
+
+def _init_worker():
+    # Give each worker its own storage connection, instead of sharing
+    # one inherited from the parent process.
+    default_storage._setup()
+
+
+def output_paths(scientific_name, map_type, png):
+    """Return the storage paths of the files that one map is saved as."""
+    path = render.storage_name(map_type, scientific_name)
+    if png:
+        return [path, path[:-len('.svg')] + '.png']
+    return [path]
+
+
+def render_plant(job):
+    """Render and save the given maps of one plant; runs in a pool
+    worker.  Returns the plant's name and the paths it saved."""
+    scientific_name, records, map_types, png = job
+    saved = []
+    for map_type in map_types:
+        svg = render.shade_records(
+            map_type, scientific_name, records).tostring()
+        paths = output_paths(scientific_name, map_type, png)
+        _save(paths[0], svg)
+        if png:
+            _save(paths[1], render.png_from_svg(svg))
+        saved.extend(paths)
+    return scientific_name, saved
+
+
+class Command(BaseCommand):
+    """Render the distribution maps of every species, and save them to
+    the default storage as SVG (and optionally PNG) files that can be
+    served statically.
+
+    The distribution records of all the plants are read in a single
+    scan of the table, and the maps are then shaded across a pool of
+    worker processes.  A manifest saved alongside the maps remembers,
+    for each file saved, a fingerprint of the records it was rendered
+    from, so that with --changed-only only the maps whose records have
+    changed, or that have not been saved yet as the map types and
+    formats asked for, are rendered again.  The map views redirect to
+    the saved maps whose records are still current, instead of
+    rendering them.
+
+    Example, for just the New England maps of the maples:
+
+    dev/django prerender_maps --map-type ne Acer
+    """
+    help = 'Pre-renders distribution maps into storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('prefixes', nargs='*',
+                            help='only render plants whose scientific'
+                            ' names start with one of these')
+        parser.add_argument('--map-type', action='append',
+                            choices=sorted(render.MAP_TYPES),
+                            help='map type to render (default: all)')
+        parser.add_argument('--png', action='store_true',
+                            help='also save a PNG of each map')
+        parser.add_argument('--changed-only', action='store_true',
+                            help='only render plants whose distribution'
+                            ' records changed since the last run')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='worker processes (default: one per CPU)')
+
+    def handle(self, *args, **options):
+        map_types = options['map_type'] or sorted(render.MAP_TYPES)
+        png = options['png']
+        if png and render.cairosvg is None:
+            raise CommandError('PNG maps need the "cairosvg" package')
+
+        names = list(Taxon.objects.order_by('scientific_name')
+                     .values_list('scientific_name', flat=True))
+        prefixes = tuple(options['prefixes'])
+        if prefixes:
+            names = [name for name in names if name.startswith(prefixes)]
+
+        distributions = render.load_distributions(names)
+        fingerprints = {name: render.fingerprint_records(records)
+                        for name, records in distributions.items()}
+
+        manifest = render.read_manifest()
+
+        jobs = []
+        for name in names:
+            stale = map_types
+            if options['changed_only']:
+                stale = [map_type for map_type in map_types
+                         if any(manifest.get(path) != fingerprints[name]
+                                for path in output_paths(name, map_type, png))]
+            if stale:
+                jobs.append((name, distributions[name], stale, png))
+
+        # The workers must not share the database connection that this
+        # process has opened.
+        connections.close_all()
+        with multiprocessing.Pool(options['processes'],
+                                  initializer=_init_worker) as pool:
+            for scientific_name, paths in pool.imap_unordered(
+                    render_plant, jobs):
+                for path in paths:
+                    manifest[path] = fingerprints[scientific_name]
+                if options['verbosity'] > 1:
+                    self.stdout.write(scientific_name)
+
+        _save(MANIFEST_NAME, json.dumps(manifest, indent=1, sort_keys=True)
+              .encode('utf-8'))
+        DataVersion.objects.bump('maps')
+        self.stdout.write('Rendered %d maps for %d plants' % (
+            sum(len(job[2]) for job in jobs), len(jobs)))
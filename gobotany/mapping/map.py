@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import copy
 import re
 
+from collections import defaultdict
 from os.path import abspath, dirname
 
 from django.conf import settings
@@ -9,12 +11,14 @@ from django.core.exceptions import ObjectDoesNotExist
 
 from lxml import etree
 
-from gobotany.core import models
+from gobotany.core import distributions, models
 
 GRAPHICS_ROOT = abspath(dirname(__file__) + '/../static/graphics')
 NAMESPACES = {'svg': 'http://www.w3.org/2000/svg'}
 STATES = [k.upper() for k, v in list(settings.STATE_NAMES.items())]
 
+_blank_maps = {}  # blank map path -> parsed SVG tree, never itself shaded
+
 class Path(object):
     """Class for operating on a SVG path node."""
     STYLE_ATTR = 'style'
@@ -187,7 +191,13 @@ class ChloroplethMap(object):
     """Base class for a chloropleth SVG map."""
 
     def __init__(self, blank_map_path, maximum_legend_items):
-        self.svg_map = etree.parse(blank_map_path)
+        # Parsing a large blank map is slow, so each one is parsed only
+        # once per process, and every map gets its own copy to shade.
+        blank_map = _blank_maps.get(blank_map_path)
+        if blank_map is None:
+            blank_map = _blank_maps[blank_map_path] = etree.parse(
+                blank_map_path)
+        self.svg_map = copy.deepcopy(blank_map)
         self.maximum_legend_items = maximum_legend_items
 
     def _get_title_node(self):
@@ -250,8 +260,7 @@ class PlantDistributionMap(ChloroplethMap):
 
     def _get_distribution_records(self, scientific_name):
         """Look up the plant and get its distribution records."""
-        return models.Distribution.objects.all_records_for_plant(
-            scientific_name)
+        return distributions.get_store().records_for_plant(scientific_name)
 
     def set_plant(self, scientific_name):
         """Set the plant to be shown and gather its data."""
@@ -271,6 +280,15 @@ class PlantDistributionMap(ChloroplethMap):
                             break
             except ObjectDoesNotExist:
                 pass  # Didn't find the plant in the database
+        self.set_records(scientific_name, records)
+
+    def set_records(self, scientific_name, records):
+        """Set the plant to be shown along with its distribution records,
+        which might instead have been fetched in bulk for many plants.
+        Each record needs a state, county, present, and native, and the
+        records should be in (scientific name, state, county) order.
+        """
+        self.scientific_name = scientific_name
         self.distribution_records = records
 
         # Only add the plant name to the title if distribution data are
@@ -314,6 +332,20 @@ class PlantDistributionMap(ChloroplethMap):
 
         return should_shade
 
+    def _index_areas(self, path_nodes):
+        """Index the map's area nodes by their lowercase ID ("ma_essex"),
+        and by the state part of those IDs that have one ("ma").
+        """
+        areas = {}
+        state_areas = defaultdict(list)
+        for node in path_nodes:
+            node_id = node.get('id').lower()
+            areas.setdefault(node_id, node)
+            state, underscore, county = node_id.partition('_')
+            if underscore:
+                state_areas[state].append(node)
+        return areas, state_areas
+
     def _shade_areas(self):
         """Set the colors of the counties or states/provinces based
         on distribution data. Return a list of the legend labels to be
@@ -324,58 +356,52 @@ class PlantDistributionMap(ChloroplethMap):
             path_nodes = self.svg_map.xpath(self.PATH_NODES_XPATH,
                 namespaces=NAMESPACES)
 
-            # When shading a map area, iterate over the nodes rather
-            # than selecting a node via XPath. Iterating is around twice
-            # as fast as XPath, at least when breaking after finding a node
-            # as is done for the county-level records.
+            # Rather than searching the nodes for each record, index
+            # them once by ID, so each record finds its areas directly.
+            areas, state_areas = self._index_areas(path_nodes)
 
-            # Take a pass through the nodes and shade any county-level
-            # records.
+            # Shade any county-level records.
             # Keep track of which states had any county-level records.
-            states_with_county_records = []
-            county_records = self.distribution_records.exclude(county='')
+            states_with_county_records = set()
+            county_records = [record for record in self.distribution_records
+                              if record.county]
             for record in county_records:
                 state_and_county = '%s_%s' % (record.state.lower(),
                                               record.county.replace(
                                                   ' ', '_').lower())
-                for node in path_nodes:
-                    node_id = node.get('id').lower()
-                    if node_id == state_and_county:
-                        label = self._get_label(record.present, record.native,
-                            level='county')
-                        if label not in legend_labels_found:
-                            legend_labels_found.append(label)
-                        box = Path(node)
-                        if self._should_shade(box, record.present,
-                                record.native, level='county'):
-                            box.color(Legend.COLORS[label])
-                            states_with_county_records.append(
-                                record.state.lower())
-                        break   # Move on to the next distribution record.
-
-            # Take a pass through the nodes and shade any
-            # state-/province-/territory-level records.
-            state_records = self.distribution_records.filter(county='')
+                node = areas.get(state_and_county)
+                if node is not None:
+                    label = self._get_label(record.present, record.native,
+                        level='county')
+                    if label not in legend_labels_found:
+                        legend_labels_found.append(label)
+                    box = Path(node)
+                    if self._should_shade(box, record.present,
+                            record.native, level='county'):
+                        box.color(Legend.COLORS[label])
+                        states_with_county_records.add(
+                            record.state.lower())
+
+            # Shade any state-/province-/territory-level records.
+            state_records = [record for record in self.distribution_records
+                             if not record.county]
             for record in state_records:
-                state_id_piece = '%s_' % record.state.lower()
-                for node in path_nodes:
-                    node_id = node.get('id').lower()
-                    if node_id.startswith(state_id_piece):
-                        # If this state is not one where any county records
-                        # were mapped, proceed to map state records.
-                        state = record.state.lower()
-                        if state not in list(set(states_with_county_records)):
-                            label = self._get_label(record.present,
-                                record.native, level='state')
-                            if label not in legend_labels_found:
-                                legend_labels_found.append(label)
-                            box = Path(node)
-                            if self._should_shade(box, record.present,
-                                    record.native):
-                                box.color(Legend.COLORS[label])
-                            # Keep going rather than break, because for each
-                            # state-level record there will be multiple
-                            # counties to shade.
+                # Only map state records for a state where no county
+                # records were mapped.
+                state = record.state.lower()
+                if state in states_with_county_records:
+                    continue
+                # For each state-level record there will be multiple
+                # counties to shade.
+                for node in state_areas.get(state, ()):
+                    label = self._get_label(record.present,
+                        record.native, level='state')
+                    if label not in legend_labels_found:
+                        legend_labels_found.append(label)
+                    box = Path(node)
+                    if self._should_shade(box, record.present,
+                            record.native):
+                        box.color(Legend.COLORS[label])
 
             # Check all legend labels found to verify they should still
             # be visible on the map. Drop any labels that no longer have
@@ -614,38 +640,40 @@ class NorthAmericanPlantDistributionMap(PlantDistributionMap):
             path_nodes = self.svg_map.xpath(self.PATH_NODES_XPATH,
                 namespaces=NAMESPACES)
 
-            # Take a pass through the nodes and shade any
-            # state-/province-/territory-level records.
-            state_records = self.distribution_records.filter(county='')
+            # Index the nodes once by the state, province, or territory
+            # at the start of their IDs.
+            province_areas = defaultdict(list)
+            for node in path_nodes:
+                id_province = node.get('id').split('_')[0].upper()
+                province_areas[id_province].append(node)
+
+            # Shade any state-/province-/territory-level records. There
+            # are often multiple paths to shade.
+            state_records = [record for record in self.distribution_records
+                             if not record.county]
             for record in state_records:
-                for node in path_nodes:
-                    id_province = node.get('id').split('_')[0].upper()
-                    if id_province == record.state.upper():
-                        label = self._get_label(record.present, record.native)
-                        if label not in legend_labels_found:
-                            legend_labels_found.append(label)
-                        box = Path(node)
-                        if self._should_shade(box, record.present,
-                                record.native):
-                            box.color(Legend.COLORS[label])
-                        # Keep going rather than break, because
-                        # there are often multiple paths to shade.
-
-            # Take a pass through the nodes and override state shading 
-            # if necessary based on county-level records.
-            county_records = self.distribution_records.exclude(county='')
+                for node in province_areas.get(record.state.upper(), ()):
+                    label = self._get_label(record.present, record.native)
+                    if label not in legend_labels_found:
+                        legend_labels_found.append(label)
+                    box = Path(node)
+                    if self._should_shade(box, record.present,
+                            record.native):
+                        box.color(Legend.COLORS[label])
+
+            # Override state shading if necessary based on county-level
+            # records, each of which shades the state's first path.
+            county_records = [record for record in self.distribution_records
+                              if record.county]
             for record in county_records:
-                for node in path_nodes:
-                    id_province = node.get('id').split('_')[0].upper()
-                    if id_province == record.state.upper():
-                        label = self._get_label(record.present, record.native)
-                        if label not in legend_labels_found:
-                            legend_labels_found.append(label)
-                        box = Path(node)
-                        if self._should_shade(box, record.present,
-                                record.native):
-                            box.color(Legend.COLORS[label])
-                        break   # Move on to the next distribution record.
+                for node in province_areas.get(record.state.upper(), ())[:1]:
+                    label = self._get_label(record.present, record.native)
+                    if label not in legend_labels_found:
+                        legend_labels_found.append(label)
+                    box = Path(node)
+                    if self._should_shade(box, record.present,
+                            record.native):
+                        box.color(Legend.COLORS[label])
 
             legend_labels_found = self._order_labels(legend_labels_found)
 
@@ -0,0 +1,164 @@
+"""Render plant distribution maps, remembering what has been rendered.
+
+Shading a map means copying the blank map, looking up the plant's
+distribution records, and coloring the areas one record at a time;
+serializing the result is slow, too, for the larger maps.  Since the
+distribution data changes only when it is imported or edited, we keep
+the finished SVG bytes of each map in the cache (see gobotany.core.memo)
+until the "distribution" `DataVersion` is bumped.
+
+The SVG bytes can also be written ahead of time to the default storage
+by the "prerender_maps" management command, from which the web tier or
+a CDN can serve them as static files.  For that, `load_distributions()`
+looks up the records of many plants in the in-memory distribution store
+(see gobotany.core.distributions), instead of with one query per plant.
+The command saves a manifest of the records each map was rendered
+from, and bumps the "maps" `DataVersion`; the map views then redirect
+to the saved file, found by `prerendered_url()`, for as long as its
+plant's records have not changed.
+
+"""
+import hashlib
+import json
+from collections import defaultdict
+
+from django.core.files.storage import default_storage
+from django.db import connection
+
+from gobotany.core import distributions, memo, models
+from gobotany.mapping.map import (NewEnglandPlantDistributionMap,
+    NorthAmericanPlantDistributionMap, UnitedStatesPlantDistributionMap)
+
+try:
+    import cairosvg
+except ImportError:
+    cairosvg = None
+
+MANIFEST_NAME = 'maps/manifest.json'
+
+_manifests = {}  # "maps" data version -> manifest of prerendered maps
+
+MAP_TYPES = {
+    'ne': NewEnglandPlantDistributionMap,
+    'us': UnitedStatesPlantDistributionMap,
+    'na': NorthAmericanPlantDistributionMap,
+    }
+
+def shade_map(map_type, scientific_name):
+    """Return a newly shaded distribution map of `map_type` for a plant."""
+    distribution_map = MAP_TYPES[map_type]()
+    distribution_map.set_plant(scientific_name)
+    return distribution_map.shade()
+
+
+def shade_records(map_type, scientific_name, records):
+    """Return a distribution map shaded from already-fetched records."""
+    distribution_map = MAP_TYPES[map_type]()
+    distribution_map.set_records(scientific_name, records)
+    return distribution_map.shade()
+
+
+def render_map(map_type, scientific_name):
+    """Return the SVG bytes of a distribution map for a plant."""
+    return memo.memoize(
+        'distribution_map', (map_type, scientific_name),
+        lambda: shade_map(map_type, scientific_name).tostring(),
+        version_name='distribution')
+
+
+def storage_name(map_type, scientific_name):
+    """Return the storage path under which a rendered map is saved."""
+    slug = scientific_name.lower().replace(' ', '-')
+    return 'maps/%s-%s-distribution-map.svg' % (slug, map_type)
+
+
+def read_manifest():
+    """Return the manifest of prerendered maps, which maps the storage
+    path of each map to the fingerprint of the records it shows."""
+    if not default_storage.exists(MANIFEST_NAME):
+        return {}
+    with default_storage.open(MANIFEST_NAME) as f:
+        return json.loads(f.read())
+
+
+def _get_manifest(version):
+    manifest = _manifests.get(version)
+    if manifest is None:
+        _manifests.clear()
+        manifest = _manifests[version] = read_manifest()
+    return manifest
+
+
+def prerendered_url(map_type, scientific_name):
+    """Return the URL of a prerendered map of a plant, or None if there
+    is none, or if the plant's records have changed since it was saved."""
+    maps_version = models.DataVersion.objects.current('maps')
+    return memo.memoize(
+        'prerendered_map', (map_type, scientific_name, maps_version),
+        lambda: _find_prerendered(map_type, scientific_name, maps_version),
+        version_name='distribution') or None
+
+
+def _find_prerendered(map_type, scientific_name, maps_version):
+    path = storage_name(map_type, scientific_name)
+    fingerprint = _get_manifest(maps_version).get(path)
+    if fingerprint is None:
+        return ''
+    records = load_distributions([scientific_name])[scientific_name]
+    if fingerprint_records(records) != fingerprint:
+        return ''
+    return default_storage.url(path)
+
+
+def png_from_svg(svg):
+    """Return a PNG rendering of SVG bytes; needs the cairosvg library."""
+    if cairosvg is None:
+        raise RuntimeError('PNG maps need the "cairosvg" package')
+    return cairosvg.svg2png(bytestring=svg)
+
+
+def load_distributions(scientific_names):
+    """Return the distribution records of many plants, by plant name.
+
+    Like `Distribution.objects.all_records_for_plant()`, a plant gets
+    the records for its exact name plus those of any name that starts
+    with its name followed by a space, so a species also gets the
+    records of its subspecies and varieties; and, as on the maps, a
+    plant without records of its own gets those of its first synonym
+    that has any.  The records come from the in-memory distribution
+    store, which reads the whole table in one pass.
+
+    """
+    store = distributions.get_store()
+    wanted = set(scientific_names)
+
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT t.scientific_name, s.scientific_name
+          FROM core_synonym s
+          JOIN core_taxon t ON (t.id = s.taxon_id)
+          ORDER BY s.scientific_name
+        """)
+    synonyms = defaultdict(list)
+    for taxon_name, synonym_name in cursor.fetchall():
+        if taxon_name in wanted:
+            synonyms[taxon_name].append(synonym_name)
+
+    result = {}
+    for name in scientific_names:
+        records = store.records_for_plant(name)
+        if not records:
+            for synonym_name in synonyms.get(name, ()):
+                records = store.records_for_plant(synonym_name)
+                if records:
+                    break
+        result[name] = records
+    return result
+
+
+def fingerprint_records(records):
+    """Return a hash that changes whenever any of the records changes."""
+    h = hashlib.sha1()
+    for record in records:
+        h.update(repr(tuple(record)).encode('utf-8'))
+    return h.hexdigest()
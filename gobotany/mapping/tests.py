@@ -1,6 +1,14 @@
+import json
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
 from django.test import TestCase
 
-from gobotany.core.models import Distribution, Family, Genus, Synonym, Taxon
+from gobotany.core import distributions
+from gobotany.core.models import (DataVersion, Distribution, Family, Genus,
+                                  Synonym, Taxon)
+from gobotany.mapping import diversity, render
 from gobotany.mapping.map import (NAMESPACES, Path, Legend,
                                   NewEnglandPlantDistributionMap,
                                   NorthAmericanPlantDistributionMap,
@@ -278,6 +286,7 @@ def create_distribution_records():
                 county=entry[0], state=entry[1], present=entry[2],
                 native=entry[3])
             distribution.save()
+    distributions.reset()
 
 
 class PlantDistributionMapTestCase(TestCase):
@@ -633,3 +642,188 @@ class NorthAmericanPlantDistributionMapTestCase(TestCase):
             shaded_paths)
         self._verify_expected_shaded_areas(EXPECTED_SHADED_AREAS,
             shaded_paths)
+
+
+class RenderTestCase(TestCase):
+    SCIENTIFIC_NAME = 'Dendrolycopodium dendroideum'
+
+    def setUp(self):
+        cache.clear()
+        create_distribution_records()
+
+    def test_maps_do_not_share_the_blank_map(self):
+        shaded = render.shade_map('ne', self.SCIENTIFIC_NAME)
+        blank = NewEnglandPlantDistributionMap()
+        self.assertNotEqual(shaded.tostring(), blank.tostring())
+        self.assertEqual(blank.tostring(),
+                         NewEnglandPlantDistributionMap().tostring())
+
+    def test_render_map_returns_shaded_svg(self):
+        svg = render.render_map('ne', self.SCIENTIFIC_NAME)
+        self.assertEqual(svg, render.shade_map(
+            'ne', self.SCIENTIFIC_NAME).tostring())
+        self.assertTrue(self.SCIENTIFIC_NAME.encode('utf-8') in svg)
+
+    def test_render_map_is_cached_until_distribution_version_changes(self):
+        svg = render.render_map('ne', self.SCIENTIFIC_NAME)
+        Distribution.objects.filter(
+            scientific_name=self.SCIENTIFIC_NAME).delete()
+        self.assertEqual(svg, render.render_map('ne', self.SCIENTIFIC_NAME))
+        DataVersion.objects.bump('distribution')
+        self.assertNotEqual(svg,
+                            render.render_map('ne', self.SCIENTIFIC_NAME))
+
+    def test_storage_name(self):
+        self.assertEqual(
+            render.storage_name('na', self.SCIENTIFIC_NAME),
+            'maps/dendrolycopodium-dendroideum-na-distribution-map.svg')
+
+    def test_load_distributions_matches_per_plant_queries(self):
+        names = ['Dendrolycopodium dendroideum', 'Vaccinium vitis-idaea',
+                 'Vaccinium', 'No such plant']
+        distributions = render.load_distributions(names)
+        for name in names:
+            expected = [
+                (r.scientific_name, r.state, r.county, r.present, r.native)
+                for r in Distribution.objects.all_records_for_plant(name)]
+            self.assertEqual(
+                [(r.scientific_name, r.state, r.county, bool(r.present),
+                  bool(r.native)) for r in distributions[name]], expected)
+
+    def test_shade_records_matches_shade_map(self):
+        records = render.load_distributions([self.SCIENTIFIC_NAME])
+        for map_type in render.MAP_TYPES:
+            self.assertEqual(
+                render.shade_records(map_type, self.SCIENTIFIC_NAME,
+                    records[self.SCIENTIFIC_NAME]).tostring(),
+                render.shade_map(map_type, self.SCIENTIFIC_NAME).tostring())
+
+
+class PrerenderMapsTestCase(TestCase):
+    PATH = 'maps/dendrolycopodium-dendroideum-ne-distribution-map.svg'
+    NA_PATH = 'maps/dendrolycopodium-dendroideum-na-distribution-map.svg'
+
+    URL = '/api/maps/dendrolycopodium-dendroideum-ne-distribution-map.svg'
+
+    def setUp(self):
+        cache.clear()
+        render._manifests.clear()
+        create_distribution_records()
+
+    def tearDown(self):
+        for path in (self.PATH, self.NA_PATH, 'maps/manifest.json'):
+            if default_storage.exists(path):
+                default_storage.delete(path)
+        cache.clear()
+        render._manifests.clear()
+
+    def _prerender(self, *args, **options):
+        call_command('prerender_maps', 'Dendrolycopodium', *args,
+                     map_type=['ne'], processes=1, **options)
+
+    def test_maps_and_manifest_are_saved(self):
+        self._prerender()
+        with default_storage.open(self.PATH) as f:
+            self.assertEqual(f.read(), render.shade_map(
+                'ne', 'Dendrolycopodium dendroideum').tostring())
+        with default_storage.open('maps/manifest.json') as f:
+            manifest = json.loads(f.read())
+        self.assertEqual(list(manifest), [self.PATH])
+
+    def test_changed_only_skips_plants_with_unchanged_records(self):
+        self._prerender()
+        default_storage.delete(self.PATH)
+        self._prerender(changed_only=True)
+        self.assertFalse(default_storage.exists(self.PATH))
+        Distribution.objects.filter(
+            scientific_name='Dendrolycopodium dendroideum',
+            state='MA').update(present=False)
+        DataVersion.objects.bump('distribution')
+        self._prerender(changed_only=True)
+        self.assertTrue(default_storage.exists(self.PATH))
+
+    def test_changed_only_renders_map_types_not_rendered_before(self):
+        self._prerender()
+        default_storage.delete(self.PATH)
+        call_command('prerender_maps', 'Dendrolycopodium',
+                     map_type=['ne', 'na'], processes=1, changed_only=True)
+        self.assertFalse(default_storage.exists(self.PATH))
+        self.assertTrue(default_storage.exists(self.NA_PATH))
+
+
+    def test_map_view_redirects_to_current_prerendered_map(self):
+        self.assertEqual(self.client.get(self.URL).status_code, 200)
+        self._prerender()
+        response = self.client.get(self.URL)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], default_storage.url(self.PATH))
+
+    def test_map_view_renders_map_whose_records_have_changed(self):
+        self._prerender()
+        Distribution.objects.filter(
+            scientific_name='Dendrolycopodium dendroideum',
+            state='MA').update(present=False)
+        DataVersion.objects.bump('distribution')
+        response = self.client.get(self.URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+
+
+class DiversityTestCase(TestCase):
+    def setUp(self):
+        for scientific_name, state, county, present, native in [
+                ('Acer rubrum', 'MA', 'Middlesex', True, True),
+                ('Acer rubrum var. trilobum', 'MA', 'Middlesex', True, True),
+                ('Acer rubrum', 'MA', 'Essex', True, True),
+                ('Acer saccharum', 'MA', '', True, True),
+                ('Acer saccharum var. nigrum', 'ME', '', True, True),
+                ('Acer negundo', 'ME', '', True, True),
+                ('Acer negundo', 'ME', 'York', True, True),
+                ('Alliaria petiolata', 'MA', 'Essex', True, False),
+                ('Betula lenta', 'MA', 'Essex', False, True),
+                ('Betula lenta', 'NY', 'Albany', True, True),
+                ]:
+            Distribution.objects.create(
+                scientific_name=scientific_name, state=state, county=county,
+                present=present, native=native)
+        distributions.reset()
+
+    def test_counts(self):
+        counts = diversity.compute_counts()
+        self.assertEqual(counts['native'], [
+            ['CT', '(all counties)', 0],
+            ['MA', 'Essex', 1],
+            ['MA', 'Middlesex', 1],
+            ['MA', '(all counties)', 3],
+            ['ME', 'York', 1],
+            ['ME', '(all counties)', 1],
+            ['NH', '(all counties)', 0],
+            ['RI', '(all counties)', 0],
+            ['VT', '(all counties)', 0],
+            ])
+        self.assertEqual(counts['nonnative'][1:3], [
+            ['MA', 'Essex', 1],
+            ['MA', '(all counties)', 1],
+            ])
+        self.assertEqual(counts['all'][1:4], [
+            ['MA', 'Essex', 2],
+            ['MA', 'Middlesex', 1],
+            ['MA', '(all counties)', 4],
+            ])
+
+    def test_counts_are_cached_until_distribution_data_changes(self):
+        cache.clear()
+        suffolk = ['MA', 'Suffolk', 1]
+        self.assertNotIn(suffolk, diversity.get_counts('nonnative'))
+        Distribution.objects.create(scientific_name='Alliaria petiolata',
+            state='MA', county='Suffolk', present=True, native=False)
+        self.assertNotIn(suffolk, diversity.get_counts('nonnative'))
+        DataVersion.objects.bump('distribution')
+        self.assertIn(suffolk, diversity.get_counts('nonnative'))
+
+    def test_csv_and_map_views(self):
+        response = self.client.get('/api/maps/ne-diversity-map-native.csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn(b'MA,(all counties),3', response.content)
+        response = self.client.get('/api/maps/ne-diversity-map-native')
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
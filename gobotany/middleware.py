@@ -1,8 +1,56 @@
 from django.conf import settings
 from django import http
+from django.middleware import gzip
 from django.urls import resolve
+from django.utils.cache import patch_vary_headers
 from django.utils.deprecation import MiddlewareMixin
 
+
+def accepted_codings(header):
+    """Return the content codings that an Accept-Encoding header allows.
+
+    A coding given a quality of zero, like ``gzip;q=0``, is refused, as
+    is every coding not named when ``*`` is refused or absent.
+
+    """
+    accepted = set()
+    refused = set()
+    everything = False
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding == '*':
+            everything = quality > 0
+        elif coding:
+            (accepted if quality > 0 else refused).add(coding)
+    if everything:
+        accepted.update({'br', 'gzip'} - refused)
+    return accepted
+
+
+class GZipMiddleware(gzip.GZipMiddleware):
+    """Django's GZipMiddleware, except that it does not compress for a
+    client that refuses gzip with ``gzip;q=0``, which Django's own test
+    of the Accept-Encoding header takes as accepting it."""
+
+    def process_response(self, request, response):
+        header = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if 'gzip' not in accepted_codings(header):
+            if not response.has_header('Content-Encoding'):
+                patch_vary_headers(response, ('Accept-Encoding',))
+            return response
+        return super(GZipMiddleware, self).process_response(
+            request, response)
+
+
 # Middleware class courtesy of https://djangosnippets.org/snippets/601/
 # (adapte for new-style Middleware)
 class SmartAppendSlashMiddleware(MiddlewareMixin):
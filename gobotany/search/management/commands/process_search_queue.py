@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from gobotany.search import queue
+
+
+class Command(BaseCommand):
+    """Apply the queued search index updates.
+
+    Saves and deletes of indexed objects are queued instead of sent to
+    the search backend at once (see gobotany.search.queue).  Without
+    --interval, this applies what is queued and exits; with it, this
+    keeps applying whatever has been queued every so many seconds, as
+    a worker process.  Example, every ten seconds:
+
+    dev/django process_search_queue --interval 10
+    """
+    help = 'Applies queued updates to the search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='keep running, applying the queue every'
+                            ' this many seconds')
+        parser.add_argument('--limit', type=int, default=10000,
+                            help='most queued updates applied at once'
+                            ' (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            start = time.perf_counter()
+            updated, removed = queue.process_queue(options['limit'])
+            if updated or removed or options['verbosity'] > 1:
+                self.stdout.write(
+                    'Updated %d and removed %d documents in %.2f s' % (
+                        updated, removed, time.perf_counter() - start))
+            if interval is None:
+                break
+            # Do not hold a database connection open while asleep.
+            connections.close_all()
+            time.sleep(interval)
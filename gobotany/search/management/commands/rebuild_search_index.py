@@ -0,0 +1,139 @@
+import multiprocessing
+import os
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from haystack import connections as haystack_connections
+from haystack.exceptions import SkipDocument
+
+
+class PreparedIndex(object):
+    """Stands in for a search index whose documents have already been
+    prepared, so that a backend's `update()` posts them as they are."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def full_prepare(self, document):
+        return document
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+
+def render_documents(job):
+    """Prepare the search documents of a batch of objects; runs in a
+    pool worker."""
+    using, model_label, pks = job
+    model = apps.get_model(model_label)
+    index = haystack_connections[using].get_unified_index().get_index(model)
+    documents = []
+    for obj in index.index_queryset(using=using).filter(pk__in=pks):
+        try:
+            documents.append(index.full_prepare(obj))
+        except SkipDocument:
+            pass
+    return documents
+
+
+class Command(BaseCommand):
+    """Rebuild the search indexes in bulk.
+
+    Unlike Haystack's "rebuild_index", which prepares and posts each
+    batch of objects in turn, this prepares the documents of each index
+    across a pool of worker processes, in batches of objects whose
+    character values, common names, synonyms, lookalikes, and statuses
+    are each fetched with one query per batch (see the `index_queryset()`
+    of each index), and then replaces the index's documents in the
+    backend in a few large posts.  The time and documents per second of
+    each index are reported.
+
+    Example, for just the species and genera, in batches of 200:
+
+    dev/django rebuild_search_index --batch-size 200 core.Taxon core.Genus
+    """
+    help = 'Rebuilds the search indexes across a pool of processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*',
+                            help='only rebuild the indexes of these models,'
+                            ' like "core.Taxon" (default: all)')
+        parser.add_argument('--using', default='default',
+                            help='search connection (default: %(default)s)')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='objects prepared by each worker job'
+                            ' (default: %(default)s)')
+        parser.add_argument('--post-size', type=int, default=2000,
+                            help='documents posted to the backend at once'
+                            ' (default: %(default)s)')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='worker processes (default: one per CPU)')
+
+    def handle(self, *args, **options):
+        using = options['using']
+        unified_index = haystack_connections[using].get_unified_index()
+        backend = haystack_connections[using].get_backend()
+
+        models = sorted(unified_index.get_indexed_models(),
+                        key=lambda model: model._meta.label)
+        if options['models']:
+            labels = {label.lower() for label in options['models']}
+            unknown = labels - {model._meta.label_lower for model in models}
+            if unknown:
+                raise CommandError('no search index for: %s'
+                                   % ', '.join(sorted(unknown)))
+            models = [model for model in models
+                      if model._meta.label_lower in labels]
+
+        processes = options['processes'] or os.cpu_count()
+        batch_size = options['batch_size']
+        post_size = options['post_size']
+
+        total_documents = 0
+        total_start = time.perf_counter()
+        for model in models:
+            index = unified_index.get_index(model)
+            start = time.perf_counter()
+            pks = list(index.index_queryset(using=using)
+                       .order_by('pk').values_list('pk', flat=True))
+            jobs = [(using, model._meta.label, pks[i:i + batch_size])
+                    for i in range(0, len(pks), batch_size)]
+
+            documents = []
+            if processes > 1 and len(jobs) > 1:
+                # The workers must not share the database connection
+                # that this process has opened.
+                connections.close_all()
+                with multiprocessing.Pool(processes) as pool:
+                    for batch in pool.imap_unordered(render_documents, jobs):
+                        documents.extend(batch)
+            else:
+                for job in jobs:
+                    documents.extend(render_documents(job))
+            prepared = time.perf_counter()
+
+            # Commit only with the last post, so that a backend like
+            # Solr goes on serving the old documents until then.
+            backend.clear(models=[model], commit=not documents)
+            prepared_index = PreparedIndex(index)
+            for i in range(0, len(documents), post_size):
+                backend.update(prepared_index, documents[i:i + post_size],
+                               commit=i + post_size >= len(documents))
+            posted = time.perf_counter()
+
+            elapsed = posted - start
+            self.stdout.write(
+                '%-24s %6d documents  %8.2f s prepare  %8.2f s post'
+                '  %8.0f/s' % (
+                    model._meta.label, len(documents), prepared - start,
+                    posted - prepared,
+                    len(documents) / elapsed if elapsed else 0))
+            total_documents += len(documents)
+
+        elapsed = time.perf_counter() - total_start
+        self.stdout.write('%-24s %6d documents  %8.2f s total  %19.0f/s' % (
+            'all', total_documents, elapsed,
+            total_documents / elapsed if elapsed else 0))
@@ -0,0 +1,27 @@
+# Generated by Django 4.1.13 on 2026-10-18 19:22
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingIndexUpdate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('object_pk', models.CharField(max_length=40)),
+                ('queued_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'pending index update',
+                'verbose_name_plural': 'pending index updates',
+            },
+        ),
+    ]
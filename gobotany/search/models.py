@@ -1,6 +1,7 @@
 import re
 
 from django.db import models
+from django.utils import timezone
 
 from gobotany.core.models import Pile, PileGroup
 
@@ -128,3 +129,22 @@ class SubgroupResultsPage(models.Model):
             [self.subgroup.friendly_name, self.subgroup.friendly_title])
 
         return suggestions
+
+
+class PendingIndexUpdate(models.Model):
+    """An object that has been saved or deleted since the search index
+    was last brought up to date (see gobotany.search.queue).
+
+    The same object may be queued many times over; its documents are
+    updated just once when the queue is processed.
+    """
+    model = models.CharField(max_length=100)  # like 'core.taxon'
+    object_pk = models.CharField(max_length=40)
+    queued_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = 'pending index update'
+        verbose_name_plural = 'pending index updates'
+
+    def __str__(self):
+        return '%s.%s' % (self.model, self.object_pk)
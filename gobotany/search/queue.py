@@ -0,0 +1,116 @@
+"""Update the search index from a queue, instead of on every save.
+
+Haystack's `RealtimeSignalProcessor` updates the search index during
+each save and delete of an indexed object, so every admin edit and
+every PlantShare sighting or question waits on a round trip to the
+search backend, and fails or stalls when the backend does.  Instead,
+the `QueuedSignalProcessor` only records which object changed, as a
+`PendingIndexUpdate` row written in the same transaction as the change
+itself, and the "process_search_queue" command, run every few seconds,
+brings the index up to date with `process_queue()`.
+
+Each pass coalesces everything queued since the last one: an object
+saved ten times is indexed once, and the objects of each model are read
+back in a single query through their index's `index_queryset()`, with
+its prefetching.  An object that is no longer there, or that the index
+would no longer include (like a sighting that has been made private),
+is removed from the index.
+
+"""
+import logging
+from collections import defaultdict
+
+from django.apps import apps
+from django.db import models, transaction
+
+from haystack import connection_router, connections
+from haystack.exceptions import NotHandled
+from haystack.signals import BaseSignalProcessor
+
+from gobotany.search.models import PendingIndexUpdate
+
+log = logging.getLogger('gobotany.search')
+
+
+class QueuedSignalProcessor(BaseSignalProcessor):
+    """Queue a `PendingIndexUpdate` for each save or delete of an
+    object that has a search index."""
+
+    def setup(self):
+        self._indexed_models = None
+        models.signals.post_save.connect(self.handle_save)
+        models.signals.post_delete.connect(self.handle_delete)
+
+    def teardown(self):
+        models.signals.post_save.disconnect(self.handle_save)
+        models.signals.post_delete.disconnect(self.handle_delete)
+
+    def indexed_models(self):
+        if self._indexed_models is None:
+            self._indexed_models = set()
+            for using in self.connections.connections_info:
+                unified_index = self.connections[using].get_unified_index()
+                self._indexed_models.update(
+                    unified_index.get_indexed_models())
+        return self._indexed_models
+
+    def handle_save(self, sender, instance, **kwargs):
+        if sender in self.indexed_models():
+            PendingIndexUpdate.objects.create(
+                model=sender._meta.label_lower, object_pk=str(instance.pk))
+
+    handle_delete = handle_save
+
+
+def process_queue(limit=10000):
+    """Apply up to `limit` queued updates to the search index.
+
+    Returns the number of objects whose documents were updated and the
+    number whose documents were removed.  The queue rows are deleted
+    only once the backends have taken the changes, so if a backend
+    raises an error they stay queued for the next pass.
+
+    """
+    rows = list(PendingIndexUpdate.objects.order_by('id')
+                .values_list('id', 'model', 'object_pk')[:limit])
+    if not rows:
+        return 0, 0
+
+    pks_by_model = defaultdict(set)
+    for row_id, model_label, object_pk in rows:
+        pks_by_model[model_label].add(object_pk)
+
+    updated = removed = 0
+    for model_label, pks in sorted(pks_by_model.items()):
+        try:
+            model = apps.get_model(model_label)
+        except LookupError:
+            log.warning('Dropping queued index updates of unknown model %s',
+                        model_label)
+            continue
+        pks = sorted(pks)
+        found = set()
+        for using in connection_router.for_write():
+            try:
+                index = connections[using].get_unified_index().get_index(
+                    model)
+            except NotHandled:
+                continue
+            backend = connections[using].get_backend()
+            objects = list(index.index_queryset(using=using)
+                           .filter(pk__in=pks))
+            for i in range(0, len(objects), backend.batch_size):
+                backend.update(index, objects[i:i + backend.batch_size])
+            found = {str(obj.pk) for obj in objects}
+            for pk in pks:
+                if pk not in found:
+                    backend.remove('%s.%s' % (model_label, pk))
+        updated += len(found)
+        removed += len(pks) - len(found)
+
+    row_ids = [row[0] for row in rows]
+    with transaction.atomic():
+        for i in range(0, len(row_ids), 500):
+            PendingIndexUpdate.objects.filter(
+                id__in=row_ids[i:i + 500]).delete()
+    return updated, removed
@@ -32,6 +32,14 @@ class CharacterCharField(indexes.CharField):
         return self.convert(self.lookup_character_value(obj) or self.default)
 
     def lookup_character_value(self, obj):
+        if 'character_values' in getattr(obj, '_prefetched_objects_cache',
+                                         {}):
+            # Search the values that `index_queryset()` prefetched,
+            # instead of querying for each object.
+            for cv in obj.character_values.all():
+                if cv.character.short_name == self.character_name:
+                    return cv.value
+            return None
         cvs = obj.character_values.filter(
             character__short_name=self.character_name)
         if len(cvs) > 0:
@@ -91,6 +99,8 @@ class TaxonIndex(BaseIndex, indexes.Indexable):
                 .prefetch_related(
                     'character_values__character',
                     'common_names',
+                    'conservation_statuses',
+                    'invasive_statuses',
                     'lookalikes',
                     'piles__pilegroup',
                     'synonyms'))
@@ -0,0 +1,348 @@
+"""A Haystack search backend that needs no search server.
+
+The site search normally runs against Solr, which is not available in
+every environment.  This backend keeps the search documents instead in
+an SQLite database file of their own, with an FTS5 full-text index
+over their "text", "name", and "title" fields, and ranks matches with
+FTS5's BM25 function.  To use it, configure a connection like:
+
+    HAYSTACK_CONNECTIONS = {
+        'default': {
+            'ENGINE': 'gobotany.search.sqlite_backend.SQLiteEngine',
+            'PATH': '/var/lib/gobotany/search.sqlite3',
+            },
+        }
+
+and fill it with "dev/django rebuild_index".  Every process opens the
+file for itself, so once the search queue has applied a save made
+through the admin (see gobotany.search.queue), every web process sees
+it.
+
+What the site asks of Solr is honored: words are stemmed as English,
+each document's index-time boost (like the 1.5 of `TaxonIndex`)
+multiplies its score, a match on the "name" field counts for much more
+than a match in the text, documents whose field equals the value of an
+"exact" filter come first (so `GoBotanySearchView` can still privilege
+exact names with `name__exact`), and highlighted snippets are returned
+when asked for.  Term boosts, facets, spelling suggestions, spatial
+queries, and "more like this" are not supported.
+
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from haystack.backends import (BaseEngine, BaseSearchBackend,
+    BaseSearchQuery, log_query)
+from haystack.constants import DJANGO_CT, DJANGO_ID, ID
+from haystack.exceptions import SearchBackendError, SkipDocument
+from haystack.inputs import Clean, PythonData
+from haystack.models import SearchResult
+from haystack.utils import get_identifier, get_model_ct
+from haystack.utils.app_loading import haystack_get_model
+
+COLUMNS = ('text', 'name', 'title')  # the fields that are full-text indexed
+COLUMN_WEIGHTS = (1.0, 10.0, 2.0)    # how much a match in each one counts
+SNIPPET_TOKENS = 32                  # words in a highlighted snippet
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    docid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    django_ct TEXT NOT NULL,
+    django_id TEXT NOT NULL,
+    boost REAL NOT NULL,
+    data TEXT NOT NULL,
+    text TEXT,
+    name TEXT,
+    title TEXT
+);
+CREATE INDEX IF NOT EXISTS documents_django_ct ON documents (django_ct);
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+    text, name, title, content='documents', content_rowid='docid',
+    tokenize='porter unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS documents_insert AFTER INSERT ON documents
+BEGIN
+    INSERT INTO documents_fts (rowid, text, name, title)
+    VALUES (new.docid, new.text, new.name, new.title);
+END;
+CREATE TRIGGER IF NOT EXISTS documents_delete AFTER DELETE ON documents
+BEGIN
+    INSERT INTO documents_fts (documents_fts, rowid, text, name, title)
+    VALUES ('delete', old.docid, old.text, old.name, old.title);
+END;
+"""
+
+_query_token = re.compile(r'NOT\s+"?([^"\s]+)"?|"([^"]*)"|(\S+)')
+_word = re.compile(r'\w+')
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    # Every query value is quoted as an FTS5 string, so nothing needs
+    # escaping by `BaseSearchQuery.clean()`.
+    RESERVED_WORDS = ()
+    RESERVED_CHARACTERS = ()
+
+    def __init__(self, connection_alias, **connection_options):
+        super(SQLiteSearchBackend, self).__init__(
+            connection_alias, **connection_options)
+        self.path = connection_options.get('PATH')
+        if not self.path:
+            raise ImproperlyConfigured(
+                "You must specify a 'PATH' in your settings for connection"
+                " '%s'." % connection_alias)
+        self.log = logging.getLogger('haystack')
+        self._local = threading.local()
+
+    @property
+    def db(self):
+        """Return this thread's connection to the index, opening it and
+        creating the tables if need be."""
+        pid, db = getattr(self._local, 'db', (None, None))
+        if pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=self.timeout)
+            db.execute('PRAGMA journal_mode = WAL')
+            db.executescript(SCHEMA)
+            self._local.db = (os.getpid(), db)
+        return db
+
+    def update(self, index, iterable, commit=True):
+        rows = []
+        for obj in iterable:
+            try:
+                doc = index.full_prepare(obj)
+            except SkipDocument:
+                self.log.debug('Indexing for object `%s` skipped', obj)
+                continue
+            rows.append(self._row(doc))
+        with self.db as db:
+            db.executemany('DELETE FROM documents WHERE id = ?',
+                           [row[:1] for row in rows])
+            db.executemany(
+                'INSERT INTO documents (id, django_ct, django_id, boost,'
+                ' data, text, name, title) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                rows)
+
+    def _row(self, doc):
+        """Return the `documents` row for a prepared document."""
+        data = {key: value for key, value in doc.items()
+                if key not in (ID, DJANGO_CT, DJANGO_ID, 'boost') + COLUMNS}
+        return ((doc[ID], doc[DJANGO_CT], str(doc[DJANGO_ID]),
+                 float(doc.get('boost', 1.0)),
+                 json.dumps(data, default=str))
+                + tuple(_text(doc.get(column)) for column in COLUMNS))
+
+    def remove(self, obj_or_string, commit=True):
+        with self.db as db:
+            db.execute('DELETE FROM documents WHERE id = ?',
+                       (get_identifier(obj_or_string),))
+
+    def clear(self, models=None, commit=True):
+        with self.db as db:
+            if not models:
+                db.execute('DELETE FROM documents')
+            else:
+                model_cts = [get_model_ct(model) for model in models]
+                db.execute('DELETE FROM documents WHERE django_ct IN (%s)'
+                           % ', '.join('?' * len(model_cts)), model_cts)
+
+    @log_query
+    def search(self, query_string, sort_by=None, start_offset=0,
+               end_offset=None, highlight=False, models=None,
+               limit_to_registered_models=None, result_class=None,
+               exact_values=None, **kwargs):
+        if not query_string:
+            return {'results': [], 'hits': 0}
+
+        if limit_to_registered_models is None:
+            limit_to_registered_models = getattr(
+                settings, 'HAYSTACK_LIMIT_TO_REGISTERED_MODELS', True)
+        if models:
+            model_cts = sorted(get_model_ct(model) for model in models)
+        elif limit_to_registered_models:
+            model_cts = self.build_models_list()
+        else:
+            model_cts = []
+
+        where = []
+        params = []
+        if query_string == '*':
+            tables = 'documents d'
+            rank = '-d.boost'
+            snippet = 'NULL'
+        else:
+            tables = ('documents_fts f JOIN documents d'
+                      ' ON (d.docid = f.rowid)')
+            where.append('documents_fts MATCH ?')
+            params.append(query_string)
+            rank = 'bm25(documents_fts, %s) * d.boost' % ', '.join(
+                map(str, COLUMN_WEIGHTS))
+            snippet = ("snippet(documents_fts, 0, '<em>', '</em>', '...', %d)"
+                       % SNIPPET_TOKENS)
+        if model_cts:
+            where.append('d.django_ct IN (%s)'
+                         % ', '.join('?' * len(model_cts)))
+            params.extend(model_cts)
+        where = ' WHERE ' + ' AND '.join(where) if where else ''
+
+        order_by = [self._order_by(field) for field in sort_by or ()]
+        order_params = []
+        if exact_values:
+            order_by.append('(%s) DESC' % ' OR '.join(
+                'lower(d.%s) = ?' % column for column, value in exact_values))
+            order_params.extend(value for column, value in exact_values)
+        order_by.append('rank')
+        limit = -1 if end_offset is None else end_offset - start_offset
+
+        try:
+            hits = self.db.execute('SELECT count(*) FROM %s%s'
+                                   % (tables, where), params).fetchone()[0]
+            rows = self.db.execute(
+                'SELECT d.django_ct, d.django_id, %s AS rank, %s, d.data,'
+                ' d.text, d.name, d.title FROM %s%s ORDER BY %s'
+                ' LIMIT ? OFFSET ?' % (rank, snippet, tables, where,
+                                       ', '.join(order_by)),
+                params + order_params + [limit, start_offset]).fetchall()
+        except sqlite3.Error as e:
+            if not self.silently_fail:
+                raise SearchBackendError(
+                    'Failed to query the SQLite index using %r: %s'
+                    % (query_string, e))
+            self.log.error('Failed to query the SQLite index using %r: %s',
+                           query_string, e, exc_info=True)
+            return {'results': [], 'hits': 0}
+
+        return {
+            'results': self._process_results(rows, highlight, result_class),
+            'hits': hits,
+            }
+
+    def _order_by(self, field):
+        """Return the SQL to sort by a field, like "-title"."""
+        descending = field.startswith('-')
+        field = field.lstrip('-')
+        if field in COLUMNS:
+            sql = 'd.%s' % field
+        elif re.match(r'^\w+$', field):
+            sql = "json_extract(d.data, '$.%s')" % field
+        else:
+            raise SearchBackendError('Cannot sort by %r' % field)
+        return sql + (' DESC' if descending else '')
+
+    def _process_results(self, rows, highlight, result_class):
+        """Return SearchResult objects for rows of a search."""
+        from haystack import connections
+        unified_index = connections[self.connection_alias].get_unified_index()
+        indexed_models = unified_index.get_indexed_models()
+        result_class = result_class or SearchResult
+
+        results = []
+        for django_ct, django_id, rank, snippet, data, *columns in rows:
+            app_label, model_name = django_ct.split('.')
+            model = haystack_get_model(app_label, model_name)
+            if not model or model not in indexed_models:
+                continue
+            index = unified_index.get_index(model)
+
+            fields = json.loads(data)
+            fields.update((column, value) for column, value
+                          in zip(COLUMNS, columns) if value is not None)
+            for key, value in fields.items():
+                field = index.fields.get(key)
+                if field is not None and hasattr(field, 'convert'):
+                    fields[key] = field.convert(value)
+            if highlight and snippet is not None:
+                fields['highlighted'] = {'text': [snippet]}
+
+            results.append(result_class(app_label, model_name, django_id,
+                                        -rank, **fields))
+        return results
+
+
+class SQLiteSearchQuery(BaseSearchQuery):
+    """Turns Haystack queries into FTS5 query strings."""
+
+    def build_query(self):
+        # Term boosts are not supported.  And FTS5 has only a binary
+        # NOT, which follows what it excludes instead of an AND.
+        self.exact_values = []
+        final_query = self.query_filter.as_query_string(
+            self.build_query_fragment)
+        if not final_query:
+            return self.matching_all_fragment()
+        return final_query.replace(' AND NOT (', ' NOT (')
+
+    def build_params(self, *args, **kwargs):
+        kwargs = super(SQLiteSearchQuery, self).build_params(*args, **kwargs)
+        if getattr(self, 'exact_values', None):
+            kwargs['exact_values'] = self.exact_values
+        return kwargs
+
+    def build_query_fragment(self, field, filter_type, value):
+        from haystack import connections
+
+        if not hasattr(value, 'input_type_name'):
+            if isinstance(value, str):
+                value = Clean(value)
+            else:
+                value = PythonData(value)
+        prepared = value.prepare(self)
+        if value.input_type_name == 'raw':
+            return prepared
+
+        if field == 'content':
+            field = connections[self._using].get_unified_index() \
+                .document_field
+        if field not in COLUMNS:
+            raise SearchBackendError(
+                'The SQLite search backend cannot search the %r field'
+                % field)
+
+        prepared = str(prepared)
+        if filter_type == 'exact':
+            expression = _phrase(prepared)
+            self.exact_values.append((field, prepared.lower()))
+        elif filter_type == 'startswith':
+            expression = _phrase(prepared) + '*'
+        elif filter_type in ('content', 'contains'):
+            positives = []
+            negatives = []
+            for negated, phrase, word in _query_token.findall(prepared):
+                if negated:
+                    negatives.append(_phrase(negated))
+                else:
+                    positives.append(_phrase(phrase or word))
+            expression = ' AND '.join(positives) or '""'
+            if negatives:
+                expression += ' NOT ' + ' NOT '.join(negatives)
+        else:
+            raise SearchBackendError(
+                'The SQLite search backend does not support %r filters'
+                % filter_type)
+        return '%s : (%s)' % (field, expression)
+
+
+class SQLiteEngine(BaseEngine):
+    backend = SQLiteSearchBackend
+    query = SQLiteSearchQuery
+
+
+def _phrase(text):
+    """Return an FTS5 string that matches the words of `text` in order;
+    one with no words matches nothing."""
+    return '"%s"' % ' '.join(_word.findall(text))
+
+
+def _text(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return ' '.join(str(item) for item in value)
+    return str(value)
@@ -1,16 +1,29 @@
+import os
 import requests
+import shutil
+import tempfile
 import unittest
+from io import StringIO
 
 from django.conf import settings
+from django.core.management import call_command
 from django.test.client import Client
 from django.test.testcases import TestCase
+from django.test.utils import override_settings
 
 from lxml import etree
 from lxml.cssselect import CSSSelector
 
+from haystack import connections
+from haystack.query import SearchQuerySet
 from haystack.utils import Highlighter
 
+from gobotany.core.models import (Character, CharacterGroup,
+    CharacterValue, Family, Genus, Taxon, TaxonCharacterValue)
+from . import queue
 from .highlight import ExtendedHighlighter
+from .models import PendingIndexUpdate
+from .search_indexes import CharacterCharField
 
 # To run all search tests:
 #
@@ -277,5 +290,192 @@ class ExtendedHighlighterTestCase(HaystackHighlighterTestCase):
         self.assertEqual(expected, highlighter.highlight(text))
 
 
+class SQLiteBackendTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        connections_info = {'default': {
+            'ENGINE': 'gobotany.search.sqlite_backend.SQLiteEngine',
+            'PATH': os.path.join(self.directory, 'search.sqlite3'),
+            }}
+        self.settings_override = override_settings(
+            HAYSTACK_CONNECTIONS=connections_info)
+        self.settings_override.enable()
+        self.connections_info = connections.connections_info
+        connections.connections_info = connections_info
+        connections.reload('default')
+
+        family = Family.objects.create(name='Sapindaceae',
+                                       common_name='soapberry family')
+        genus = Genus.objects.create(name='Acer', family=family,
+                                     common_name='maples')
+        Taxon.objects.create(scientific_name='Acer rubrum', family=family,
+                             genus=genus)
+        Taxon.objects.create(scientific_name='Acer saccharum',
+                             family=family, genus=genus)
+        # Other plants, so that "acer" is a rare enough word to count.
+        family = Family.objects.create(name='Betulaceae',
+                                       common_name='birch family')
+        for genus_name, epithets in [('Alnus', ['incana', 'serrulata']),
+                                     ('Betula', ['alleghaniensis', 'lenta',
+                                                 'papyrifera', 'populifolia']),
+                                     ('Carpinus', ['caroliniana'])]:
+            genus = Genus.objects.create(name=genus_name, family=family)
+            for epithet in epithets:
+                Taxon.objects.create(
+                    scientific_name='%s %s' % (genus_name, epithet),
+                    family=family, genus=genus)
+        queue.process_queue()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        connections.connections_info = self.connections_info
+        connections.reload('default')
+        shutil.rmtree(self.directory)
+
+    def names(self, queryset):
+        return [result.name for result in queryset]
+
+    def test_search_by_phrase(self):
+        self.assertEqual(
+            self.names(SearchQuerySet().auto_query('"acer rubrum"')),
+            ['Acer rubrum', 'Acer'])
+
+    def test_search_by_stemmed_word(self):
+        self.assertEqual(
+            self.names(SearchQuerySet().auto_query('maple')), ['Acer'])
+
+    def test_search_excluding_a_word(self):
+        # The genus goes too, because its text lists Acer rubrum.
+        self.assertEqual(
+            self.names(SearchQuerySet().auto_query('acer -rubrum')),
+            ['Acer saccharum', 'Sapindaceae'])
+
+    def test_boost(self):
+        # Both documents say "saccharum" once, but species are boosted.
+        self.assertEqual(
+            self.names(SearchQuerySet().auto_query('saccharum')),
+            ['Acer saccharum', 'Acer'])
+
+    def test_exact_name_comes_first(self):
+        results = SearchQuerySet().auto_query('acer')
+        self.assertEqual(self.names(results)[0], 'Acer rubrum')
+        results = results.filter_or(name__exact='acer')
+        self.assertEqual(self.names(results),
+                         ['Acer', 'Acer rubrum', 'Acer saccharum',
+                          'Sapindaceae'])
+
+    def test_exact_name_keeps_its_punctuation(self):
+        query = SearchQuerySet().filter_or(
+            name__exact='Plymouth Rose-gentian').query
+        query.build_query()
+        self.assertEqual(query.exact_values,
+                         [('name', 'plymouth rose-gentian')])
+
+    def test_highlight(self):
+        results = SearchQuerySet().auto_query('maples').highlight()
+        self.assertIn('<em>maples</em>', results[0].highlighted['text'][0])
+
+    def test_count_and_slice(self):
+        results = SearchQuerySet().auto_query('acer')
+        self.assertEqual(results.count(), 4)
+        self.assertEqual(self.names(results[1:3]),
+                         self.names(results)[1:3])
+
+    def test_remove(self):
+        connections['default'].get_backend().remove(
+            Taxon.objects.get(scientific_name='Acer rubrum'))
+        self.assertEqual(
+            self.names(SearchQuerySet().auto_query('rubrum')), ['Acer'])
+
+    def test_saves_are_queued(self):
+        genus = Genus.objects.get(name='Acer')
+        for common_name in 'box elders', 'sycamores':
+            genus.common_name = common_name
+            genus.save()
+        self.assertEqual(PendingIndexUpdate.objects.count(), 2)
+        self.assertEqual(
+            self.names(SearchQuerySet().auto_query('sycamore')), [])
+        self.assertEqual(queue.process_queue(), (1, 0))
+        self.assertEqual(PendingIndexUpdate.objects.count(), 0)
+        self.assertEqual(
+            self.names(SearchQuerySet().auto_query('sycamore')), ['Acer'])
+
+    def test_deletes_are_queued(self):
+        Taxon.objects.get(scientific_name='Acer rubrum').delete()
+        self.assertEqual(queue.process_queue(), (0, 1))
+        # The genus still lists it, until it is saved again.
+        self.assertEqual(
+            self.names(SearchQuerySet().auto_query('rubrum')), ['Acer'])
+
+    def test_unindexed_saves_are_not_queued(self):
+        CharacterGroup.objects.create(name='habitat')
+        self.assertEqual(PendingIndexUpdate.objects.count(), 0)
+        self.assertEqual(queue.process_queue(), (0, 0))
+
+    def test_process_search_queue(self):
+        genus = Genus.objects.get(name='Acer')
+        genus.common_name = 'sycamores'
+        genus.save()
+        output = StringIO()
+        call_command('process_search_queue', stdout=output)
+        self.assertIn('Updated 1 and removed 0 documents',
+                      output.getvalue())
+        self.assertEqual(
+            self.names(SearchQuerySet().auto_query('sycamore')), ['Acer'])
+
+    def test_rebuild_search_index(self):
+        connections['default'].get_backend().clear()
+        output = StringIO()
+        call_command('rebuild_search_index', processes=1, batch_size=3,
+                     post_size=4, stdout=output)
+        self.assertIn('core.Taxon                    9 documents',
+                      output.getvalue())
+        self.assertEqual(SearchQuerySet().models(Taxon).count(), 9)
+        self.assertEqual(
+            self.names(SearchQuerySet().auto_query('saccharum')),
+            ['Acer saccharum', 'Acer'])
+
+    def test_rebuild_search_index_of_one_model(self):
+        Genus.objects.filter(name='Acer').update(common_name='sycamores')
+        call_command('rebuild_search_index', 'core.genus', processes=1,
+                     stdout=StringIO())
+        self.assertEqual(
+            self.names(SearchQuerySet().auto_query('sycamore')), ['Acer'])
+        self.assertEqual(SearchQuerySet().models(Taxon).count(), 9)
+
+    def test_taxon_index_prefetches_character_values(self):
+        group = CharacterGroup.objects.create(name='habitat')
+        habitat = Character.objects.create(
+            short_name='habitat', name='Habitat', friendly_name='Habitat',
+            character_group=group, value_type='TEXT')
+        taxon = Taxon.objects.get(scientific_name='Acer rubrum')
+        for value_str in 'wetlands', 'forests':
+            TaxonCharacterValue.objects.create(
+                taxon=taxon, character_value=CharacterValue.objects.create(
+                    character=habitat, value_str=value_str))
+
+        index = connections['default'].get_unified_index().get_index(Taxon)
+        taxon = index.index_queryset().get(scientific_name='Acer rubrum')
+        with self.assertNumQueries(0):
+            habitats = [value.value_str for value in taxon.get_habitats()]
+            value = CharacterCharField('habitat').lookup_character_value(
+                taxon)
+        self.assertEqual(habitats, ['forests', 'wetlands'])
+        self.assertIn(value, habitats)
+
+        taxon = Taxon.objects.get(scientific_name='Acer rubrum')
+        self.assertEqual(
+            [value.value_str for value in taxon.get_habitats()], habitats)
+
+    def test_search_page(self):
+        response = self.client.get('/search/?q=acer')
+        content = response.content
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(content.index(b'<a href="/genus/acer/">'),
+                        content.index(b'<a href="/species/acer/rubrum/">'))
+        self.assertIn(b'<span class="highlighted">Acer</span>', content)
+
+
 if __name__ == '__main__':
     unittest.main()
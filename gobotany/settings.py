@@ -196,7 +196,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = (
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.middleware.gzip.GZipMiddleware',
+    'gobotany.middleware.GZipMiddleware',
 
     ) + (('debug_toolbar.middleware.DebugToolbarMiddleware',)
          if USE_DEBUG_TOOLBAR else ()) + (
@@ -236,6 +236,12 @@ USE_I18N = False
 TIME_ZONE = 'America/New_York'
 USE_TZ = True
 
+# Where the search box and plant name picker look up suggestions as the
+# user types: 'memory' keeps an index of them in each web process, and
+# 'database' shares indexed lookups in the database among all processes
+# (see gobotany.site.suggestions).
+SUGGESTION_BACKEND = os.environ.get('GOBOTANY_SUGGESTION_BACKEND', 'memory')
+
 # For django-haystack
 HAYSTACK_CONNECTIONS = {
     'default': {
@@ -248,10 +254,21 @@ HAYSTACK_CONNECTIONS = {
     },
 }
 HAYSTACK_SEARCH_RESULTS_PER_PAGE = 10
-HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.RealtimeSignalProcessor'
+# Saves are queued for the search index, and applied by a worker running
+# "process_search_queue --interval 10" (see gobotany.search.queue).
+HAYSTACK_SIGNAL_PROCESSOR = 'gobotany.search.queue.QueuedSignalProcessor'
 # For when we are running on Heroku:
 if 'WEBSOLR_URL' in os.environ:
     HAYSTACK_CONNECTIONS['default']['URL'] = os.environ['WEBSOLR_URL']
+# For running without Solr, from an SQLite full-text index instead (see
+# gobotany.search.sqlite_backend):
+if os.environ.get('GOBOTANY_SEARCH_BACKEND') == 'sqlite':
+    HAYSTACK_CONNECTIONS['default'] = {
+        'ENGINE': 'gobotany.search.sqlite_backend.SQLiteEngine',
+        'PATH': os.environ.get('GOBOTANY_SEARCH_PATH',
+                               os.path.join(THIS_DIRECTORY, 'search.sqlite3')),
+        'BATCH_SIZE': 1000,
+    }
 
 # For django-facebook-connect
 FACEBOOK_LOGIN_REDIRECT = '/plantshare/'
@@ -0,0 +1,72 @@
+import sys
+
+from django.conf import settings
+from django.db import DatabaseError, migrations, models, transaction
+
+TRIGRAM_INDEXES = [
+    ('site_searchsuggestion_term_trgm', 'site_searchsuggestion', 'term'),
+    ('site_plantnamesuggestion_name_trgm', 'site_plantnamesuggestion',
+     'name'),
+    ]
+
+NO_TRIGRAMS_MESSAGE = """
+Cannot create the PostgreSQL extension pg_trgm: %s
+Suggestions will be looked up through the site_suggestionkey table
+instead of trigram indexes.  To use trigram indexes, have a superuser
+run "CREATE EXTENSION pg_trgm" in this database, and then migrate the
+"site" app back to 0009 and forward again.
+"""
+
+
+def add_trigram_indexes(apps, schema_editor):
+    """On PostgreSQL, let the suggestion regular expressions use an index.
+
+    This is only done where SUGGESTION_BACKEND is 'database', and is
+    skipped, with a message, if the pg_trgm extension cannot be created;
+    either way, the lookups use the SuggestionKey table instead.
+
+    """
+    connection = schema_editor.connection
+    if (connection.vendor != 'postgresql'
+            or settings.SUGGESTION_BACKEND != 'database'):
+        return
+    try:
+        with transaction.atomic(using=connection.alias):
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except DatabaseError as e:
+        sys.stderr.write(NO_TRIGRAMS_MESSAGE % str(e).strip())
+        return
+    for index, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            'CREATE INDEX %s ON %s USING gin (%s gin_trgm_ops)'
+            % (index, table, column))
+
+
+def remove_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for index, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS %s' % index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('site', '0009_alter_document_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SuggestionKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=10)),
+                ('key', models.CharField(max_length=3)),
+                ('suggestion_id', models.IntegerField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['source', 'key', 'suggestion_id'], name='site_sugges_source_96fc4b_idx')],
+            },
+        ),
+        migrations.RunPython(add_trigram_indexes, remove_trigram_indexes),
+    ]
@@ -34,6 +34,38 @@ class SearchSuggestion(models.Model):
         super(SearchSuggestion, self).save(*args, **kw)
 
 
+class SuggestionKey(models.Model):
+    """A pair of characters in a suggestion, for looking up suggestions
+    in the database without a scan (see gobotany.site.suggestions).
+
+    Keys that begin with "^" hold the first one or two characters of a
+    suggestion; the rest are the pairs of adjacent characters anywhere
+    in it, lowercased.
+    """
+    source = models.CharField(max_length=10)  # 'search' or 'plant_name'
+    key = models.CharField(max_length=3)
+    suggestion_id = models.IntegerField()
+
+    class Meta:
+        indexes = [models.Index(fields=['source', 'key', 'suggestion_id'])]
+
+    def __str__(self):
+        return '%s %s %s' % (self.source, self.key, self.suggestion_id)
+
+
+@receiver(models.signals.post_save, sender=PlantNameSuggestion)
+@receiver(models.signals.post_save, sender=SearchSuggestion)
+def update_suggestion_keys(sender, instance, **kwargs):
+    from gobotany.site import suggestions
+    suggestions.update_keys(instance)
+
+@receiver(models.signals.post_delete, sender=PlantNameSuggestion)
+@receiver(models.signals.post_delete, sender=SearchSuggestion)
+def remove_suggestion_keys(sender, instance, **kwargs):
+    from gobotany.site import suggestions
+    suggestions.update_keys(instance, deleted=True)
+
+
 # As with screened images elsewhere, storage location for documents
 # depends on environment: use file system for local development, but
 # S3 for Production and similar (Dev) environments.
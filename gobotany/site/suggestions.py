@@ -0,0 +1,370 @@
+"""Suggest search terms and plant names as the user types.
+
+Each keystroke in a search box or plant name picker asks for the
+suggestions that match what has been typed so far.  The match is the
+typo-tolerant regular expression of `gobotany.site.utils.query_regex()`,
+which no database index can help with, so instead each table of
+suggestions is kept in memory in a `SuggestionIndex`.
+
+The index numbers the suggestions in the order in which the database
+sorts them - by its collation, rather than in Python's codepoint order,
+which would put every capitalized name first - and keeps, for every
+character and every pair of adjacent characters that occurs in them,
+the set of suggestions that contain it, along with the set of those
+that start with it.  The pairs of characters a query requires - each
+longer word must begin with its first letter and end with its last
+letter, which the typo-tolerant expression leaves fixed, and each short
+word must appear as typed - narrow the suggestions down to a few
+candidates, which are then checked against the full expression in order
+until enough have been found.
+
+The indexes are built the first time they are asked for, and then kept
+for the life of the process, until the "botany" `DataVersion` is
+bumped.
+
+Where many web processes should not each keep their own indexes, the
+SUGGESTION_BACKEND setting can say 'database' instead of 'memory', and
+a `DatabaseIndex` will look suggestions up with indexed queries: the
+regular expressions as they stand on PostgreSQL, whose `pg_trgm`
+trigram indexes can serve them, and elsewhere the same pairs of
+characters as above, kept in the `SuggestionKey` table.  (Migration
+site 0010 adds the trigram indexes only if the setting already says
+'database', and the pg_trgm extension can be created; without them,
+PostgreSQL uses the `SuggestionKey` table, too.)  The keys are only
+kept up to date while they are in use, so after switching a site to
+'database', build them with the `rebuild_suggestion_keys` command.
+
+"""
+import re
+from collections import defaultdict
+from itertools import compress, filterfalse, islice
+
+from django.conf import settings
+from django.db import connection, transaction
+
+import bulkup
+from gobotany.core import models as core_models
+from gobotany.site.models import (PlantNameSuggestion, SearchSuggestion,
+    SuggestionKey)
+from gobotany.site.utils import query_regex
+
+MAX_RESULTS = 10
+
+SOURCES = {
+    'search': (SearchSuggestion, 'term'),
+    'plant_name': (PlantNameSuggestion, 'name'),
+    }
+
+_indexes = {}  # source name -> (data version, SuggestionIndex)
+_trigram_indexes = {}  # database alias -> whether it has trigram indexes
+_bit_values = bytes.maketrans(b'01', b'\x00\x01')
+
+
+class SuggestionIndex(object):
+    """A list of suggestions, and which of them contain what.
+
+    Suggestion number i is ``terms[i]``; the terms are kept in the order
+    given, which is the order in which they are suggested.  The sets of suggestions are
+    kept as Python integers in which bit i stands for suggestion i, so
+    that intersecting them is a single ``&``.
+
+    """
+    def __init__(self, terms):
+        self.terms = list(terms)
+        size = len(self.terms) // 8 + 1
+        grams = defaultdict(lambda: bytearray(size))
+        starts = defaultdict(lambda: bytearray(size))
+        for i, term in enumerate(self.terms):
+            byte, bit = i >> 3, 1 << (i & 7)
+            lowered = term.lower()
+            for gram in set(lowered).union(
+                    lowered[j:j + 2] for j in range(len(lowered) - 1)):
+                grams[gram][byte] |= bit
+            for gram in {lowered[:1], lowered[:2]}:
+                if gram:
+                    starts[gram][byte] |= bit
+
+        self.everything = (1 << len(self.terms)) - 1
+        self.grams = {gram: int.from_bytes(bits, 'little')
+                      for gram, bits in grams.items()}
+        self.starts = {gram: int.from_bytes(bits, 'little')
+                       for gram, bits in starts.items()}
+
+    def __len__(self):
+        return len(self.terms)
+
+    def candidates(self, query, at_start):
+        """Return the set of suggestions that could match a query."""
+        bits = self.everything
+        words = query.split()
+        for word in words:
+            for choices in _required_grams(word):
+                bits &= self.any_of(self.grams, choices)
+        if at_start and words:
+            for choices in _required_grams(words[0])[:1]:
+                bits &= self.any_of(self.starts, choices)
+        return bits
+
+    def any_of(self, bitsets, grams):
+        """Return the suggestions that have at least one of `grams`."""
+        bits = 0
+        for gram in grams:
+            bits |= bitsets.get(gram, 0)
+        return bits
+
+    def matches(self, query, at_start=True, limit=None):
+        """Return an iterator over the suggestions that match a query.
+
+        With `at_start`, these are the suggestions that match at their
+        start; otherwise, those that match somewhere but not at the
+        start; either way, in order, and at most `limit` of them.  The
+        query should already be cleaned up.
+
+        """
+        try:
+            pattern = re.compile(query_regex(query), re.IGNORECASE)
+        except re.error:
+            return iter(())
+        # Walk the candidates without a Python loop.
+        bits = self.candidates(query, at_start)
+        selectors = bin(bits)[:1:-1].encode('ascii').translate(_bit_values)
+        candidates = compress(self.terms, selectors)
+        return _checked(pattern, candidates, at_start, limit)
+
+
+class DatabaseIndex(object):
+    """Suggestions looked up in the database, with the same `matches()`
+    as a `SuggestionIndex`."""
+
+    def __init__(self, source):
+        self.source = source
+        self.model, self.field = SOURCES[source]
+
+    def matches(self, query, at_start=True, limit=None):
+        """Return an iterator over the suggestions that match a query."""
+        regex = query_regex(query)
+        try:
+            pattern = re.compile(regex, re.IGNORECASE)
+        except re.error:
+            return iter(())
+        if not _uses_trigram_index():
+            candidates = self.candidates(query, at_start)
+            return _checked(pattern, candidates, at_start, limit)
+
+        lookup = self.field + '__iregex'
+        queryset = self.model.objects.filter(**{lookup: '^' + regex})
+        if not at_start:
+            queryset = self.model.objects.filter(**{lookup: regex}).exclude(
+                **{lookup: '^' + regex})
+        queryset = queryset.order_by(self.field).values_list(
+            self.field, flat=True)
+        return iter(queryset[:limit])
+
+    def candidates(self, query, at_start):
+        """Yield, in order, the suggestions that have the keys that a
+        query is looked up by, which it requires."""
+        # Each choice of keys costs a scan of every row with any of
+        # them, so rather than intersecting them all, we take only the
+        # start keys and the choice among the fewest keys, and leave the
+        # rest to the regular expression.  Single characters are only
+        # kept as keys at the start.
+        words = query.split()
+        choices = [grams for word in words for grams in _required_grams(word)
+                   if all(len(gram) > 1 for gram in grams)]
+        choices = sorted(choices, key=len)[:1]
+        if at_start and words:
+            choices.extend(['^' + gram[:2] for gram in grams]
+                           for grams in _required_grams(words[0])[:1])
+
+        column = connection.ops.quote_name(
+            self.model._meta.get_field(self.field).column)
+        sql = 'SELECT %s FROM %s' % (column, self.model._meta.db_table)
+        params = []
+        if choices:
+            sql += ' WHERE id IN (%s)' % ' INTERSECT '.join(
+                'SELECT suggestion_id FROM site_suggestionkey'
+                ' WHERE source = %%s AND key IN (%s)'
+                % ', '.join(['%s'] * len(grams)) for grams in choices)
+            for grams in choices:
+                params.append(self.source)
+                params.extend(grams)
+        sql += ' ORDER BY %s' % column
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(100)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row[0]
+
+
+def _checked(pattern, candidates, at_start, limit):
+    """Return an iterator over the candidates that match `pattern` at
+    their start, or elsewhere but not at their start; `match()` is the
+    one that is anchored at the start of the string."""
+    if at_start:
+        found = filter(pattern.match, candidates)
+    else:
+        found = filter(pattern.search, filterfalse(pattern.match, candidates))
+    return islice(found, limit)
+
+
+def _required_grams(word):
+    """Return what any text matching `word` must contain.
+
+    The result is a tuple of choices, each a list of strings of which
+    the text must contain at least one.  A word longer than two
+    characters becomes, in `query_regex()`, its first letter, then
+    letters from among its interior ones (or an apostrophe), then its
+    last letter; so the text must contain its first letter followed by
+    one of those, and one of those followed by its last letter.  A
+    shorter word is used as it stands, which is literal unless it
+    contains characters special to regular expressions.
+
+    """
+    if len(word) > 2:
+        first, interior, last = word[0], set(word[1:-1] + "'"), word[-1]
+        return ([first + c for c in interior | {last}],
+                [c + last for c in interior | {first}])
+    if re.escape(word) == word:
+        return ([word],)
+    return ()
+
+
+def build_index(source):
+    """Read a table of suggestions into a new `SuggestionIndex`."""
+    model, field = SOURCES[source]
+    return SuggestionIndex(
+        model.objects.order_by(field).values_list(field, flat=True))
+
+
+def get_index(source):
+    """Return the `SuggestionIndex` of 'search' or 'plant_name'
+    suggestions, building it if the data has changed since it was
+    last built."""
+    version = core_models.DataVersion.objects.current()
+    entry = _indexes.get(source)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    index = build_index(source)
+    _indexes[source] = (version, index)
+    return index
+
+
+def reset():
+    """Forget the indexes, so that the next `get_index()` rebuilds them."""
+    _indexes.clear()
+
+
+def get_backend(source):
+    """Return what the SUGGESTION_BACKEND setting says to look up the
+    'search' or 'plant_name' suggestions with."""
+    if settings.SUGGESTION_BACKEND == 'database':
+        return DatabaseIndex(source)
+    return get_index(source)
+
+
+def _uses_trigram_index():
+    """Return whether the database has the trigram indexes of both
+    suggestion tables, which only PostgreSQL can have."""
+    if connection.vendor != 'postgresql':
+        return False
+    found = _trigram_indexes.get(connection.alias)
+    if found is None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT count(*) FROM pg_indexes WHERE indexname IN (%s, %s)',
+                ['site_searchsuggestion_term_trgm',
+                 'site_plantnamesuggestion_name_trgm'])
+            found = _trigram_indexes[connection.alias] = (
+                cursor.fetchone()[0] == 2)
+    return found
+
+
+def suggestion_keys(text):
+    """Return the `SuggestionKey` keys of a suggestion."""
+    lowered = text.lower()
+    keys = {lowered[j:j + 2] for j in range(len(lowered) - 1)}
+    keys.update('^' + lowered[:n] for n in (1, 2) if len(lowered) >= n)
+    return keys
+
+
+def _keys_in_use():
+    """Return whether suggestions are looked up by `SuggestionKey`."""
+    return (settings.SUGGESTION_BACKEND == 'database'
+            and not _uses_trigram_index())
+
+
+def rebuild_keys(source, force=False):
+    """Replace all the `SuggestionKey` rows of 'search' or 'plant_name'
+    suggestions; needed after suggestions are imported in bulk.  Unless
+    `force` is given, this does nothing where the keys are not used."""
+    if not (force or _keys_in_use()):
+        return
+    model, field = SOURCES[source]
+    db = bulkup.Database(connection)
+    table = db.table('site_suggestionkey')
+    for suggestion_id, text in model.objects.values_list('id', field):
+        for key in suggestion_keys(text):
+            table.get(source=source, key=key, suggestion_id=suggestion_id)
+    with transaction.atomic(), connection.cursor() as cursor:
+        # (Not a queryset delete(), which fetches every row first.)
+        cursor.execute('DELETE FROM site_suggestionkey WHERE source = %s',
+                       [source])
+        table.save()
+
+
+def update_keys(suggestion, deleted=False):
+    """Replace the `SuggestionKey` rows of a suggestion that has just
+    been saved, or delete them if it has been deleted."""
+    if not _keys_in_use():
+        return
+    for source, (model, field) in SOURCES.items():
+        if isinstance(suggestion, model):
+            break
+    SuggestionKey.objects.filter(
+        source=source, suggestion_id=suggestion.id).delete()
+    if not deleted:
+        SuggestionKey.objects.bulk_create(
+            SuggestionKey(source=source, key=key,
+                          suggestion_id=suggestion.id)
+            for key in suggestion_keys(getattr(suggestion, field)))
+
+
+def search_suggestions(query):
+    """Return the search terms to suggest for a cleaned-up query.
+
+    Terms that match at their start come first, and then, if there is
+    room, terms that match elsewhere; each group is lowercased,
+    de-duplicated, and sorted, and the query itself is left out.
+
+    """
+    index = get_backend('search')
+    terms = islice((term for term in index.matches(
+        query, limit=MAX_RESULTS * 2 + 1) if term != query), MAX_RESULTS * 2)
+    suggestions = sorted(set(term.lower() for term in terms))[:MAX_RESULTS]
+    remaining_slots = MAX_RESULTS - len(suggestions)
+    if remaining_slots > 0:
+        terms = index.matches(query, at_start=False, limit=MAX_RESULTS * 2)
+        suggestions.extend(sorted(set(term.lower() for term in terms))
+                           [:remaining_slots])
+    return suggestions
+
+
+def plant_name_suggestions(query):
+    """Return the plant names to suggest for a cleaned-up query.
+
+    Names that match at their start come first, and then, if there is
+    room, names that match elsewhere; the query itself is left out.
+
+    """
+    index = get_backend('plant_name')
+    suggestions = list(islice((name for name in index.matches(
+        query, limit=MAX_RESULTS + 1) if name != query), MAX_RESULTS))
+    remaining_slots = MAX_RESULTS - len(suggestions)
+    if remaining_slots > 0:
+        suggestions.extend(index.matches(query, at_start=False,
+                                         limit=remaining_slots))
+    return suggestions
@@ -7,7 +7,7 @@ from datetime import datetime
 
 from django.conf import settings
 from django.contrib.auth.models import Group, User
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.test.client import Client
 from django.utils import timezone
 
@@ -16,7 +16,9 @@ from gobotany.dkey import models as dkey_models
 from gobotany.plantshare import models as plantshare_models
 from gobotany.search import models as search_models
 from gobotany.site import models as site_models
+from gobotany.site import suggestions
 from gobotany.site.templatetags import gobotany_tags
+from gobotany.site.utils import query_regex
 
 TEST_USERNAME = 'test'
 TEST_EMAIL = 'test@test.com'
@@ -134,6 +136,7 @@ def _setup_sample_data():
 
 # Tests for PlantShare plant name picker API call
 
+@override_settings(SUGGESTION_BACKEND='memory')
 class PlantNameSuggestionsTests(TestCase):
     MAX_NAMES = 20
 
@@ -142,6 +145,9 @@ class PlantNameSuggestionsTests(TestCase):
         _setup_sample_data()
         cls.client = Client()
 
+    def setUp(self):
+        suggestions.reset()
+
     def half_max_names(self):
         return int(math.floor(self.MAX_NAMES / 2))
 
@@ -154,6 +160,12 @@ class PlantNameSuggestionsTests(TestCase):
         self.assertEqual('application/json; charset=utf-8',
                          response['Content-Type'])
 
+    def test_index_keeps_names_in_database_order(self):
+        self.assertEqual(
+            suggestions.build_index('plant_name').terms,
+            list(site_models.PlantNameSuggestion.objects.order_by(
+                'name').values_list('name', flat=True)))
+
     def test_returns_names_in_expected_format(self):
         response = self.client.get('/plant-name-suggestions/?q=a')
         names = json.loads(response.content)
@@ -205,6 +217,149 @@ class PlantNameSuggestionsTests(TestCase):
         self.assertEqual(names, expected_names)
 
 
+    def test_returns_names_matching_elsewhere_after_those_at_start(self):
+        response = self.client.get('/plant-name-suggestions/?q=rubr')
+        names = json.loads(response.content)
+        self.assertEqual(names, ['Acer rubrum', 'Actaea rubra'])
+
+    def test_leaves_out_the_query_itself(self):
+        response = self.client.get('/plant-name-suggestions/?q=red%20maple')
+        names = json.loads(response.content)
+        self.assertEqual(names, [])
+
+
+@override_settings(SUGGESTION_BACKEND='memory')
+class SearchSuggestionsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for term in ['maple', 'red maple', 'silver maple', 'sugar maple',
+                     'maples of new england', 'mapleleaf viburnum',
+                     'acer rubrum', 'acer saccharum', 'ma']:
+            site_models.SearchSuggestion(term=term).save()
+
+    def setUp(self):
+        suggestions.reset()
+
+    def suggest(self, query):
+        response = self.client.get('/search-suggestions/', {'q': query})
+        self.assertEqual('application/json; charset=utf-8',
+                         response['Content-Type'])
+        return json.loads(response.content)
+
+    def test_matches_at_start_come_before_others(self):
+        self.assertEqual(self.suggest('maple'), [
+            'mapleleaf viburnum', 'maples of new england',
+            'red maple', 'silver maple', 'sugar maple'])
+
+    def test_tolerates_typos(self):
+        self.assertEqual(self.suggest('acer rbu'), ['acer rubrum'])
+        self.assertEqual(self.suggest('mxple'), [])
+        self.assertEqual(self.suggest('mapel'), [
+            'maple', 'mapleleaf viburnum', 'maples of new england',
+            'red maple', 'silver maple', 'sugar maple'])
+
+    def test_short_words_match_literally(self):
+        self.assertEqual(self.suggest('m'), [
+            'ma', 'maple', 'mapleleaf viburnum', 'maples of new england',
+            'acer rubrum', 'acer saccharum', 'red maple', 'silver maple',
+            'sugar maple'])
+
+    def test_leaves_out_the_query_itself(self):
+        self.assertEqual(self.suggest('acer rubrum'), [])
+
+    def test_empty_query_returns_nothing(self):
+        self.assertEqual(self.suggest(''), [])
+        self.assertEqual(self.suggest('?'), [])
+
+    def test_invalid_regular_expression_returns_nothing(self):
+        self.assertEqual(self.suggest('+'), [])
+
+    def test_index_is_rebuilt_when_data_version_changes(self):
+        self.assertEqual(self.suggest('viburnum'), ['mapleleaf viburnum'])
+        site_models.SearchSuggestion(term='viburnum dentatum').save()
+        self.assertEqual(self.suggest('viburnum'), ['mapleleaf viburnum'])
+        core_models.DataVersion.objects.bump()
+        self.assertEqual(self.suggest('viburnum'),
+                         ['viburnum dentatum', 'mapleleaf viburnum'])
+
+
+@override_settings(SUGGESTION_BACKEND='database')
+class DatabasePlantNameSuggestionsTests(PlantNameSuggestionsTests):
+    pass
+
+
+@override_settings(SUGGESTION_BACKEND='database')
+class DatabaseSearchSuggestionsTests(SearchSuggestionsTests):
+
+    def test_index_is_rebuilt_when_data_version_changes(self):
+        # There is no index to rebuild: new suggestions show at once.
+        site_models.SearchSuggestion(term='viburnum dentatum').save()
+        self.assertEqual(self.suggest('viburnum'),
+                         ['viburnum dentatum', 'mapleleaf viburnum'])
+
+    def test_matches_agree_with_memory_index(self):
+        database = suggestions.DatabaseIndex('search')
+        memory = suggestions.get_index('search')
+        for query in ['m', 'ma', 'mpale', 'maple', 'maple v', 'r', 'acer',
+                      'acer r', 'e', 'x', 'a.', 'ne']:
+            for at_start in True, False:
+                self.assertEqual(list(database.matches(query, at_start)),
+                                 list(memory.matches(query, at_start)),
+                                 (query, at_start))
+
+    def test_keys_follow_edits_and_deletes(self):
+        suggestion = site_models.SearchSuggestion.objects.get(
+            term='red maple')
+        suggestion.term = 'red oak'
+        suggestion.save()
+        self.assertEqual(self.suggest('red'), ['red oak'])
+        self.assertEqual(self.suggest('red m'), [])
+        suggestion_id = suggestion.id
+        suggestion.delete()
+        self.assertEqual(self.suggest('red'), [])
+        self.assertFalse(site_models.SuggestionKey.objects.filter(
+            suggestion_id=suggestion_id).exists())
+
+    def test_rebuild_keys(self):
+        if suggestions._uses_trigram_index():
+            self.skipTest('suggestions are looked up by trigram indexes')
+        site_models.SuggestionKey.objects.all().delete()
+        self.assertEqual(self.suggest('viburnum'), [])
+        suggestions.rebuild_keys('search')
+        self.assertEqual(self.suggest('viburnum'), ['mapleleaf viburnum'])
+
+    def test_keys_are_not_kept_for_the_memory_backend(self):
+        site_models.SuggestionKey.objects.all().delete()
+        with self.settings(SUGGESTION_BACKEND='memory'):
+            site_models.SearchSuggestion(term='viburnum dentatum').save()
+            suggestions.rebuild_keys('search')
+        self.assertFalse(site_models.SuggestionKey.objects.exists())
+
+
+class SuggestionIndexTests(unittest.TestCase):
+    TERMS = ['Acer rubrum', 'Acer saccharum', 'acer rubrum', 'Actaea rubra',
+             'red maple', "Bebb's willow", 'Plymouth rose-gentian',
+             'rose', 'Rosa', 'a', '']
+
+    def test_matches_agree_with_scanning_every_term(self):
+        index = suggestions.SuggestionIndex(self.TERMS)
+        for query in ['a', 'ac', 'acer', 'acre rub', 'r', 'ro', 'rose',
+                      'rsoe', 'bebbs', "bebb's w", 'e', 'pylmouth r',
+                      'x', 'a r', 'ma', 'a.', 'e-g']:
+            regex = query_regex(query)
+            at_start = re.compile('^' + regex, re.IGNORECASE)
+            anywhere = re.compile(regex, re.IGNORECASE)
+            terms = self.TERMS
+            self.assertEqual(
+                list(index.matches(query)),
+                [term for term in terms if at_start.search(term)], query)
+            self.assertEqual(
+                list(index.matches(query, at_start=False)),
+                [term for term in terms if anywhere.search(term)
+                 and not at_start.search(term)], query)
+
+
 class RobotsTests(TestCase):
 
     def test_robots_returns_ok(self):
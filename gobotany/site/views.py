@@ -16,9 +16,9 @@ from django.template import RequestContext
 from django.urls import reverse_lazy
 from django.views.decorators.vary import vary_on_headers
 
-from gobotany.core import botany
+from gobotany.core import botany, distributions
 from gobotany.core.models import (
-    CommonName, ContentImage, CopyrightHolder, Distribution,
+    CommonName, ContentImage, CopyrightHolder,
     Family, Genus, GlossaryTerm, HomePageImage, PartnerSite,
     PartnerSpecies, Pile, Taxon, Video,
     )
@@ -26,9 +26,9 @@ from gobotany.core.partner import (which_partner, partner_short_name,
                                    per_partner_template, render_per_partner)
 from gobotany.plantoftheday.models import PlantOfTheDay
 from gobotany.simplekey.groups_order import ordered_pilegroups, ordered_piles
-from gobotany.site.models import (Document, Highlight, PlantNameSuggestion,
-    SearchSuggestion, Update)
-from gobotany.site.utils import query_regex
+from gobotany.site.models import Document, Highlight, Update
+from gobotany.site.suggestions import (plant_name_suggestions,
+    search_suggestions)
 
 # Home page
 
@@ -237,46 +237,12 @@ def clean_input_string(input_string):
 
 def search_suggestions_view(request):
     """Return some search suggestions for search."""
-    MAX_RESULTS = 10
     query = request.GET.get('q', '').lower()
     query = clean_input_string(query)
 
     suggestions = []
     if query != '':
-        regex = query_regex(query)
-
-        # Make a variation for checking at the start of the string.
-        regex_at_start = '^%s' % regex
-
-        # First look for suggestions that match at the start of the
-        # query string.
-
-        # This query is case-sensitive for better speed than using a
-        # case-insensitive query. The database field is also case-
-        # sensitive, so it is important that all SearchSuggestion
-        # records be lowercased before import to ensure that they
-        # can be reached.
-        suggestions = list(SearchSuggestion.objects.filter(
-            term__iregex=regex_at_start).exclude(term=query).
-            order_by('term').values_list('term', flat=True)
-            [:MAX_RESULTS * 2])   # Fetch extra to handle case-sensitive dups
-        # Remove any duplicates due to case-sensitivity and pare down to
-        # the desired number of results.
-        suggestions = list(sorted(set([suggestion.lower()
-            for suggestion in suggestions])))[:MAX_RESULTS]
-
-        # If fewer than the maximum number of suggestions were found,
-        # try finding some additional ones that match anywhere in the
-        # query string.
-        remaining_slots = MAX_RESULTS - len(suggestions)
-        if remaining_slots > 0:
-            more_suggestions = list(SearchSuggestion.objects.filter(
-                term__iregex=regex).exclude(term__iregex=regex_at_start).
-                order_by('term').values_list('term', flat=True)
-                [:MAX_RESULTS * 2])
-            more_suggestions = list(sorted(set([suggestion.lower()
-                for suggestion in  more_suggestions])))[:remaining_slots]
-            suggestions.extend(more_suggestions)
+        suggestions = search_suggestions(query)
 
     return HttpResponse(json.dumps(suggestions),
         content_type='application/json; charset=utf-8')
@@ -285,33 +251,12 @@ def search_suggestions_view(request):
 
 def plant_name_suggestions_view(request):
     """Return some suggestions for plant name input."""
-    MAX_RESULTS = 10
     query = request.GET.get('q', '').lower()
     query = clean_input_string(query)
 
     suggestions = []
     if query != '':
-        regex = query_regex(query)
-
-        # Make a variation for checking at the start of the string.
-        regex_at_start = '^%s' % regex
-
-        # First look for suggestions that match at the start of the
-        # query string.
-        suggestions = list(PlantNameSuggestion.objects.filter(
-            name__iregex=regex_at_start).exclude(name=query).
-            order_by('name').values_list('name', flat=True)[:MAX_RESULTS])
-
-        # If fewer than the maximum number of suggestions were found,
-        # try finding some additional ones that match anywhere in the
-        # query string.
-        remaining_slots = MAX_RESULTS - len(suggestions)
-        if remaining_slots > 0:
-            more_suggestions = list(PlantNameSuggestion.objects.filter(
-                name__iregex=regex).exclude(name__iregex=regex_at_start).
-                order_by('name').values_list('name', flat=True)[:MAX_RESULTS])
-            more_suggestions = list(more_suggestions)[:remaining_slots]
-            suggestions.extend(more_suggestions)
+        suggestions = plant_name_suggestions(query)
 
     return HttpResponse(json.dumps(suggestions),
         content_type='application/json; charset=utf-8')
@@ -453,13 +398,12 @@ def species_list_view(request):
         'id', 'scientific_name')
     sci_names = list(set([name for id, name in t]))
     states = [state.upper() for state in list(settings.STATE_NAMES.keys())]
-    d = Distribution.objects.filter(present=True).filter(
-        county__exact='').filter(state__in=states).filter(
-        species_name__in=sci_names).values_list('species_name', 'state')
+    present_states = distributions.get_store().present_states(
+        sci_names, states)
     ids_by_name = {name: id for id, name in t}
-    for scientific_name, state in d:
+    for scientific_name, states_present in present_states.items():
         taxon_id = ids_by_name[scientific_name]
-        plantmap[taxon_id]['states'].add(state)
+        plantmap[taxon_id]['states'].update(states_present)
 
     q = Pile.species.through.objects.values_list(
         'taxon_id', 'pile__friendly_title', 'pile__pilegroup__friendly_title',
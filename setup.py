@@ -20,6 +20,7 @@ requirements = [
     'django-tinymce==4.1.0',
     'inflect',
     'lxml==5.3.0',
+    'orjson==3.8.3',   # faster API encoding; see gobotany/api/encoding.py
     'psycopg2==2.9.2',
     'python-memcached',
     'pytz',
@@ -44,8 +45,7 @@ requirements = [
 
     # For storing images on S3.
 
-    'boto==2.49.0',   # for bin/s3imagecheck.py
-    'boto3==1.35.0',   # has replaced boto in the Django app
+    'boto3==1.35.0',
     'django-storages==1.13.1',
     'requests',
 
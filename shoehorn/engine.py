@@ -4,6 +4,8 @@ nil = object()  # need another object
 end = object()  # end-of-iteration marker
 endpair = (end, end)
 
+BATCH_SIZE = 1000  # changes per batch yielded by `DifferenceEngine.batches()`
+
 
 def _keys_and_items(sequence, indices):
     """Yield ``(key, item)`` pairs where the key is built from `indices`.
@@ -12,7 +14,7 @@ def _keys_and_items(sequence, indices):
 
     """
     for item in sequence:
-        key = map(item.__getitem__, indices)
+        key = tuple(item[index] for index in indices)
         yield key, item
 
 
@@ -20,7 +22,8 @@ def pairs(sequence1, sequence2, indices):
     """Yield matched and unmatched items from two sequences.
 
     Both `sequence1` and `sequence2` should already by sorted by
-    `indices`.
+    `indices`.  Either can be any iterable, like a database cursor, since
+    each is read only once and one item at a time.
 
     For each item in the sequences, a key will be generated by pulling
     the given `indices` from the item.  If your sequence items are lists
@@ -54,10 +57,26 @@ def pairs(sequence1, sequence2, indices):
 
     while item1 is not end:
         yield (item1, None)
-        key1, item1 = next(iter1)
+        key1, item1 = next(iter1, endpair)
     while item2 is not end:
         yield (None, item2)
-        key2, item2 = next(iter2)
+        key2, item2 = next(iter2, endpair)
+
+
+def changes(have, want, indices):
+    """Yield each change that turns `have` into `want`, as it is found.
+
+    The changes are ``('insert', item)``, ``('update', (old, new))``,
+    and ``('delete', item)`` tuples.
+
+    """
+    for h, w in pairs(have, want, indices):
+        if h is None:
+            yield 'insert', w
+        elif w is None:
+            yield 'delete', h
+        elif h != w:
+            yield 'update', (h, w)
 
 
 class DifferenceEngine(object):
@@ -68,10 +87,30 @@ class DifferenceEngine(object):
         self.deletes = []
 
     def differentiate(self, have, want, indices):
-        for h, w in pairs(have, want, indices):
-            if h is None:
-                self.inserts.append(w)
-            elif w is None:
-                self.deletes.append(h)
-            elif h != w:
-                self.updates.append((h, w))
+        """Add every change between `have` and `want` to our lists."""
+        lists = {'insert': self.inserts, 'update': self.updates,
+                 'delete': self.deletes}
+        for kind, change in changes(have, want, indices):
+            lists[kind].append(change)
+
+    def batches(self, have, want, indices, size=BATCH_SIZE):
+        """Yield the changes between `have` and `want` in batches.
+
+        Each batch is an ``(inserts, updates, deletes)`` tuple of lists
+        holding at most `size` changes in all, so that two sorted
+        streams of any length - like two database cursors - can be
+        compared in memory bounded by `size`.  Our own lists are not
+        touched.
+
+        """
+        batch = {'insert': [], 'update': [], 'delete': []}
+        count = 0
+        for kind, change in changes(have, want, indices):
+            batch[kind].append(change)
+            count += 1
+            if count >= size:
+                yield batch['insert'], batch['update'], batch['delete']
+                batch = {'insert': [], 'update': [], 'delete': []}
+                count = 0
+        if count:
+            yield batch['insert'], batch['update'], batch['delete']
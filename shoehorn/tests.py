@@ -42,3 +42,15 @@ class Tests(TestCase):
         self.assertEqual(e.updates, [])
         self.assertEqual(e.deletes, [['King George III'], ['Adams'],
                                      ['Madison']])
+
+    def test_batches(self):
+        e = DifferenceEngine()
+        seq1 = [['Adams', 1], ['Jefferson', 2], ['Madison', 3]]
+        seq2 = [['Adams', 1], ['Jefferson', 3], ['Monroe', 5],
+                ['Washington', 1]]
+        batches = list(e.batches(iter(seq1), iter(seq2), [0], size=2))
+        self.assertEqual(batches, [
+            ([], [(['Jefferson', 2], ['Jefferson', 3])], [['Madison', 3]]),
+            ([['Monroe', 5], ['Washington', 1]], [], []),
+            ])
+        self.assertEqual(e.inserts, [])